@@ -0,0 +1,136 @@
+# Copyright 2015 Ryan Brown <sb@ryansb.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import logging
+import threading
+import time
+
+log = logging.getLogger(__name__)
+
+
+class Acker(object):
+    """
+    Collects acknowledged job IDs and sends them to Disque as a single
+    multi-ID FASTACK (or ACKJOB, with fast=False) once ``max_batch`` IDs are
+    waiting or the oldest waiting ID is ``max_delay_secs`` old, whichever
+    comes first. Anything still waiting is flushed when the acker is closed.
+
+    Example:
+
+    >>> with client.acker(max_batch=500, max_delay_secs=0.05) as acker:
+    ...     for job in jobs:
+    ...         handle(job)
+    ...         acker.ack(job[1])
+
+    If a flush fails, ``on_error(job_ids, exception)`` is called from the
+    flushing thread. Without an ``on_error`` callback, or if the callback
+    raises too, the failure is logged.
+    Either way the IDs are dropped, and Disque will redeliver those jobs once
+    their retry time is up.
+    """
+    def __init__(self, client, fast=True, max_batch=100, max_delay_secs=0.1,
+                 on_error=None):
+        if max_batch < 1:
+            raise ValueError("max_batch must be >= 1")
+        if max_delay_secs <= 0:
+            raise ValueError("max_delay_secs must be > 0")
+        self._command = client.fastack if fast else client.ackjob
+        self.max_batch = max_batch
+        self.max_delay_secs = max_delay_secs
+        self.on_error = on_error
+
+        self._pending = []
+        self._oldest = None
+        self._closed = False
+        self._cond = threading.Condition()
+
+        self._thread = threading.Thread(target=self._run,
+                                        name='disq-acker')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __len__(self):
+        return len(self._pending)
+
+    def ack(self, *jobs):
+        "Queue one or more job IDs to be acknowledged"
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("Can't ack jobs after close()")
+            if not self._pending:
+                # wake the flushing thread so it starts the delay timer
+                self._oldest = time.time()
+                self._cond.notify()
+            self._pending.extend(jobs)
+            if len(self._pending) >= self.max_batch:
+                self._cond.notify()
+
+    def flush(self):
+        "Acknowledge every waiting job ID right now"
+        with self._cond:
+            batch = self._take()
+        self._send(batch)
+
+    def close(self):
+        "Flush waiting job IDs and stop the background thread"
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+        self._thread.join()
+
+    def _take(self):
+        batch, self._pending, self._oldest = self._pending, [], None
+        return batch
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._closed:
+                    if len(self._pending) >= self.max_batch:
+                        break
+                    if self._pending:
+                        remaining = (self._oldest + self.max_delay_secs -
+                                     time.time())
+                        if remaining <= 0:
+                            break
+                        self._cond.wait(remaining)
+                    else:
+                        self._cond.wait()
+                batch = self._take()
+                closed = self._closed
+            self._send(batch)
+            if closed:
+                return
+
+    def _send(self, batch):
+        for i in range(0, len(batch), self.max_batch):
+            ids = batch[i:i + self.max_batch]
+            # anything raised here would kill the flushing thread, e.g. an
+            # OSError from deleting a blob, or an error from on_error
+            try:
+                self._command(*ids)
+            except Exception as e:
+                if self.on_error is None:
+                    log.exception("Failed to acknowledge %d jobs", len(ids))
+                    continue
+                try:
+                    self.on_error(ids, e)
+                except Exception:
+                    log.exception("on_error failed for %d jobs", len(ids))
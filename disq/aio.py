@@ -0,0 +1,556 @@
+# Copyright 2015 Ryan Brown <sb@ryansb.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+asyncio Disque client. Requires Python 3.5 or later.
+
+    >>> client = AsyncDisque(port=7711)
+    >>> job_id = await client.addjob('queue', 'body')
+    >>> job = await client.getjob('queue')
+
+AsyncDisque has the same command methods as DisqueAlpha, but every one of
+them returns an awaitable.
+"""
+
+import asyncio
+import itertools
+import time
+
+from redis.connection import BaseParser, Token
+from redis.exceptions import ConnectionError, ResponseError, TimeoutError
+
+from disq.client import DisqueAlpha, DisqueError
+from disq.parsers import bin_to_str
+
+
+class AsyncConnection(object):
+    "A single connection to a Disque node, built on asyncio streams"
+
+    description_format = "AsyncConnection<host=%(host)s,port=%(port)s>"
+
+    def __init__(self, host='localhost', port=7711, password=None,
+                 socket_timeout=None, socket_connect_timeout=None,
+                 path=None, encoding='utf-8', encoding_errors='strict',
+                 decode_responses=False, retry_on_timeout=False):
+        self.host = bin_to_str(host) if isinstance(host, bytes) else host
+        self.port = int(port)
+        self.path = path
+        self.password = password
+        self.socket_timeout = socket_timeout
+        self.socket_connect_timeout = socket_connect_timeout or socket_timeout
+        self.encoding = encoding
+        self.encoding_errors = encoding_errors
+        self.decode_responses = decode_responses
+        self.retry_on_timeout = retry_on_timeout
+        self._parser = BaseParser()
+        self._reader = None
+        self._writer = None
+
+    def __repr__(self):
+        return self.description_format % {'host': self.host,
+                                          'port': self.port}
+
+    async def connect(self):
+        "Connects to the Disque node if not already connected"
+        if self._writer is not None:
+            return
+        if self.path is not None:
+            fut = asyncio.open_unix_connection(self.path)
+        else:
+            fut = asyncio.open_connection(self.host, self.port)
+        try:
+            self._reader, self._writer = await asyncio.wait_for(
+                fut, self.socket_connect_timeout)
+        except asyncio.TimeoutError:
+            raise TimeoutError("Timeout connecting to server")
+        except OSError as e:
+            raise ConnectionError("Error connecting to %s:%s. %s." %
+                                  (self.host, self.port, e))
+
+        if self.password:
+            try:
+                await self.send_command('AUTH', self.password)
+                await self.read_response()
+            except Exception:
+                self.disconnect()
+                raise
+
+    def disconnect(self):
+        "Disconnects from the Disque node"
+        if self._writer is None:
+            return
+        try:
+            self._writer.close()
+        except Exception:
+            pass
+        self._reader = self._writer = None
+
+    def encode(self, value):
+        "Return a bytestring representation of the value"
+        if isinstance(value, Token):
+            value = value.value
+        if isinstance(value, (bytes, bytearray)):
+            return value
+        elif isinstance(value, memoryview):
+            # sent without copying, as a flat view of bytes
+            return value.cast('B')
+        elif isinstance(value, int):
+            value = str(value)
+        elif isinstance(value, float):
+            value = repr(value)
+        elif not isinstance(value, str):
+            value = str(value)
+        return value.encode(self.encoding, self.encoding_errors)
+
+    def pack_command(self, *args):
+        "Pack a series of arguments into the Redis protocol"
+        args = tuple(args[0].split()) + args[1:]
+        output = [b'*' + str(len(args)).encode() + b'\r\n']
+        for arg in map(self.encode, args):
+            output.append(b'$' + str(len(arg)).encode() + b'\r\n')
+            output.append(arg)
+            output.append(b'\r\n')
+        return output
+
+    async def send_packed_command(self, command):
+        "Send an already packed command to the Disque node"
+        await self.connect()
+        try:
+            self._writer.writelines(command)
+            await self._with_timeout(self._writer.drain())
+        except OSError as e:
+            self.disconnect()
+            raise ConnectionError("Error while writing to socket. %s." % e)
+        except BaseException:
+            self.disconnect()
+            raise
+
+    async def send_command(self, *args):
+        "Pack and send a command to the Disque node"
+        await self.send_packed_command(self.pack_command(*args))
+
+    async def read_response(self):
+        "Read the response from a previously sent command"
+        try:
+            response = await self._with_timeout(self._read())
+        except BaseException:
+            self.disconnect()
+            raise
+        if isinstance(response, ResponseError):
+            raise response
+        return response
+
+    async def _with_timeout(self, fut):
+        try:
+            return await asyncio.wait_for(fut, self.socket_timeout)
+        except asyncio.TimeoutError:
+            raise TimeoutError("Timeout reading from socket")
+
+    async def _read(self):
+        try:
+            line = await self._reader.readline()
+        except OSError as e:
+            raise ConnectionError("Error while reading from socket: %s" % e)
+        if not line.endswith(b'\r\n'):
+            raise ConnectionError("Socket closed on remote end")
+
+        byte, response = line[:1], line[1:-2]
+        if byte == b'-':
+            return self._parser.parse_error(response.decode())
+        elif byte == b'+':
+            pass
+        elif byte == b':':
+            return int(response)
+        elif byte == b'$':
+            length = int(response)
+            if length == -1:
+                return None
+            try:
+                response = (await self._reader.readexactly(length + 2))[:-2]
+            except asyncio.IncompleteReadError:
+                raise ConnectionError("Socket closed on remote end")
+        elif byte == b'*':
+            length = int(response)
+            if length == -1:
+                return None
+            response = []
+            for _ in range(length):
+                response.append((await self._read()))
+            return response
+        else:
+            raise ConnectionError("Protocol Error: %r" % line)
+
+        if self.decode_responses:
+            response = response.decode(self.encoding, self.encoding_errors)
+        return response
+
+
+class AsyncConnectionPool(object):
+    "A pool of AsyncConnections to a single Disque node"
+
+    def __init__(self, connection_class=AsyncConnection, max_connections=None,
+                 **connection_kwargs):
+        self.connection_class = connection_class
+        self.connection_kwargs = connection_kwargs
+        self.max_connections = max_connections or 2 ** 31
+        self._created_connections = 0
+        self._available_connections = []
+        self._in_use_connections = set()
+
+    def __repr__(self):
+        return "%s<%s>" % (
+            type(self).__name__,
+            self.connection_class.description_format % {
+                'host': self.connection_kwargs.get('host'),
+                'port': self.connection_kwargs.get('port')},
+        )
+
+    async def get_connection(self, command_name, **options):
+        "Get a connected connection from the pool"
+        try:
+            connection = self._available_connections.pop()
+        except IndexError:
+            connection = self.make_connection()
+        self._in_use_connections.add(connection)
+        try:
+            await connection.connect()
+        except BaseException:
+            self.release(connection)
+            raise
+        return connection
+
+    def make_connection(self):
+        "Create a new connection"
+        if self._created_connections >= self.max_connections:
+            raise ConnectionError("Too many connections")
+        self._created_connections += 1
+        return self.connection_class(**self.connection_kwargs)
+
+    def release(self, connection):
+        "Releases the connection back to the pool"
+        self._in_use_connections.remove(connection)
+        self._available_connections.append(connection)
+
+    def disconnect(self):
+        "Disconnects all connections in the pool"
+        for connection in itertools.chain(self._available_connections,
+                                          self._in_use_connections):
+            connection.disconnect()
+
+
+class AsyncDisque(DisqueAlpha):
+    """
+    asyncio counterpart to DisqueAlpha.
+
+    Creating the client does no I/O: the HELLO that discovers the rest of
+    the cluster is sent by ``connect()``, or by the first command if
+    ``connect()`` wasn't awaited first. Node selection, including job-origin
+    tracking with ``record_job_origin=True``, works the same way as in
+    DisqueAlpha.
+    """
+
+    def __init__(self, host='localhost', port=7711,
+                 password=None, socket_timeout=None,
+                 socket_connect_timeout=None, connection_pool=None,
+                 unix_socket_path=None, encoding='utf-8',
+                 encoding_errors='strict', decode_responses=False,
+                 retry_on_timeout=False, max_connections=None,
+                 job_origin_ttl_secs=5, record_job_origin=False,
+                 job_objects=False, codec=None, queue_codecs=None,
+                 compression=None, compress_min_size=1024,
+                 blob_store=None, blob_min_size=1024 * 1024,
+                 blob_delete_on_ack=True):
+        if not connection_pool:
+            connection_pool = AsyncConnectionPool(
+                host=host, port=port, password=password,
+                socket_timeout=socket_timeout,
+                socket_connect_timeout=socket_connect_timeout,
+                path=unix_socket_path, encoding=encoding,
+                encoding_errors=encoding_errors,
+                decode_responses=decode_responses,
+                retry_on_timeout=retry_on_timeout,
+                max_connections=max_connections)
+        options = {
+            'job_origin_ttl_secs': job_origin_ttl_secs,
+            'record_job_origin': record_job_origin,
+            'job_objects': job_objects,
+            'codec': codec,
+            'queue_codecs': queue_codecs,
+            'compression': compression,
+            'compress_min_size': compress_min_size,
+            'blob_store': blob_store,
+            'blob_min_size': blob_min_size,
+            'blob_delete_on_ack': blob_delete_on_ack,
+        }
+        # the shared state (codecs, blobs, job-origin counters, node
+        # statistics, topology) is set up the same way as for DisqueAlpha.
+        # lazy=True, since the HELLO is sent by connect().
+        DisqueAlpha.__init__(self, connection_pool=connection_pool,
+                             lazy=True, **options)
+        self._options = options
+        self._connection_kwargs = dict(
+            connection_pool.connection_kwargs,
+            connection_class=connection_pool.connection_class,
+            max_connections=connection_pool.max_connections)
+        # jobs are added on the default node, and read with job-origin
+        # routing only
+        self.producer_routing = None
+        self.read_routing = None
+        # sampling queue lengths would block the event loop
+        self.flow_control = None
+        self._connected = False
+        self._connect_lock = None
+
+    def __setstate__(self, state):
+        pool = AsyncConnectionPool(**state['connection_kwargs'])
+        self.__init__(connection_pool=pool, **state['options'])
+        self.response_callbacks.update(state['response_callbacks'])
+
+    async def connect(self):
+        "Discover the other nodes of the cluster with HELLO"
+        if self._connect_lock is None:
+            # created here rather than in __init__ so that the lock belongs
+            # to the event loop the client is actually used from
+            self._connect_lock = asyncio.Lock()
+        async with self._connect_lock:
+            if self._connected:
+                return
+            await self._refresh_topology()
+            self._connected = True
+
+    async def refresh_topology(self):
+        """
+        Ask the cluster for its current list of nodes with HELLO and update
+        the connection pools to match, as DisqueAlpha.refresh_topology does.
+
+        Returns the new topology, a dict of node -> node information
+        """
+        if not self._connected:
+            await self.connect()
+            return self.topology
+        async with self._connect_lock:
+            return await self._refresh_topology()
+
+    async def _refresh_topology(self):
+        nodes = sorted(self.connection_pool, key=lambda n: (
+            n != self.default_node, self._node_priority(n)))
+        error = None
+        for node in nodes:
+            try:
+                hi = await self._execute_on(node, 'HELLO')
+            except (ConnectionError, TimeoutError) as e:
+                error = e
+                continue
+            old = self.connection_pool
+            self._apply_hello(hi)
+            for n, pool in old.items():
+                if self.connection_pool.get(n) is not pool:
+                    pool.disconnect()
+            return self.topology
+        raise error
+
+    def _make_pool(self, host, port):
+        return AsyncConnectionPool(**dict(self._connection_kwargs, host=host,
+                                          port=port))
+
+    async def warmup(self, connections_per_node=1):
+        """
+        Open ``connections_per_node`` connections to every node in the
+        cluster concurrently, and put them back in their pools. Nodes that
+        can't be reached are skipped.
+
+        Returns a dict of node -> number of connections opened
+        """
+        if not self._connected:
+            await self.connect()
+        pools = self.connection_pool
+
+        async def connect(node):
+            try:
+                return await pools[node].get_connection('PING')
+            except (ConnectionError, TimeoutError):
+                return None
+
+        nodes = [node for node in pools for _ in range(connections_per_node)]
+        connections = await asyncio.gather(*[connect(n) for n in nodes])
+        opened = dict((node, 0) for node in pools)
+        for node, connection in zip(nodes, connections):
+            if connection is not None:
+                pools[node].release(connection)
+                opened[node] += 1
+        return opened
+
+    async def probe_latency(self):
+        """
+        PING every node concurrently to measure its latency, as
+        DisqueAlpha.probe_latency does.
+
+        Returns a dict of node -> average latency in seconds
+        """
+        if not self._connected:
+            await self.connect()
+        await asyncio.gather(*[self._execute_on(node, 'PING')
+                               for node in list(self.connection_pool)],
+                             return_exceptions=True)
+        with self._all_stats_locks():
+            return dict(self._latency)
+
+    def close(self):
+        "Disconnect every pooled connection"
+        for pool in self.connection_pool.values():
+            pool.disconnect()
+
+    async def execute_command(self, *args, _connect=True, **options):
+        "Execute a command and return a parsed response"
+        if _connect and not self._connected:
+            await self.connect()
+        return await self._execute_on(self._get_node(args[0], args), *args,
+                                      **options)
+
+    async def _execute_on(self, node, *args, **options):
+        "Execute a command on a specific node"
+        command_name = args[0]
+        pool = self.connection_pool[node]
+        connection = await pool.get_connection(command_name, **options)
+        elapsed = None
+        self._started(node)
+        try:
+            start = time.time()
+            try:
+                await connection.send_command(*args)
+                response = await self.parse_response(connection, command_name,
+                                                     **options)
+            except (ConnectionError, TimeoutError) as e:
+                connection.disconnect()
+                if not connection.retry_on_timeout and \
+                        isinstance(e, TimeoutError):
+                    raise
+                start = time.time()
+                await connection.send_command(*args)
+                response = await self.parse_response(connection, command_name,
+                                                     **options)
+            if not self._is_blocking(args):
+                elapsed = time.time() - start
+            return response
+        finally:
+            self._finished(node, elapsed=elapsed)
+            pool.release(connection)
+
+    async def parse_response(self, connection, command_name, **options):
+        "Parses a response from the Disque node"
+        response = await connection.read_response()
+        if command_name in self.response_callbacks:
+            return self.response_callbacks[command_name](response, **options)
+        return response
+
+    def pipeline(self):
+        raise NotImplementedError("Pipelines aren't supported by AsyncDisque")
+
+    def acker(self, *args, **kwargs):
+        raise NotImplementedError("Ackers aren't supported by AsyncDisque")
+
+    async def shutdown(self):
+        "Shutdown the server"
+        try:
+            await self.execute_command('SHUTDOWN')
+        except ConnectionError:
+            # a ConnectionError here is expected
+            return
+        raise DisqueError("SHUTDOWN seems to have failed.")
+
+    def addjob(self, queue, body, *args, **kwargs):
+        # ADDJOB's ``async`` argument can't be named in an async def
+        return self._addjob(self._addjob_args(queue, body, *args, **kwargs))
+
+    async def _addjob(self, args):
+        try:
+            return await self.execute_command(*args)
+        except ResponseError:
+            self._rejected(args)
+            raise
+
+    async def addjobs(self, queue, bodies, chunk_size=100, **options):
+        """
+        Add every body in ``bodies`` to ``queue``, sending up to
+        ``chunk_size`` ADDJOBs concurrently. Returns job IDs (or the
+        ResponseError a job failed with) in input order.
+        """
+        return await self.addjobs_with_options(
+            queue, ({'body': body} for body in bodies), chunk_size, **options)
+
+    async def addjobs_with_options(self, queue, jobs, chunk_size=100,
+                                   **options):
+        "Like ``addjobs``, with a dict of ``addjob`` arguments per job"
+        if chunk_size < 1:
+            raise ValueError("chunk_size must be >= 1")
+        results = []
+        jobs = iter(jobs)
+        while True:
+            chunk = list(itertools.islice(jobs, chunk_size))
+            if not chunk:
+                return results
+            calls = []
+            for job in chunk:
+                kwargs = dict(options, queue=queue)
+                kwargs.update(job)
+                calls.append(self.addjob(**kwargs))
+            for r in await asyncio.gather(*calls, return_exceptions=True):
+                if isinstance(r, BaseException) and \
+                        not isinstance(r, ResponseError):
+                    raise r
+                results.append(r)
+
+    def iter_addjobs(self, queue, jobs, chunk_size=100, **options):
+        raise NotImplementedError("Use addjobs_with_options with AsyncDisque")
+
+    async def _execute_jobs(self, command_name, jobs):
+        """
+        Send a command taking job IDs to the nodes that own the jobs,
+        concurrently, and return the sum of the replies
+        """
+        if not self._connected:
+            await self.connect()
+        groups = {}
+        for job in jobs:
+            node = self._get_node(command_name, (command_name, job))
+            groups.setdefault(node, []).append(job)
+        if len(groups) < 2:
+            return await self.execute_command(command_name, *jobs)
+        replies = await asyncio.gather(*[
+            self.execute_command(command_name, *ids)
+            for ids in groups.values()])
+        return sum(replies)
+
+    def _acked(self, jobs, reply):
+        return self._release_blobs(jobs, reply)
+
+    async def _release_blobs(self, jobs, reply):
+        return DisqueAlpha._acked(self, jobs, await reply)
+
+    async def getjob(self, queue, timeout_ms=0, queues=None):
+        """
+        This function returns a 3-element list
+        [queue, job_id, b'body']
+        """
+        return self._first_job(
+            await self._job_cmd(queue, timeout_ms, 1, queues))
+
+    async def qpeek(self, queue, count=1):
+        return self._decode_jobs(
+            await self.execute_command('QPEEK', queue, count))
+
+    async def _job_cmd(self, queue, timeout_ms=0, count=1, queues=None,
+                       nohang=False):
+        jobs = await self.execute_command(
+            *self._getjob_args(queue, timeout_ms, count, queues, nohang))
+        return self._got_jobs(jobs)
@@ -0,0 +1,123 @@
+# Copyright 2015 Ryan Brown <sb@ryansb.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import errno
+import os
+import time
+import uuid
+
+import six
+
+from disq.compression import MAGIC
+
+# job bodies that were moved to a blob store are replaced by REFERENCE and
+# the key of the blob
+REFERENCE = MAGIC + b'@'
+
+
+class BlobStore(object):
+    """
+    Holds large job bodies outside of Disque, which only gets a reference to
+    them. ``put`` stores a body and returns a key, a short string; ``get``
+    returns the body stored under a key, or raises KeyError; ``delete``
+    removes it.
+    """
+    def put(self, data):
+        raise NotImplementedError
+
+    def get(self, key):
+        raise NotImplementedError
+
+    def delete(self, key):
+        raise NotImplementedError
+
+
+class FileBlobStore(BlobStore):
+    """
+    Stores every body in a file under ``path``, which has to be shared by
+    producers and consumers, e.g. a local directory for processes on one
+    host or a network filesystem. ``get`` returns the body as bytes.
+
+    Blobs whose jobs are never acknowledged (or that are fetched by clients
+    that don't delete them) stay behind; ``cleanup()`` removes old ones.
+    """
+    def __init__(self, path):
+        self.path = path
+
+    def _file(self, key):
+        if not key or os.sep in key or key.startswith('.'):
+            raise KeyError(key)
+        return os.path.join(self.path, key[:2], key)
+
+    def put(self, data):
+        if isinstance(data, six.text_type):
+            data = data.encode('utf-8')
+        key = uuid.uuid4().hex
+        filename = self._file(key)
+        try:
+            os.makedirs(os.path.dirname(filename))
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+        # write to a temporary name first, so that a blob is never seen
+        # half written
+        tmp = filename + '.tmp'
+        with open(tmp, 'wb') as f:
+            f.write(data)
+        os.rename(tmp, filename)
+        return key
+
+    def get(self, key):
+        try:
+            with open(self._file(key), 'rb') as f:
+                return f.read()
+        except IOError as e:
+            if e.errno == errno.ENOENT:
+                raise KeyError(key)
+            raise
+
+    def delete(self, key):
+        try:
+            os.unlink(self._file(key))
+        except OSError as e:
+            if e.errno != errno.ENOENT:
+                raise
+
+    def cleanup(self, max_age_secs):
+        "Delete blobs older than ``max_age_secs``. Returns how many were"
+        deleted = 0
+        cutoff = time.time() - max_age_secs
+        for root, _, files in os.walk(self.path):
+            for name in files:
+                filename = os.path.join(root, name)
+                try:
+                    if os.path.getmtime(filename) < cutoff:
+                        os.unlink(filename)
+                        deleted += 1
+                except OSError as e:
+                    if e.errno != errno.ENOENT:
+                        raise
+        return deleted
+
+
+def reference(key):
+    "The job body that refers to the blob stored under ``key``"
+    return REFERENCE + key.encode('ascii')
+
+
+def referenced_key(body):
+    "The key of the blob ``body`` refers to, or None if it isn't a reference"
+    if isinstance(body, six.binary_type) and body.startswith(REFERENCE):
+        return body[len(REFERENCE):].decode('ascii')
+    return None
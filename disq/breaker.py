@@ -0,0 +1,94 @@
+# Copyright 2015 Ryan Brown <sb@ryansb.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import threading
+import time
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half-open'
+
+
+class CircuitBreaker(object):
+    """
+    Keeps track of which nodes are failing, so commands stop being sent to
+    them.
+
+    A node's circuit opens after ``failure_threshold`` connection errors in
+    a row. Once it has been open for ``reset_timeout_secs`` it's half-open:
+    a single caller gets to probe it (see ``acquire_probe``), and the
+    circuit closes again if the probe succeeds, or stays open for another
+    ``reset_timeout_secs`` if it fails. Any success closes the circuit.
+    """
+    def __init__(self, failure_threshold=1, reset_timeout_secs=5):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout_secs = reset_timeout_secs
+        self._lock = threading.Lock()
+        self._failures = {}
+        self._opened = {}
+        self._probing = set()
+
+    def state(self, node):
+        opened = self._opened.get(node)
+        if opened is None:
+            return CLOSED
+        if node in self._probing or \
+                time.time() - opened >= self.reset_timeout_secs:
+            return HALF_OPEN
+        return OPEN
+
+    def acquire_probe(self, node):
+        """
+        Return True if the caller should probe ``node``: its circuit is
+        half-open and nobody else is probing it already. The caller reports
+        the outcome with success() or failure().
+        """
+        with self._lock:
+            opened = self._opened.get(node)
+            if opened is None or node in self._probing or \
+                    time.time() - opened < self.reset_timeout_secs:
+                return False
+            self._probing.add(node)
+            return True
+
+    def success(self, node):
+        if node not in self._failures:
+            return
+        with self._lock:
+            self._failures.pop(node, None)
+            self._opened.pop(node, None)
+            self._probing.discard(node)
+
+    def failure(self, node):
+        with self._lock:
+            failures = self._failures[node] = self._failures.get(node, 0) + 1
+            if node in self._probing or failures >= self.failure_threshold:
+                self._opened[node] = time.time()
+            self._probing.discard(node)
+
+    def open_nodes(self):
+        "The nodes whose circuit is open or half-open"
+        return list(self._opened)
+
+    def reset(self, node=None):
+        "Close the circuit of ``node``, or of every node"
+        with self._lock:
+            if node is None:
+                self._failures.clear()
+                self._opened.clear()
+                self._probing.clear()
+            else:
+                self._failures.pop(node, None)
+                self._opened.pop(node, None)
+                self._probing.discard(node)
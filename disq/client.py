@@ -12,10 +12,18 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import collections
+import contextlib
+import itertools
+import logging
+import os
 import six
+import sys
+import threading
+import time
 
-from redis.connection import (ConnectionPool, UnixDomainSocketConnection,
-                              Token)
+from redis.connection import (ConnectionPool, Connection,
+                              UnixDomainSocketConnection, Token)
 from redis.exceptions import (
     ConnectionError,
     RedisError,
@@ -26,12 +34,32 @@ from redis.exceptions import (
 from redis.client import (dict_merge, string_keys_to_dict, parse_client_list,
                           bool_ok, parse_config_get, parse_info)
 
-from disq.rolling_counter import RollingCounter
+from disq.acker import Acker
+from disq.blobstore import reference, referenced_key
+from disq.breaker import CLOSED, OPEN, CircuitBreaker
+from disq.codec import DecodeError, get_codec
+from disq.compression import MAGIC, compress, decompress, get_compressor
+from disq.flow import QueueFull
+from disq.job import Job
+from disq.connection import (BUFFER_TYPES, DisqueConnection,
+                             DisqueUnixDomainSocketConnection)
+from disq.rolling_counter import KeyedRollingCounter, ShardedRollingCounter
+from disq.routing import get_policy
 from disq.parsers import (bin_to_str, bin_to_int, parse_job_resp,
-                          parse_cluster_nodes, parse_hello, parse_time)
+                          parse_job_resp_raw, parse_cluster_nodes,
+                          parse_hello, parse_time, hello_topology)
+
+log = logging.getLogger(__name__)
 
 DisqueError = RedisError
 
+# bodies that can be moved to a blob store, as for compression: anything
+# else is left for the connection to encode
+_BLOB_TYPES = (six.text_type, six.binary_type) + BUFFER_TYPES
+
+# how many locks the per-node routing stats are striped over
+_STATS_LOCKS = 8
+
 
 class DisqueAlpha(object):
     """
@@ -44,8 +72,6 @@ class DisqueAlpha(object):
     the commands are sent and received to the Redis server
     """
 
-    _job_score = None
-
     RESPONSE_CALLBACKS = dict_merge(
         string_keys_to_dict(
             'GETJOB', parse_job_resp
@@ -87,6 +113,13 @@ class DisqueAlpha(object):
         of conflicting arguments, querystring arguments always win.
         """
         connection_pool = ConnectionPool.from_url(url, **kwargs)
+        # use the connection classes that can send bytearray and memoryview
+        # job bodies, unless another class was asked for
+        if connection_pool.connection_class is Connection:
+            connection_pool.connection_class = DisqueConnection
+        elif connection_pool.connection_class is UnixDomainSocketConnection:
+            connection_pool.connection_class = \
+                DisqueUnixDomainSocketConnection
         return cls(connection_pool=connection_pool)
 
     def __init__(self, host='localhost', port=7711,
@@ -96,13 +129,142 @@ class DisqueAlpha(object):
                  connection_pool=None, unix_socket_path=None,
                  encoding='utf-8', encoding_errors='strict',
                  decode_responses=False, retry_on_timeout=False,
-                 job_origin_ttl_secs=5, record_job_origin=False):
+                 job_origin_ttl_secs=5, record_job_origin=False,
+                 fork_safe=False, topology_refresh_secs=None, lazy=False,
+                 producer_routing=None, read_routing=None,
+                 latency_alpha=0.2, job_origin_max_queues=1000,
+                 raw_jobs=False, job_objects=False, codec=None,
+                 queue_codecs=None, compression=None, compress_min_size=1024,
+                 blob_store=None, blob_min_size=1024 * 1024,
+                 blob_delete_on_ack=True, failover=False,
+                 failure_threshold=3, breaker_reset_secs=5,
+                 retry_deadline_secs=5, hedge_after_secs=None,
+                 hedge_drain_secs=1, flow_control=None):
         """
         job_origin_ttl_secs is the number of seconds to store counts of
         incoming jobs. The higher the throughput you're expecting, the lower
         this number should be.
+
+        With record_job_origin=True, the origin of jobs is also counted per
+        queue, so GETJOB goes to the node the jobs of the queues it reads
+        from have been coming from, or to the node most jobs came from if
+        nothing was received from those queues lately. Counts are kept for
+        up to job_origin_max_queues queues.
+
+        With fork_safe=True, a client that is used in a child process after
+        fork() notices the PID change and opens fresh connections, leaving
+        the sockets it inherited alone for the parent process to keep using.
+
+        The client learns about the cluster's nodes with HELLO when it's
+        created. It sends HELLO again to pick up nodes that joined or left
+        the cluster after a connection error, and every
+        topology_refresh_secs seconds if that is set.
+
+        With lazy=True the client doesn't connect to anything until it's
+        first used, so creating one never blocks. Call warmup() to connect
+        to the cluster ahead of the first command instead.
+
+        ADDJOB goes to the node the client first connected to unless
+        producer_routing is set, to spread jobs over all the healthy nodes in
+        the cluster: one of 'round_robin', 'random', 'least_outstanding' and
+        'sticky' (all the jobs of a queue go to the same node), or a
+        disq.routing.RoutingPolicy instance.
+
+        The round trip time of every command but GETJOB (which may block
+        waiting for jobs) is tracked per node as an exponentially weighted
+        moving average, giving each new measurement a weight of
+        latency_alpha. producer_routing='lowest_latency' sends jobs to the
+        fastest node. read_routing does the same for GETJOB, ACKJOB and
+        FASTACK: 'lowest_latency' ignores where jobs came from, while
+        'job_origin_latency' weighs the job-origin score of
+        record_job_origin against each node's latency.
+
+        With raw_jobs=True, GETJOB returns jobs exactly as the connection
+        read them, with the queue name, job ID and body all left as bytes,
+        so large bodies aren't copied or decoded on the way.
+
+        With job_objects=True, GETJOB returns disq.job.Job objects, which
+        decode their queue name and ID only when they're used and can
+        acknowledge themselves with job.ack() or job.fastack().
+
+        codec encodes job bodies for ADDJOB and decodes them when they're
+        fetched with GETJOB or QPEEK: one of 'json', 'pickle', 'msgpack' and
+        'raw', the name of a codec added with disq.codec.register_codec, or
+        a disq.codec.Codec instance. queue_codecs is a dict of queue name ->
+        codec for queues that don't use the client's codec.
+
+        With compression set to 'zlib', 'lz4', 'zstd' (if those packages are
+        installed) or a disq.compression.Compressor instance, bodies of at
+        least compress_min_size bytes are compressed before they're added.
+        Compressed bodies are marked with a header, and decompressed when
+        they're fetched by any client, whatever its compression setting.
+
+        With a blob_store (see disq.blobstore), bodies of at least
+        blob_min_size bytes are written to the store and only a reference
+        to them is added to Disque. Fetched references are replaced by the
+        stored body, and with blob_delete_on_ack the body is deleted from
+        the store when this client acknowledges the job.
+
+        A command that fails with a connection error is retried once on the
+        same node. With failover=True, if that fails too it's retried on
+        another healthy node, and a node that fails failure_threshold times
+        in a row is left alone for breaker_reset_secs, after which a PING
+        decides whether it gets traffic again (see disq.breaker). Timeouts
+        only fail over with retry_on_timeout, since the command may have
+        gone through. Retries stop once retry_deadline_secs have passed
+        since the command was first sent.
+
+        With hedge_after_secs set, a GETJOB that hasn't returned after that
+        many seconds is also sent, with NOHANG, to the healthy node with the
+        lowest latency. If that node has jobs they're returned, and the
+        original GETJOB's reply is read in the background for up to
+        hedge_drain_secs; any jobs it returns are put back with ENQUEUE.
+
+        flow_control is a disq.flow.FlowController that holds ADDJOB back,
+        or makes it raise disq.flow.QueueFull, while a queue is longer than
+        its high-water mark, until it's back down to its low-water mark.
         """
+        if not 0 < latency_alpha <= 1:
+            raise ValueError("latency_alpha must be between 0 and 1")
         self.record_job_origin = record_job_origin
+        self.fork_safe = fork_safe
+        self.topology_refresh_secs = topology_refresh_secs
+        self.producer_routing = get_policy(producer_routing)
+        self.read_routing = get_policy(read_routing)
+        self.latency_alpha = latency_alpha
+        self.failover = failover
+        self.retry_deadline_secs = retry_deadline_secs
+        self.hedge_after_secs = hedge_after_secs
+        self.hedge_drain_secs = hedge_drain_secs
+        self.flow_control = flow_control
+        self._breaker = CircuitBreaker(failure_threshold, breaker_reset_secs)
+        self._options = {
+            'job_origin_ttl_secs': job_origin_ttl_secs,
+            'job_origin_max_queues': job_origin_max_queues,
+            'raw_jobs': raw_jobs,
+            'job_objects': job_objects,
+            'codec': codec,
+            'queue_codecs': queue_codecs,
+            'compression': compression,
+            'compress_min_size': compress_min_size,
+            'blob_store': blob_store,
+            'blob_min_size': blob_min_size,
+            'blob_delete_on_ack': blob_delete_on_ack,
+            'failover': failover,
+            'failure_threshold': failure_threshold,
+            'breaker_reset_secs': breaker_reset_secs,
+            'retry_deadline_secs': retry_deadline_secs,
+            'hedge_after_secs': hedge_after_secs,
+            'hedge_drain_secs': hedge_drain_secs,
+            'flow_control': flow_control,
+            'record_job_origin': record_job_origin,
+            'fork_safe': fork_safe,
+            'topology_refresh_secs': topology_refresh_secs,
+            'lazy': lazy,
+            'producer_routing': producer_routing,
+            'read_routing': read_routing,
+            'latency_alpha': latency_alpha,
+        }
         kwargs = {
             'password': password,
             'socket_timeout': socket_timeout,
@@ -116,11 +278,12 @@ class DisqueAlpha(object):
         if unix_socket_path is not None:
             kwargs.update({
                 'path': unix_socket_path,
-                'connection_class': UnixDomainSocketConnection
+                'connection_class': DisqueUnixDomainSocketConnection
             })
         else:
             # TCP specific options
             kwargs.update({
+                'connection_class': DisqueConnection,
                 'host': host,
                 'port': port,
                 'socket_connect_timeout': socket_connect_timeout,
@@ -130,25 +293,225 @@ class DisqueAlpha(object):
 
         if not connection_pool:
             connection_pool = ConnectionPool(**kwargs)
+        else:
+            # connect to the rest of the cluster the same way as to the
+            # node we were given
+            kwargs = dict(connection_pool.connection_kwargs,
+                          connection_class=connection_pool.connection_class)
+        self._connection_kwargs = kwargs
 
         self.response_callbacks = self.__class__.RESPONSE_CALLBACKS.copy()
+        self.job_objects = job_objects
+        self.codec = get_codec(codec)
+        self.queue_codecs = dict(
+            (self._queue_name(queue), get_codec(c))
+            for queue, c in six.iteritems(queue_codecs or {}))
+        self.compression = get_compressor(compression)
+        self.compress_min_size = compress_min_size
+        self.blob_store = blob_store
+        self.blob_min_size = blob_min_size
+        self.blob_delete_on_ack = blob_delete_on_ack
+        # job ID -> key of the blob holding its body, for jobs fetched but
+        # not acknowledged yet. The oldest entries are dropped once there
+        # are too many, for jobs that never get acknowledged.
+        self._blob_keys = {}
+        self._blob_order = collections.deque()
+        self._blob_lock = threading.Lock()
+        if raw_jobs or job_objects:
+            self.response_callbacks['GETJOB'] = parse_job_resp_raw
 
         self.connection_pool = {'default': connection_pool}
         self.default_node = 'default'
+        self.topology = {}
+        self._pid = os.getpid()
+        self._topology_stale = False
+        self._topology_lock = threading.Lock()
+        self._next_refresh = None
+        self._healthy_nodes = []
+        self._routed = collections.defaultdict(int)
+        self._outstanding = collections.defaultdict(int)
+        self._latency = {}
+        # the stats are guarded by a few locks, each covering the nodes that
+        # hash to it, so commands to different nodes rarely contend
+        self._stats_locks = [threading.Lock() for _ in range(_STATS_LOCKS)]
+
+        self._job_score = ShardedRollingCounter(ttl_secs=job_origin_ttl_secs)
+        self._queue_score = KeyedRollingCounter(
+            ttl_secs=job_origin_ttl_secs, max_keys=job_origin_max_queues)
+
+        if lazy:
+            # HELLO is sent before the first command
+            self._topology_stale = True
+        else:
+            self.__connect_cluster(kwargs)
+
+    def __connect_cluster(self, connection_kwargs):
+        self._apply_hello(self.hello())
 
-        self._job_score = RollingCounter(ttl_secs=job_origin_ttl_secs)
+    def warmup(self, connections_per_node=1):
+        """
+        Open ``connections_per_node`` connections to every node in the
+        cluster, all at once from one thread per connection, and put them
+        back in their pools. The first commands sent to each node then don't
+        wait on a TCP connect.
 
-        self.__connect_cluster(kwargs)
+        Learns the cluster's topology first if the client hasn't yet, as is
+        the case for a lazy client. Nodes that can't be reached are skipped.
 
-    def __connect_cluster(self, connection_kwargs):
-        hi = self.hello()
+        Returns a dict of node -> number of connections opened
+        """
+        if self._topology_stale:
+            self.refresh_topology()
+        pools = self.connection_pool
+        opened = dict((node, []) for node in pools)
+        lock = threading.Lock()
+
+        def connect(node):
+            connection = pools[node].get_connection('PING')
+            try:
+                connection.connect()
+            except (ConnectionError, TimeoutError):
+                pools[node].release(connection)
+                return
+            with lock:
+                opened[node].append(connection)
+
+        threads = [threading.Thread(target=connect, args=(node,))
+                   for node in pools for _ in range(connections_per_node)]
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        # connections are only released once they are all open, so every
+        # thread got a connection of its own from the pool
+        for node, connections in six.iteritems(opened):
+            for connection in connections:
+                self._release_connection(connection, node)
+        return dict((node, len(c)) for node, c in six.iteritems(opened))
+
+    def refresh_topology(self):
+        """
+        Ask the cluster for its current list of nodes with HELLO and update
+        the connection pools to match: pools are created for nodes that
+        joined and dropped for nodes that left. HELLO is sent to the default
+        node, falling back to the other known nodes if it can't be reached.
 
+        Returns the new topology, a dict of node -> node information
+        """
+        with self._topology_lock:
+            return self._refresh_topology()
+
+    def _refresh_topology(self):
+        # ask nodes known to be failing last
+        failing = self._breaker.open_nodes()
+        nodes = sorted(self.connection_pool, key=lambda n: (
+            n in failing, n != self.default_node, self._node_priority(n)))
+        error = None
+        for node in nodes:
+            try:
+                hi = self._execute_on(node, 'HELLO')
+            except (ConnectionError, TimeoutError) as e:
+                error = e
+                continue
+            self._apply_hello(hi)
+            return self.topology
+        raise error
+
+    def _make_pool(self, host, port):
+        return ConnectionPool(**dict(self._connection_kwargs, host=host,
+                                     port=port))
+
+    def _maybe_refresh_topology(self):
+        # only one thread refreshes at a time, the others carry on with the
+        # topology they already have
+        if not self._topology_lock.acquire(False):
+            return
+        try:
+            self._refresh_topology()
+        except (ConnectionError, TimeoutError):
+            # the command that is about to be sent will report the error
+            pass
+        finally:
+            self._topology_lock.release()
+
+    def _apply_hello(self, hi):
+        topology = hello_topology(hi)
+        pools = {}
+        for node, info in six.iteritems(topology):
+            pool = self.connection_pool.get(node)
+            if pool is None or \
+                    pool.connection_kwargs.get('host') != info['host'] or \
+                    int(pool.connection_kwargs.get('port')) != info['port']:
+                pool = self._make_pool(info['host'], info['port'])
+            pools[node] = pool
+        # swap everything in at once, so other threads see either the old
+        # view of the cluster or the new one. Pools for nodes that left are
+        # dropped, and their connections closed once they're released.
+        self.connection_pool = pools
         self.default_node = bin_to_str(hi['id'][:8])
-        self.connection_pool.pop('default')
-        for node, ip, port, version in hi['nodes']:
-            connection_kwargs.update(dict(host=ip, port=port))
-            self.connection_pool[bin_to_str(node[:8])] = ConnectionPool(
-                **connection_kwargs)
+        self.topology = topology
+        with self._all_stats_locks():
+            latency = dict((node, latency) for node, latency in
+                           six.iteritems(self._latency) if node in pools)
+            if 'default' in self._latency:
+                # the first HELLO was sent before the node's ID was known
+                latency.setdefault(self.default_node,
+                                   self._latency['default'])
+            self._latency = latency
+        if topology:
+            best = min(info['priority'] for info in six.itervalues(topology))
+            self._healthy_nodes = sorted(
+                node for node, info in six.iteritems(topology)
+                if info['priority'] == best)
+        self._topology_stale = False
+        if self.topology_refresh_secs:
+            self._next_refresh = time.time() + self.topology_refresh_secs
+
+    def _node_priority(self, node):
+        info = self.topology.get(node)
+        if info is None:
+            return 1
+        return info['priority']
+
+    def __getstate__(self):
+        # connections can't be pickled, so a pickled client is just the
+        # configuration needed to connect again. Response callbacks are only
+        # included if they were changed with set_response_callback.
+        defaults = self.__class__.RESPONSE_CALLBACKS
+        return {
+            'connection_kwargs': self._connection_kwargs,
+            'options': self._options,
+            'response_callbacks': dict(
+                (k, v) for k, v in six.iteritems(self.response_callbacks)
+                if defaults.get(k) is not v),
+        }
+
+    def __setstate__(self, state):
+        kwargs = dict(state['connection_kwargs'])
+        connection_class = kwargs.pop('connection_class', None)
+        if connection_class is not None:
+            pool = ConnectionPool(connection_class=connection_class, **kwargs)
+        else:
+            pool = ConnectionPool(**kwargs)
+        self.__init__(connection_pool=pool, **state['options'])
+        self.response_callbacks.update(state['response_callbacks'])
+
+    def _check_pid(self):
+        if self._pid == os.getpid():
+            return
+        # this is a forked child. Close our copies of the parent's sockets
+        # without shutting them down (which would break the parent's
+        # connections too) and start over with empty pools
+        for pool in six.itervalues(self.connection_pool):
+            for connection in itertools.chain(pool._available_connections,
+                                              pool._in_use_connections):
+                if connection._sock is not None:
+                    connection._sock.close()
+                    connection._sock = None
+            pool.reset()
+        self._pid = os.getpid()
 
     def __repr__(self):
         return "%s<%s>" % (type(self).__name__, repr(self.connection_pool))
@@ -157,37 +520,362 @@ class DisqueAlpha(object):
         "Set a custom Response Callback"
         self.response_callbacks[command] = callback
 
+    def pipeline(self):
+        """
+        Return a new pipeline object that queues commands and sends them all
+        at once when its ``execute()`` method is called, saving a network
+        round trip per command.
+        """
+        return DisquePipeline(self)
+
+    def acker(self, fast=True, max_batch=100, max_delay_secs=0.1,
+              on_error=None):
+        """
+        Return an Acker that batches job acknowledgements from this client
+        into multi-ID FASTACK (or ACKJOB, if ``fast`` is False) commands.
+        See disq.acker.Acker for details.
+        """
+        return Acker(self, fast=fast, max_batch=max_batch,
+                     max_delay_secs=max_delay_secs, on_error=on_error)
+
     __read_cmds = {'GETJOB': 0, 'ACKJOB': 0, 'FASTACK': 0}
+    __write_cmds = {'ADDJOB': 0}
 
-    def _get_connection(self, command_name, **options):
-        node = self.default_node
-        if self.record_job_origin and command_name in self.__read_cmds:
-            node = self._job_score.max(node)
+    __blocking_cmds = {'GETJOB': 0}
+    __job_cmds = {'ACKJOB': 0, 'FASTACK': 0, 'DELJOB': 0, 'SHOW': 0,
+                  'ENQUEUE': 0, 'DEQUEUE': 0}
 
-        pool = self.connection_pool.get(node)
-        if pool is None:
-            pool = self.connection_pool[self.default_node]
+    def _get_node(self, command_name, args=()):
+        node = self.default_node
+        if command_name in self.__job_cmds and len(args) > 1 and \
+                self._job_owner(args[1]) in self.connection_pool:
+            # the node that created a job is the one that has it for sure
+            node = self._job_owner(args[1])
+        elif command_name in self.__read_cmds:
+            if self.read_routing is not None and self._healthy_nodes:
+                node = self.read_routing.select(self, self._healthy_nodes,
+                                                None)
+            elif self.record_job_origin:
+                local = None
+                if command_name == 'GETJOB':
+                    local = self._queue_score.max(
+                        [self._queue_name(q)
+                         for q in self._getjob_queues(args)])
+                node = local or self._job_score.max(node)
+        elif self.producer_routing is not None and \
+                command_name in self.__write_cmds and self._healthy_nodes:
+            queue = args[1] if len(args) > 1 else None
+            node = self.producer_routing.select(self, self._healthy_nodes,
+                                                queue)
+
+        # don't pick nodes the cluster thinks are failing over the default
+        if node not in self.connection_pool or \
+                self._node_priority(node) > \
+                self._node_priority(self.default_node):
             node = self.default_node
+        return node
+
+    def _is_blocking(self, args):
+        "Whether a command can block, so its round trip isn't its latency"
+        return args[0] in self.__blocking_cmds and not any(
+            isinstance(arg, Token) and arg.value == 'NOHANG' for arg in args)
+
+    @staticmethod
+    def _job_owner(job_id):
+        # the ID of the node that created a job is part of the job's ID
+        # https://github.com/antirez/disque#job-ids
+        owner = job_id[2:10]
+        if isinstance(owner, six.binary_type):
+            owner = owner.decode()
+        return owner
+
+    @staticmethod
+    def _getjob_queues(args):
+        "The queues a GETJOB reads from: the arguments after FROM"
+        for i, arg in enumerate(args):
+            if isinstance(arg, Token) and arg.value == 'FROM':
+                return args[i + 1:]
+        return ()
+
+    @staticmethod
+    def _queue_name(queue):
+        # raw jobs have their queue name as bytes
+        if isinstance(queue, six.binary_type):
+            queue = queue.decode()
+        return queue
+
+    def _execute_jobs(self, command_name, jobs):
+        """
+        Send a command taking job IDs to the nodes that own the jobs,
+        splitting the IDs by owner, and return the sum of the replies
+        """
+        self._prepare()
+        groups = {}
+        for job in jobs:
+            node = self._get_node(command_name, (command_name, job))
+            groups.setdefault(node, []).append(job)
+        if len(groups) < 2:
+            return self.execute_command(command_name, *jobs)
+
+        # send to every node before reading any reply, so that the nodes
+        # work on their share of the jobs at the same time
+        sent = []
+        try:
+            for node, ids in six.iteritems(groups):
+                if self.failover and self._breaker.state(node) != CLOSED:
+                    # sent through _execute_failover below instead
+                    sent.append((node, ids, None, None))
+                    continue
+                connection = self.connection_pool[node].get_connection(
+                    command_name)
+                self._started(node)
+                sent.append((node, ids, connection, time.time()))
+                try:
+                    connection.send_command(command_name, *ids)
+                except (ConnectionError, TimeoutError):
+                    # the reply is read from _execute_on below instead
+                    connection.disconnect()
+
+            total = 0
+            error = None
+            for node, ids, connection, start in sent:
+                if connection is None:
+                    try:
+                        total += self._resend_jobs(node, command_name, ids)
+                    except RedisError as e:
+                        if error is None:
+                            error = e
+                    continue
+                elapsed = None
+                try:
+                    try:
+                        if connection._sock is None:
+                            raise ConnectionError("Connection lost")
+                        reply = self.parse_response(connection, command_name)
+                        elapsed = time.time() - start
+                    except (ConnectionError, TimeoutError) as e:
+                        connection.disconnect()
+                        self._topology_stale = True
+                        if not connection.retry_on_timeout and \
+                                isinstance(e, TimeoutError):
+                            raise
+                        reply = self._resend_jobs(node, command_name, ids)
+                    total += reply
+                except RedisError as e:
+                    # keep reading, so no reply is left on a connection
+                    if error is None:
+                        error = e
+                finally:
+                    self._finished(node, elapsed=elapsed)
+            if error is not None:
+                raise error
+            return total
+        finally:
+            for node, _, connection, _ in sent:
+                if connection is not None:
+                    self._release_connection(connection, node)
+
+    def _resend_jobs(self, node, command_name, ids):
+        """
+        Send the share of a command's job IDs that ``node`` owns again,
+        after its reply was lost. With failover, it goes to another node if
+        ``node`` still fails.
+        """
+        args = (command_name,) + tuple(ids)
+        if self.failover:
+            return self._execute_failover(args, {}, node)
+        return self._execute_on(node, *args)
 
+    def node_stats(self):
+        """
+        Return a dict of node -> {'routed': number of commands sent to the
+        node, 'outstanding': number of commands waiting on a reply,
+        'latency': average round trip time in seconds, or None if it hasn't
+        been measured yet} for every node the client has a connection pool
+        for
+        """
+        with self._all_stats_locks():
+            return dict((node, {'routed': self._routed[node],
+                                'outstanding': self._outstanding[node],
+                                'latency': self._latency.get(node)})
+                        for node in self.connection_pool)
+
+    def probe_latency(self):
+        """
+        PING every node once to measure its latency, so latency-aware
+        routing has a measurement for every node from the start. Nodes that
+        can't be reached are skipped.
+
+        Returns a dict of node -> average latency in seconds
+        """
+        if self._topology_stale:
+            self.refresh_topology()
+        for node in list(self.connection_pool):
+            try:
+                self._execute_on(node, 'PING')
+            except (ConnectionError, TimeoutError):
+                pass
+        with self._all_stats_locks():
+            return dict((node, latency) for node, latency in
+                        six.iteritems(self._latency)
+                        if node in self.connection_pool)
+
+    def _stats_lock(self, node):
+        "The lock guarding ``node``'s routed, outstanding and latency stats"
+        return self._stats_locks[hash(node) % len(self._stats_locks)]
+
+    @contextlib.contextmanager
+    def _all_stats_locks(self):
+        """
+        Hold every stats lock, to read or replace the stats of all nodes at
+        once. The locks are always taken in the same order, and _started and
+        _finished only ever hold one, so this can't deadlock with them.
+        """
+        for lock in self._stats_locks:
+            lock.acquire()
+        try:
+            yield
+        finally:
+            for lock in reversed(self._stats_locks):
+                lock.release()
+
+    def _started(self, node, count=1):
+        with self._stats_lock(node):
+            self._routed[node] += count
+            self._outstanding[node] += count
+
+    def _finished(self, node, count=1, elapsed=None):
+        with self._stats_lock(node):
+            self._outstanding[node] -= count
+            if elapsed is not None:
+                average = self._latency.get(node)
+                if average is None:
+                    self._latency[node] = elapsed
+                else:
+                    self._latency[node] = average + self.latency_alpha * (
+                        elapsed - average)
+
+    def _prepare(self):
+        if self.fork_safe:
+            self._check_pid()
+        if self._topology_stale or (
+                self._next_refresh is not None and
+                time.time() >= self._next_refresh):
+            self._maybe_refresh_topology()
+
+    def _get_connection(self, command_name, *args, **options):
+        self._prepare()
+        node = self._get_node(command_name, (command_name,) + args)
+        pool = self.connection_pool[node]
         return pool.get_connection(command_name, **options), node
 
     def _release_connection(self, connection, node):
-        return self.connection_pool[node].release(connection)
+        pool = self.connection_pool.get(node)
+        if pool is None:
+            # the node left the cluster while the connection was in use
+            connection.disconnect()
+            return
+        return pool.release(connection)
 
     def execute_command(self, *args, **options):
         "Execute a command and return a parsed response"
+        if self.failover:
+            return self._execute_failover(args, options)
+        connection, node = self._get_connection(*args, **options)
+        return self._execute(connection, node, args, options)
+
+    def _execute_failover(self, args, options, node=None):
         command_name = args[0]
-        connection, node = self._get_connection(command_name, **options)
+        deadline = time.time() + self.retry_deadline_secs
+        tried = set()
+        self._prepare()
+        if node is None:
+            node = self._get_node(command_name, args)
+        while True:
+            node = self._failover_node(node, tried)
+            if node is None:
+                raise ConnectionError("No node available for %s, tried %s" %
+                                      (command_name, ', '.join(sorted(tried))))
+            connection = self.connection_pool[node].get_connection(
+                command_name, **options)
+            try:
+                # a stale pooled connection is reconnected and retried on the
+                # same node first, as without failover
+                response = self._execute(connection, node, args, options)
+            except (ConnectionError, TimeoutError) as e:
+                self._breaker.failure(node)
+                tried.add(node)
+                if time.time() >= deadline or (
+                        isinstance(e, TimeoutError) and
+                        not connection.retry_on_timeout):
+                    raise
+                log.warning("%s failed on node %s, failing over: %s",
+                            command_name, node, e)
+                continue
+            self._breaker.success(node)
+            return response
+
+    def _failover_node(self, node, tried):
+        "The node to send a command to, given it already failed on ``tried``"
+        if node not in tried and self._node_available(node):
+            return node
+        pools = self.connection_pool
+        candidates = self._healthy_nodes + sorted(
+            (n for n in pools if n not in self._healthy_nodes),
+            key=self._node_priority)
+        for candidate in candidates:
+            if candidate in pools and candidate not in tried and \
+                    self._node_available(candidate):
+                return candidate
+        return None
+
+    def _node_available(self, node):
+        "Whether ``node`` can be sent commands, probing it if it's half-open"
+        state = self._breaker.state(node)
+        if state == CLOSED:
+            return True
+        if state == OPEN or not self._breaker.acquire_probe(node):
+            return False
         try:
-            connection.send_command(*args)
-            return self.parse_response(connection, command_name, **options)
-        except (ConnectionError, TimeoutError) as e:
-            connection.disconnect()
-            if not connection.retry_on_timeout and isinstance(e, TimeoutError):
-                raise
-            connection.send_command(*args)
-            return self.parse_response(connection, command_name, **options)
+            connection = self.connection_pool[node].get_connection('PING')
+            self._execute(connection, node, ('PING',), {}, retry=False)
+        except (ConnectionError, TimeoutError, KeyError):
+            self._breaker.failure(node)
+            return False
+        self._breaker.success(node)
+        return True
+
+    def _execute_on(self, node, *args, **options):
+        "Execute a command on a specific node"
+        connection = self.connection_pool[node].get_connection(args[0],
+                                                               **options)
+        return self._execute(connection, node, args, options)
+
+    def _execute(self, connection, node, args, options, retry=True):
+        command_name = args[0]
+        elapsed = None
+        self._started(node)
+        try:
+            start = time.time()
+            try:
+                connection.send_command(*args)
+                response = self.parse_response(connection, command_name,
+                                               **options)
+            except (ConnectionError, TimeoutError) as e:
+                connection.disconnect()
+                self._topology_stale = True
+                if not retry or (not connection.retry_on_timeout and
+                                 isinstance(e, TimeoutError)):
+                    raise
+                start = time.time()
+                connection.send_command(*args)
+                response = self.parse_response(connection, command_name,
+                                               **options)
+            if not self._is_blocking(args):
+                elapsed = time.time() - start
+            return response
         finally:
+            self._finished(node, elapsed=elapsed)
             self._release_connection(connection, node)
 
     def parse_response(self, connection, command_name, **options):
@@ -348,6 +1036,38 @@ class DisqueAlpha(object):
 
     def addjob(self, queue, body, timeout_ms=0, replicate=0, delay_secs=0,
                retry_secs=-1, ttl_secs=0, maxlen=0, async=False):
+        if self.flow_control is not None:
+            self._throttle(queue)
+        args = self._addjob_args(queue, body, timeout_ms, replicate,
+                                 delay_secs, retry_secs, ttl_secs, maxlen,
+                                 async)
+        try:
+            return self.execute_command(*args)
+        except ResponseError:
+            self._rejected(args)
+            raise
+
+    def _throttle(self, queue):
+        self.flow_control.wait(self, queue)
+
+    def _rejected(self, args):
+        "Delete the blob of an ADDJOB that was rejected"
+        key = referenced_key(args[2])
+        if key is not None and self.blob_store is not None:
+            self.blob_store.delete(key)
+
+    def _addjob_args(self, queue, body, timeout_ms=0, replicate=0,
+                     delay_secs=0, retry_secs=-1, ttl_secs=0, maxlen=0,
+                     async=False):
+        codec = self._codec(queue)
+        if codec is not None:
+            body = codec.encode(body)
+        if self.blob_store is not None and \
+                isinstance(body, _BLOB_TYPES) and \
+                len(body) >= self.blob_min_size:
+            body = reference(self.blob_store.put(body))
+        elif self.compression is not None:
+            body = compress(self.compression, body, self.compress_min_size)
         args = ['ADDJOB', queue, body, timeout_ms]
         if replicate > 0:
             args += [Token('REPLICATE'), replicate]
@@ -361,10 +1081,69 @@ class DisqueAlpha(object):
             args += [Token('MAXLEN'), maxlen]
         if async:
             args += [Token('ASYNC')]
+        return args
 
-        return self.execute_command(*args)
+    def addjobs(self, queue, bodies, chunk_size=100, **options):
+        """
+        Add every body in the iterable ``bodies`` to ``queue``, pipelining
+        ``chunk_size`` ADDJOBs at a time. Any other keyword arguments are
+        passed along to every ``addjob`` call.
+
+        This function returns a list with one entry per body, in input order:
+        the new job ID, the ResponseError that ADDJOB failed with, or the
+        disq.flow.QueueFull raised by flow control. One failing job doesn't
+        stop the rest of the batch from being added.
+        """
+        return list(self.iter_addjobs(
+            queue, ({'body': body} for body in bodies), chunk_size,
+            **options))
 
-    def getjobs(self, queue, timeout_ms=0, count=1, queues=None):
+    def addjobs_with_options(self, queue, jobs, chunk_size=100, **options):
+        """
+        Like ``addjobs``, but ``jobs`` is an iterable of dicts of ``addjob``
+        keyword arguments, so every job can have its own options:
+
+            addjobs_with_options('q', [{'body': 'a'},
+                                       {'body': 'b', 'delay_secs': 10},
+                                       {'body': 'c', 'queue': 'otherq'}])
+
+        Keyword arguments to this function are used as the defaults for
+        every job.
+        """
+        return list(self.iter_addjobs(queue, jobs, chunk_size, **options))
+
+    def iter_addjobs(self, queue, jobs, chunk_size=100, **options):
+        """
+        Generator version of ``addjobs_with_options``. At most ``chunk_size``
+        jobs are read from ``jobs`` and held in memory at a time, so it can
+        stream any number of jobs from another generator.
+        """
+        if chunk_size < 1:
+            raise ValueError("chunk_size must be >= 1")
+        jobs = iter(jobs)
+        while True:
+            chunk = list(itertools.islice(jobs, chunk_size))
+            if not chunk:
+                return
+            pipe = self.pipeline()
+            # None for the jobs that were staged, QueueFull for the ones
+            # flow control turned away
+            rejected = []
+            for job in chunk:
+                kwargs = dict(options, queue=queue)
+                kwargs.update(job)
+                try:
+                    pipe.addjob(**kwargs)
+                except QueueFull as e:
+                    rejected.append(e)
+                else:
+                    rejected.append(None)
+            replies = iter(pipe.execute(raise_on_error=False))
+            for error in rejected:
+                yield next(replies) if error is None else error
+
+    def getjobs(self, queue, timeout_ms=0, count=1, queues=None,
+                nohang=False):
         """
         This function returns a list of 3-element lists
         [
@@ -373,18 +1152,17 @@ class DisqueAlpha(object):
             [queue, job3_id, b'body']
         ]
         """
-        return self._job_cmd(queue, timeout_ms, count, queues)
+        return self._job_cmd(queue, timeout_ms, count, queues, nohang)
 
     def getjob(self, queue, timeout_ms=0, queues=None):
         """
         This function returns a 3-element list
         [queue, job_id, b'body']
         """
-        j = self._job_cmd(queue, timeout_ms, 1, queues)
-        if j:
-            return j[0]
+        return self._first_job(self._job_cmd(queue, timeout_ms, 1, queues))
 
-    def _job_cmd(self, queue, timeout_ms=0, count=1, queues=None):
+    def _job_cmd(self, queue, timeout_ms=0, count=1, queues=None,
+                 nohang=False):
         """ This function accepts a queue name as "queue" and a list of
         additional queues as "queues="
 
@@ -399,28 +1177,219 @@ class DisqueAlpha(object):
 
         But that throws a SyntaxError in anything less than Python 3
         """
+        args = self._getjob_args(queue, timeout_ms, count, queues, nohang)
+        if self.hedge_after_secs is not None and not nohang:
+            return self._got_jobs(self._hedged_getjob(args))
+        return self._got_jobs(self.execute_command(*args))
+
+    def _hedged_getjob(self, args):
+        self._prepare()
+        node = self._get_node('GETJOB', args)
+        connection = self.connection_pool[node].get_connection('GETJOB')
+        self._started(node)
+        try:
+            try:
+                connection.send_command(*args)
+                if not connection.can_read(self.hedge_after_secs):
+                    jobs = self._hedge(args, node)
+                    if jobs:
+                        self._drain(connection, node)
+                        connection = None
+                        return jobs
+                return self.parse_response(connection, 'GETJOB')
+            except (ConnectionError, TimeoutError) as e:
+                connection.disconnect()
+                self._topology_stale = True
+                if not connection.retry_on_timeout and \
+                        isinstance(e, TimeoutError):
+                    raise
+                connection.send_command(*args)
+                return self.parse_response(connection, 'GETJOB')
+        except BaseException:
+            # the GETJOB reply may still be on its way, so the connection
+            # can't be handed to another command
+            if connection is not None:
+                connection.disconnect()
+            raise
+        finally:
+            if connection is not None:
+                self._finished(node)
+                self._release_connection(connection, node)
+
+    def _hedge(self, args, primary):
+        "Try to get the jobs ``args`` asks for from the next best node"
+        latency = self._latency
+        nodes = [node for node in self._healthy_nodes or self.connection_pool
+                 if node != primary and node in self.connection_pool and
+                 self._breaker.state(node) == CLOSED]
+        if not nodes:
+            return None
+        node = min(nodes, key=lambda n: latency.get(n, 0))
+        # same COUNT and queues, but without blocking
+        nohang = [args[0], Token('NOHANG')] + list(args[3:])
+        try:
+            return self._execute_on(node, *nohang)
+        except (ConnectionError, TimeoutError):
+            return None
+
+    def _drain(self, connection, node):
+        """
+        Read the reply to a GETJOB that lost the race to a hedged one in the
+        background, and put the jobs it returns back on their queues
+        """
+        def drain():
+            try:
+                if not connection.can_read(self.hedge_drain_secs):
+                    # a blocked GETJOB can't be cancelled, other than by
+                    # closing the connection
+                    connection.disconnect()
+                    return
+                jobs = self.parse_response(connection, 'GETJOB')
+                if jobs:
+                    # the node that just replied has the jobs for sure
+                    connection.send_command('ENQUEUE',
+                                            *[job[1] for job in jobs])
+                    connection.read_response()
+            except Exception as e:
+                if not isinstance(e, (ConnectionError, TimeoutError)):
+                    log.warning("Failed to put back jobs from a hedged "
+                                "GETJOB on node %s: %s", node, e)
+                connection.disconnect()
+            finally:
+                self._finished(node)
+                self._release_connection(connection, node)
+        thread = threading.Thread(target=drain)
+        thread.daemon = True
+        thread.start()
+        return thread
+
+    def _getjob_args(self, queue, timeout_ms=0, count=1, queues=None,
+                     nohang=False):
         if queues is None:
             queues = []
-        jobs = self.execute_command(
-            'GETJOB', Token('TIMEOUT'), timeout_ms, Token('COUNT'), count,
-            Token('FROM'), queue, *queues)
+        if nohang:
+            # return right away, with no jobs if the queues are empty
+            return ['GETJOB', Token('NOHANG'), Token('COUNT'), count,
+                    Token('FROM'), queue] + list(queues)
+        return ['GETJOB', Token('TIMEOUT'), timeout_ms, Token('COUNT'), count,
+                Token('FROM'), queue] + list(queues)
+
+    def _codec(self, queue):
+        if self.queue_codecs:
+            return self.queue_codecs.get(self._queue_name(queue), self.codec)
+        return self.codec
+
+    def _decode_jobs(self, jobs):
+        "Decompress and decode the bodies of [queue, id, body] lists in place"
+        if not jobs:
+            return jobs
+        for job in jobs:
+            body = job[2]
+            if isinstance(body, six.binary_type) and body.startswith(MAGIC):
+                key = referenced_key(body)
+                if key is None:
+                    job[2] = self._decompress(body)
+                else:
+                    job[2] = self._get_blob(job[1], key, body)
+        if self.codec is None and not self.queue_codecs:
+            return jobs
+        by_codec = {}
+        for job in jobs:
+            if isinstance(job[2], DecodeError):
+                # it couldn't be decompressed, or its blob fetched
+                continue
+            codec = self._codec(job[0])
+            if codec is not None:
+                by_codec.setdefault(codec, []).append(job)
+        for codec, batch in six.iteritems(by_codec):
+            bodies = codec.decode_many([job[2] for job in batch])
+            for job, body in zip(batch, bodies):
+                job[2] = body
+        return jobs
+
+    @staticmethod
+    def _decompress(body):
+        """
+        Decompress ``body``, or return a DecodeError in its place if it
+        can't be, so the rest of the batch isn't lost
+        """
+        try:
+            return decompress(body)
+        except Exception as e:
+            return DecodeError("Can't decompress job body: %s" % e, body)
+
+    MAX_BLOB_KEYS = 10000
+
+    def _get_blob(self, job_id, key, reference):
+        """
+        The body stored under ``key``, or a DecodeError in its place if it
+        can't be fetched, so the rest of the batch isn't lost
+        """
+        if self.blob_store is None:
+            return DecodeError("Job %s refers to a blob, but the client has "
+                               "no blob_store" % self._queue_name(job_id),
+                               reference)
+        try:
+            body = self.blob_store.get(key)
+        except KeyError:
+            return DecodeError("The blob job %s refers to is missing" %
+                               self._queue_name(job_id), reference)
+        if self.blob_delete_on_ack:
+            job_id = self._queue_name(job_id)
+            with self._blob_lock:
+                if job_id not in self._blob_keys:
+                    self._blob_order.append(job_id)
+                self._blob_keys[job_id] = key
+                while len(self._blob_order) > self.MAX_BLOB_KEYS:
+                    self._blob_keys.pop(self._blob_order.popleft(), None)
+        return body
+
+    def _acked(self, jobs, reply):
+        "Delete the blobs of acknowledged jobs"
+        if self._blob_keys:
+            keys = []
+            with self._blob_lock:
+                for job_id in jobs:
+                    key = self._blob_keys.pop(self._queue_name(job_id), None)
+                    if key is not None:
+                        keys.append(key)
+            for key in keys:
+                self.blob_store.delete(key)
+        return reply
+
+    def _got_jobs(self, jobs):
         if jobs is None:
             return
+        self._decode_jobs(jobs)
+        # origins are recorded from the raw replies, before Job objects
+        # would decode their queue names and IDs
         if self.record_job_origin:
-            for _, job_id, _ in jobs:
-                # pull the origin node out of the job_id
-                # https;//github.com/antirez/disque#job-ids
-                self._job_score.add(job_id[2:10])
+            for queue, job_id, _ in jobs:
+                owner = self._job_owner(job_id)
+                self._job_score.add(owner)
+                self._queue_score.add(self._queue_name(queue), owner)
+        if self.job_objects:
+            client = self._job_client()
+            jobs = [Job(queue, job_id, body, client)
+                    for queue, job_id, body in jobs]
         return jobs
 
+    def _job_client(self):
+        "The client Job objects use to acknowledge themselves"
+        return self
+
+    def _first_job(self, jobs):
+        if jobs:
+            return jobs[0]
+
     def ackjob(self, *jobs):
-        return self.execute_command('ACKJOB', *jobs)
+        return self._acked(jobs, self._execute_jobs('ACKJOB', jobs))
 
     def fastack(self, *jobs):
-        return self.execute_command('FASTACK', *jobs)
+        return self._acked(jobs, self._execute_jobs('FASTACK', jobs))
 
     def deljob(self, *jobs):
-        return self.execute_command('DELJOB', *jobs)
+        return self._execute_jobs('DELJOB', jobs)
 
     def show(self, job):
         return self.execute_command('SHOW', job)
@@ -430,10 +1399,10 @@ class DisqueAlpha(object):
                                   "yet, so clients can't use it")
 
     def enqueue(self, *jobs):
-        return self.execute_command('ENQUEUE', *jobs)
+        return self._execute_jobs('ENQUEUE', jobs)
 
     def dequeue(self, *jobs):
-        return self.execute_command('DEQUEUE', *jobs)
+        return self._execute_jobs('DEQUEUE', jobs)
 
     # QUEUE COMMANDS
 
@@ -461,4 +1430,180 @@ class DisqueAlpha(object):
         return self.execute_command(*args)
 
     def qpeek(self, queue, count=1):
-        return self.execute_command('QPEEK', queue, count)
+        return self._decode_jobs(self.execute_command('QPEEK', queue, count))
+
+
+class DisquePipeline(DisqueAlpha):
+    """
+    Pipelines buffer commands and send them to Disque with a single socket
+    write, reading all of the replies back when ``execute()`` is called.
+
+    Every DisqueAlpha command is available on a pipeline and returns the
+    pipeline itself, so calls can be chained. Commands are routed to nodes
+    exactly as the parent client would route them, and replies are returned
+    in the order the commands were queued, whichever node answered them.
+
+    >>> with client.pipeline() as pipe:
+    ...     pipe.addjob('q', 'first').addjob('q', 'second').qlen('q')
+    ...     pipe.execute()
+    ['DI...SQ', 'DI...SQ', 2]
+
+    Pipelines share their connection pools and routing state with the client
+    that created them, but each pipeline should be used by one thread only.
+    """
+
+    def __init__(self, client):
+        self.client = client
+        self.command_stack = []
+
+    def __getattr__(self, name):
+        # everything but the command stack (pools, response callbacks,
+        # job-origin scores...) is borrowed from the parent client
+        if name == 'client':
+            raise AttributeError(name)
+        return getattr(self.client, name)
+
+    def __repr__(self):
+        return "%s<%s>" % (type(self).__name__, repr(self.client))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.reset()
+
+    def __len__(self):
+        return len(self.command_stack)
+
+    def reset(self):
+        "Throw away any commands that haven't been executed yet"
+        self.command_stack = []
+
+    def pipeline(self):
+        raise DisqueError("Pipelines can't be nested")
+
+    def pipeline_execute_command(self, callback, *args, **options):
+        """
+        Stage a command to be sent when execute() is called. ``callback``, if
+        not None, is applied to the parsed reply before it is returned.
+        """
+        self.command_stack.append((args, options, callback))
+        return self
+
+    def execute_command(self, *args, **options):
+        return self.pipeline_execute_command(None, *args, **options)
+
+    def _job_cmd(self, queue, timeout_ms=0, count=1, queues=None,
+                 nohang=False):
+        return self.pipeline_execute_command(
+            self._got_jobs,
+            *self._getjob_args(queue, timeout_ms, count, queues, nohang))
+
+    def qpeek(self, queue, count=1):
+        return self.pipeline_execute_command(self._decode_jobs, 'QPEEK',
+                                             queue, count)
+
+    def _job_client(self):
+        # jobs are acknowledged right away, not as part of the pipeline
+        return self.client
+
+    def _throttle(self, queue):
+        # queue lengths are sampled right away, not as part of the pipeline
+        self.client._throttle(queue)
+
+    def _execute_jobs(self, command_name, jobs):
+        # a pipelined command has a single reply, so its job IDs aren't
+        # split up: it's sent to the owner of the first job
+        return self.execute_command(command_name, *jobs)
+
+    def _acked(self, jobs, pipe):
+        # blobs are deleted once the acknowledgement has been sent
+        args, options, callback = self.command_stack[-1]
+
+        def acked(reply):
+            self.client._acked(jobs, reply)
+            return reply if callback is None else callback(reply)
+        self.command_stack[-1] = (args, options, acked)
+        return pipe
+
+    def getjob(self, queue, timeout_ms=0, queues=None):
+        return self.pipeline_execute_command(
+            lambda jobs: self._first_job(self._got_jobs(jobs)),
+            *self._getjob_args(queue, timeout_ms, 1, queues))
+
+    def execute(self, raise_on_error=True):
+        """
+        Send all staged commands and return a list of their replies.
+
+        If ``raise_on_error`` is False, a command that fails with a
+        ResponseError doesn't abort the rest of the pipeline: the exception
+        is returned in that command's place in the result list instead.
+        """
+        stack = self.command_stack
+        if not stack:
+            return []
+        self.reset()
+        self.client._prepare()
+
+        # group commands by the node they are routed to, keeping the
+        # original position of every command so replies come back in order
+        by_node = {}
+        for i, (args, _, _) in enumerate(stack):
+            by_node.setdefault(self._get_node(args[0], args),
+                               []).append(i)
+
+        response = [None] * len(stack)
+        for node, indexes in six.iteritems(by_node):
+            replies = self._execute_node(node, [stack[i] for i in indexes])
+            for i, reply in zip(indexes, replies):
+                response[i] = reply
+
+        for i, (args, _, callback) in enumerate(stack):
+            if isinstance(response[i], ResponseError):
+                if args[0] == 'ADDJOB':
+                    self.client._rejected(args)
+            elif callback is not None:
+                response[i] = callback(response[i])
+
+        if raise_on_error:
+            self.raise_first_error(stack, response)
+        return response
+
+    def _execute_node(self, node, commands):
+        connection = self.connection_pool[node].get_connection('PIPELINE')
+        self.client._started(node, len(commands))
+        try:
+            return self._execute_pipeline(connection, commands)
+        except (ConnectionError, TimeoutError) as e:
+            connection.disconnect()
+            self.client._topology_stale = True
+            if not connection.retry_on_timeout and isinstance(e, TimeoutError):
+                raise
+            return self._execute_pipeline(connection, commands)
+        finally:
+            self.client._finished(node, len(commands))
+            self._release_connection(connection, node)
+
+    def _execute_pipeline(self, connection, commands):
+        connection.send_packed_command(
+            connection.pack_commands([args for args, _, _ in commands]))
+        response = []
+        for args, options, _ in commands:
+            try:
+                response.append(
+                    self.parse_response(connection, args[0], **options))
+            except ResponseError:
+                response.append(sys.exc_info()[1])
+        return response
+
+    def raise_first_error(self, commands, response):
+        for i, r in enumerate(response):
+            if isinstance(r, ResponseError):
+                self.annotate_exception(r, i + 1, commands[i][0])
+                raise r
+
+    def annotate_exception(self, exception, number, command):
+        cmd = six.text_type(' ').join(six.moves.map(six.text_type, command))
+        msg = six.text_type('Command # %d (%s) of pipeline caused error: %s') \
+            % (number, cmd, six.text_type(exception.args[0]))
+        exception.args = (msg,) + exception.args[1:]
@@ -0,0 +1,149 @@
+# Copyright 2015 Ryan Brown <sb@ryansb.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import six
+from six.moves import cPickle as pickle
+
+from disq.parsers import json
+
+
+class DecodeError(ValueError):
+    """
+    A job body couldn't be decompressed or decoded, or the blob it refers
+    to couldn't be fetched (see disq.blobstore). It takes the place of the
+    body of that job only, since the rest of the batch was fetched (and
+    taken off the queue) along with it. ``body`` is the body as it was
+    fetched.
+    """
+    def __init__(self, message, body):
+        super(DecodeError, self).__init__(message)
+        self.body = body
+
+
+class Codec(object):
+    """
+    Turns job bodies into bytes for ADDJOB and back when they're fetched.
+
+    Subclasses implement ``encode`` and ``decode``. ``decode_many`` decodes
+    the bodies of a whole GETJOB reply at once, and can be overridden where
+    a batch can be decoded faster than one body at a time. Either way, a
+    body that can't be decoded is replaced by a DecodeError rather than
+    failing the whole batch.
+    """
+    def encode(self, obj):
+        raise NotImplementedError
+
+    def decode(self, data):
+        raise NotImplementedError
+
+    def decode_many(self, bodies):
+        decode = self.decode
+        decoded = []
+        for body in bodies:
+            try:
+                decoded.append(decode(body))
+            except Exception as e:
+                decoded.append(DecodeError("Can't decode job body: %s" % e,
+                                           body))
+        return decoded
+
+
+class RawCodec(Codec):
+    "Leaves bodies as they are"
+    def encode(self, obj):
+        return obj
+
+    def decode(self, data):
+        return data
+
+    def decode_many(self, bodies):
+        return list(bodies)
+
+
+class JSONCodec(Codec):
+    """
+    JSON, using ujson if it's installed and the standard library's json
+    module otherwise.
+
+    Bodies are decoded one at a time: parsing a batch as a single JSON
+    array can't tell where one body ends and the next starts, so malformed
+    bodies could be split or merged into the wrong values.
+    """
+    def encode(self, obj):
+        return json.dumps(obj).encode('utf-8')
+
+    def decode(self, data):
+        return json.loads(six.binary_type(data).decode('utf-8'))
+
+
+class PickleCodec(Codec):
+    """
+    Pickles bodies with the highest protocol available. Only use it for
+    jobs that come from producers you trust: unpickling runs arbitrary code.
+    """
+    def __init__(self, protocol=pickle.HIGHEST_PROTOCOL):
+        self.protocol = protocol
+
+    def encode(self, obj):
+        return pickle.dumps(obj, self.protocol)
+
+    def decode(self, data):
+        return pickle.loads(six.binary_type(data))
+
+
+class MsgpackCodec(Codec):
+    "msgpack, if the msgpack package (>= 0.5.2) is installed"
+    def __init__(self):
+        import msgpack
+        self._msgpack = msgpack
+
+    def encode(self, obj):
+        return self._msgpack.packb(obj, use_bin_type=True)
+
+    def decode(self, data):
+        return self._msgpack.unpackb(data, raw=False)
+
+    def __getstate__(self):
+        return {}
+
+    def __setstate__(self, state):
+        self.__init__()
+
+
+CODECS = {
+    'raw': RawCodec,
+    'json': JSONCodec,
+    'pickle': PickleCodec,
+    'msgpack': MsgpackCodec,
+}
+
+
+def register_codec(name, codec_class):
+    "Make ``codec_class`` available as ``codec=name``"
+    CODECS[name] = codec_class
+
+
+def get_codec(codec):
+    """
+    Return a Codec for ``codec``, which is either the name of a registered
+    codec or a Codec instance. None means bodies are left as they are.
+    """
+    if codec is None or isinstance(codec, Codec):
+        return codec
+    try:
+        codec_class = CODECS[codec]
+    except KeyError:
+        raise ValueError("Unknown codec %r, expected one of %s" % (
+            codec, ', '.join(sorted(CODECS))))
+    return codec_class()
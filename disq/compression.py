@@ -0,0 +1,179 @@
+# Copyright 2015 Ryan Brown <sb@ryansb.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import zlib
+
+import six
+
+from disq.connection import BUFFER_TYPES
+
+# compressed bodies start with MAGIC and the tag of the compressor that was
+# used, anything else is left alone
+MAGIC = b'\x00DQ'
+
+
+def _as_bytes(data):
+    "Python 2's compression libraries only take str, not buffers"
+    if six.PY2 and not isinstance(data, str):
+        # memoryview.tobytes(), as str(memoryview) is its repr on Python 2
+        tobytes = getattr(data, 'tobytes', None)
+        return tobytes() if tobytes is not None else bytes(data)
+    return data
+
+
+class Compressor(object):
+    """
+    Compresses job bodies. ``tag`` is the single byte written after MAGIC
+    to tell which compressor a body has to be decompressed with.
+    """
+    tag = None
+
+    def compress(self, data):
+        raise NotImplementedError
+
+    def decompress(self, data):
+        raise NotImplementedError
+
+
+class ZlibCompressor(Compressor):
+    tag = b'z'
+
+    def __init__(self, level=6):
+        self.level = level
+
+    def compress(self, data):
+        return zlib.compress(_as_bytes(data), self.level)
+
+    def decompress(self, data):
+        return zlib.decompress(data)
+
+
+class LZ4Compressor(Compressor):
+    "LZ4 frames, if the lz4 package is installed. Faster than zlib"
+    tag = b'4'
+
+    def __init__(self):
+        import lz4.frame
+        self._lz4 = lz4.frame
+
+    def compress(self, data):
+        return self._lz4.compress(_as_bytes(data))
+
+    def decompress(self, data):
+        return self._lz4.decompress(data)
+
+    def __getstate__(self):
+        return {}
+
+    def __setstate__(self, state):
+        self.__init__()
+
+
+class ZstdCompressor(Compressor):
+    "Zstandard, if the zstandard package is installed"
+    tag = b's'
+
+    def __init__(self, level=3):
+        import zstandard
+        self.level = level
+        self._zstd = zstandard
+
+    def compress(self, data):
+        return self._zstd.ZstdCompressor(level=self.level).compress(
+            _as_bytes(data))
+
+    def decompress(self, data):
+        return self._zstd.ZstdDecompressor().decompress(data)
+
+    def __getstate__(self):
+        return {'level': self.level}
+
+    def __setstate__(self, state):
+        self.__init__(**state)
+
+
+COMPRESSORS = {
+    'zlib': ZlibCompressor,
+    'lz4': LZ4Compressor,
+    'zstd': ZstdCompressor,
+}
+
+# tag -> compressor, for decompressing bodies whatever compressor the client
+# was set up with
+_DECOMPRESSORS = {ZlibCompressor.tag: ZlibCompressor()}
+
+
+def register_compressor(name, compressor_class):
+    "Make ``compressor_class`` available as ``compression=name``"
+    COMPRESSORS[name] = compressor_class
+
+
+def get_compressor(compressor):
+    """
+    Return a Compressor for ``compressor``, which is either the name of a
+    registered compressor or a Compressor instance. None means no
+    compression. The compressor is also used to decompress bodies tagged
+    with its tag.
+    """
+    if compressor is None:
+        return None
+    if not isinstance(compressor, Compressor):
+        try:
+            compressor_class = COMPRESSORS[compressor]
+        except KeyError:
+            raise ValueError("Unknown compressor %r, expected one of %s" % (
+                compressor, ', '.join(sorted(COMPRESSORS))))
+        compressor = compressor_class()
+    _DECOMPRESSORS.setdefault(compressor.tag, compressor)
+    return compressor
+
+
+def compress(compressor, body, min_size):
+    """
+    Compress ``body`` if it's at least ``min_size`` bytes long and
+    compressing it makes it smaller
+    """
+    if isinstance(body, six.text_type):
+        body = body.encode('utf-8')
+    elif not isinstance(body, (six.binary_type,) + BUFFER_TYPES):
+        return body
+    if len(body) < min_size:
+        return body
+    compressed = MAGIC + compressor.tag + compressor.compress(body)
+    if len(compressed) >= len(body):
+        return body
+    return compressed
+
+
+def decompress(body):
+    "Decompress ``body`` if it was compressed by compress()"
+    if not isinstance(body, six.binary_type) or not body.startswith(MAGIC):
+        return body
+    return _decompressor(body[3:4]).decompress(body[4:])
+
+
+def _decompressor(tag):
+    try:
+        return _DECOMPRESSORS[tag]
+    except KeyError:
+        pass
+    for compressor_class in six.itervalues(COMPRESSORS):
+        if compressor_class.tag == tag:
+            try:
+                compressor = compressor_class()
+            except ImportError as e:
+                raise ValueError("Can't decompress job body: %s" % e)
+            return _DECOMPRESSORS.setdefault(tag, compressor)
+    raise ValueError("Job body was compressed with an unknown compressor "
+                     "(tag %r)" % tag)
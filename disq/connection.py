@@ -0,0 +1,96 @@
+# Copyright 2015 Ryan Brown <sb@ryansb.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from redis.connection import Connection, UnixDomainSocketConnection
+
+try:
+    BUFFER_TYPES = (bytearray, memoryview)
+except NameError:
+    # python 2.6 has no memoryview
+    BUFFER_TYPES = (bytearray,)
+
+# arguments at least this long are sent as they are instead of being copied
+# into the buffer holding the rest of the command
+CHUNK_SIZE = 6000
+
+
+def _nbytes(value):
+    if isinstance(value, bytearray):
+        return len(value)
+    return len(value) * value.itemsize
+
+
+class BufferPackingMixin(object):
+    """
+    Packs bytearray and memoryview arguments, like job bodies, without
+    copying them: they're handed to the socket as they are. redis-py would
+    send their repr() instead.
+    """
+    def _encode(self, value):
+        if isinstance(value, BUFFER_TYPES):
+            return value
+        # redis-py >= 2.10.6 moved encode() to a separate Encoder
+        return getattr(self, 'encoder', self).encode(value)
+
+    def pack_command(self, *args):
+        "Pack a series of arguments into the Redis protocol"
+        args = tuple(args[0].split()) + args[1:]
+        output = []
+        buff = b'*' + str(len(args)).encode() + b'\r\n'
+        for arg in map(self._encode, args):
+            if isinstance(arg, BUFFER_TYPES):
+                output.append(buff + b'$' + str(_nbytes(arg)).encode() +
+                              b'\r\n')
+                output.append(arg)
+                buff = b'\r\n'
+            elif len(buff) > CHUNK_SIZE or len(arg) > CHUNK_SIZE:
+                output.append(buff + b'$' + str(len(arg)).encode() + b'\r\n')
+                output.append(arg)
+                buff = b'\r\n'
+            else:
+                buff = b''.join((buff, b'$', str(len(arg)).encode(), b'\r\n',
+                                 arg, b'\r\n'))
+        output.append(buff)
+        return output
+
+    def pack_commands(self, commands):
+        "Pack multiple commands into the Redis protocol"
+        output = []
+        pieces = []
+        size = 0
+        for cmd in commands:
+            for chunk in self.pack_command(*cmd):
+                if isinstance(chunk, BUFFER_TYPES) or len(chunk) > CHUNK_SIZE:
+                    if pieces:
+                        output.append(b''.join(pieces))
+                        pieces, size = [], 0
+                    output.append(chunk)
+                    continue
+                pieces.append(chunk)
+                size += len(chunk)
+                if size > CHUNK_SIZE:
+                    output.append(b''.join(pieces))
+                    pieces, size = [], 0
+        if pieces:
+            output.append(b''.join(pieces))
+        return output
+
+
+class DisqueConnection(BufferPackingMixin, Connection):
+    pass
+
+
+class DisqueUnixDomainSocketConnection(BufferPackingMixin,
+                                       UnixDomainSocketConnection):
+    pass
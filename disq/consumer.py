@@ -0,0 +1,210 @@
+# Copyright 2015 Ryan Brown <sb@ryansb.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import collections
+import logging
+import threading
+import time
+
+from redis.exceptions import RedisError
+
+from disq.rolling_counter import RollingCounter
+
+log = logging.getLogger(__name__)
+
+
+class PrefetchConsumer(object):
+    """
+    Keeps a local buffer of jobs from ``queue`` (and any extra ``queues``)
+    topped up from a background thread, so that in the steady state
+    ``next()`` returns a job from memory instead of waiting on a GETJOB.
+
+    Whenever fewer than ``low_water`` jobs are buffered, the background
+    thread fetches enough jobs with GETJOB ... COUNT to fill the buffer back
+    up, to at most ``maxsize`` jobs.
+
+    Disque requeues a job that hasn't been acknowledged ``retry_secs`` after
+    it was handed out, so buffering more jobs than can be processed in that
+    time just means they get delivered twice. The consumer measures how fast
+    jobs are taken from it and only fills the buffer with as many jobs as it
+    expects to hand out in ``max_age_secs`` (half of ``retry_secs`` by
+    default), and jobs that sat in the buffer longer than that are put back
+    on their queue with ENQUEUE rather than returned.
+
+    Example:
+
+    >>> with PrefetchConsumer(client, 'queue', maxsize=200) as consumer:
+    ...     for job in consumer:
+    ...         handle(job)
+    ...         client.fastack(job[1])
+
+    Jobs still buffered when the consumer is closed are put back on their
+    queue too.
+    """
+    def __init__(self, client, queue, queues=None, maxsize=100,
+                 low_water=None, timeout_ms=500, retry_secs=300,
+                 max_age_secs=None, rate_window_secs=10):
+        if timeout_ms <= 0:
+            raise ValueError("timeout_ms must be > 0")
+        if low_water is None:
+            low_water = max(1, maxsize // 4)
+        if not 1 <= low_water <= maxsize:
+            raise ValueError("low_water must be between 1 and maxsize")
+        self.client = client
+        self.queue = queue
+        self.queues = queues
+        self.maxsize = maxsize
+        self.low_water = low_water
+        self.timeout_ms = timeout_ms
+        if max_age_secs is None:
+            max_age_secs = retry_secs / 2.0
+        self.max_age_secs = max_age_secs
+        self.rate_window_secs = rate_window_secs
+
+        self._buffer = collections.deque()
+        self._delivered = RollingCounter(ttl_secs=rate_window_secs)
+        self._stats = collections.defaultdict(int)
+        self._closed = False
+        self._cond = threading.Condition()
+
+        self._thread = threading.Thread(target=self._run,
+                                        name='disq-prefetch')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        job = self.get()
+        if job is None:
+            raise StopIteration
+        return job
+
+    next = __next__
+
+    def __len__(self):
+        return len(self._buffer)
+
+    def get(self, timeout=None):
+        """
+        Return the next job, waiting up to ``timeout`` seconds (forever if
+        None) for one to be fetched. Returns None on timeout, or once the
+        consumer is closed.
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        stale = []
+        try:
+            with self._cond:
+                while True:
+                    while not self._buffer and not self._closed:
+                        if deadline is None:
+                            self._cond.wait()
+                        else:
+                            remaining = deadline - time.time()
+                            if remaining <= 0:
+                                return None
+                            self._cond.wait(remaining)
+                    if not self._buffer:
+                        return None
+
+                    fetched_at, job = self._buffer.popleft()
+                    if len(self._buffer) < self.low_water:
+                        self._cond.notify_all()
+                    if time.time() - fetched_at > self.max_age_secs:
+                        stale.append(job[1])
+                        continue
+                    self._delivered.add('jobs')
+                    self._stats['delivered'] += 1
+                    return job
+        finally:
+            if stale:
+                self._requeue(stale, 'expired')
+
+    def stats(self):
+        "Return a dict of buffer depth and counters"
+        with self._cond:
+            stats = dict(self._stats)
+            stats.update({
+                'depth': len(self._buffer),
+                'capacity': self._capacity(),
+                'rate': self._rate(),
+            })
+        for key in ('fetches', 'fetched', 'delivered', 'expired', 'returned'):
+            stats.setdefault(key, 0)
+        return stats
+
+    def close(self):
+        "Stop prefetching and put any buffered jobs back on their queue"
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        self._thread.join()
+        with self._cond:
+            jobs = [job[1] for _, job in self._buffer]
+            self._buffer.clear()
+        self._requeue(jobs, 'returned')
+
+    def _rate(self):
+        "Jobs handed out per second, over the last ``rate_window_secs``"
+        return self._delivered.count('jobs') / float(self.rate_window_secs)
+
+    def _capacity(self):
+        # don't buffer more jobs than we expect to hand out before they get
+        # too old, but always keep at least the low water mark
+        expected = int(self._rate() * self.max_age_secs)
+        return min(self.maxsize, max(self.low_water, expected))
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while (len(self._buffer) >= self.low_water and
+                       not self._closed):
+                    self._cond.wait()
+                if self._closed:
+                    return
+                count = self._capacity() - len(self._buffer)
+
+            try:
+                jobs = self.client.getjobs(self.queue,
+                                           timeout_ms=self.timeout_ms,
+                                           count=count, queues=self.queues)
+            except RedisError:
+                log.exception("Failed to prefetch jobs")
+                time.sleep(self.timeout_ms / 1000.0)
+                continue
+
+            with self._cond:
+                self._stats['fetches'] += 1
+                if jobs:
+                    now = time.time()
+                    self._buffer.extend((now, job) for job in jobs)
+                    self._stats['fetched'] += len(jobs)
+                    self._cond.notify_all()
+
+    def _requeue(self, job_ids, stat):
+        if not job_ids:
+            return
+        try:
+            self.client.enqueue(*job_ids)
+        except RedisError:
+            log.exception("Failed to requeue %d jobs", len(job_ids))
+        with self._cond:
+            self._stats[stat] += len(job_ids)
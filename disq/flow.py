@@ -0,0 +1,159 @@
+# Copyright 2015 Ryan Brown <sb@ryansb.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import threading
+import time
+
+from redis.exceptions import ConnectionError, RedisError, TimeoutError
+
+
+class QueueFull(RedisError):
+    "A queue is over its high-water mark and the producer won't wait"
+
+
+class _QueueState(object):
+    __slots__ = ('depth', 'added', 'sampled_at', 'sampling', 'paused')
+
+    def __init__(self):
+        self.depth = 0
+        self.added = 0
+        self.sampled_at = 0
+        self.sampling = False
+        self.paused = False
+
+
+class FlowController(object):
+    """
+    Holds producers back while consumers catch up, instead of letting
+    ADDJOB ... MAXLEN reject jobs outright.
+
+    Adding a job to a queue that holds ``high_water`` jobs or more pauses
+    the queue, and it stays paused until it's down to ``low_water`` jobs
+    (half of ``high_water`` by default). While a queue is paused, adding a
+    job either blocks until it isn't (``mode='block'``, for at most
+    ``max_wait_secs`` if that's set) or raises QueueFull right away
+    (``mode='raise'``).
+
+    The length of a queue is sampled with QLEN at most once every
+    ``sample_secs`` seconds per queue; in between, the jobs added by this
+    client are counted on top of the last sample. With ``cluster_wide=True``
+    QLEN is summed over every node; with ``cluster_wide=False`` it's only
+    sent to the client's default node. By default (``None``) it's summed
+    over every node if the client has a ``producer_routing`` policy, since
+    jobs are then spread over several nodes, and sent to the default node,
+    where all of the client's jobs go, otherwise.
+
+    >>> client = Disque(flow_control=FlowController(high_water=10000))
+    """
+    def __init__(self, high_water, low_water=None, sample_secs=1.0,
+                 mode='block', max_wait_secs=None, cluster_wide=None):
+        if low_water is None:
+            low_water = high_water // 2
+        if not 0 <= low_water < high_water:
+            raise ValueError("low_water must be between 0 and high_water")
+        if mode not in ('block', 'raise'):
+            raise ValueError("mode must be 'block' or 'raise'")
+        self.high_water = high_water
+        self.low_water = low_water
+        self.sample_secs = sample_secs
+        self.mode = mode
+        self.max_wait_secs = max_wait_secs
+        self.cluster_wide = cluster_wide
+        self.waited = 0
+        self.rejected = 0
+        self._queues = {}
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['_lock']
+        state['_queues'] = {}
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def _sample(self, client, queue):
+        cluster_wide = self.cluster_wide
+        if cluster_wide is None:
+            cluster_wide = client.producer_routing is not None
+        if not cluster_wide:
+            return client.qlen(queue)
+        depth = 0
+        error = None
+        for node in list(client.connection_pool):
+            try:
+                depth += client._execute_on(node, 'QLEN', queue)
+            except (ConnectionError, TimeoutError) as e:
+                error = e
+        if error is not None and not depth:
+            raise error
+        return depth
+
+    def _state(self, client, queue):
+        "The state of ``queue``, sampling its length if it's due"
+        now = time.time()
+        with self._lock:
+            state = self._queues.get(queue)
+            if state is None:
+                state = self._queues[queue] = _QueueState()
+            if state.sampling or now - state.sampled_at < self.sample_secs:
+                return state
+            # other threads carry on with the old sample meanwhile
+            state.sampling = True
+        try:
+            depth = self._sample(client, queue)
+        finally:
+            with self._lock:
+                state.sampling = False
+        with self._lock:
+            state.depth = depth
+            state.added = 0
+            state.sampled_at = now
+            if depth <= self.low_water:
+                state.paused = False
+        return state
+
+    def wait(self, client, queue, count=1):
+        """
+        Return once ``count`` jobs may be added to ``queue``, or raise
+        QueueFull
+        """
+        start = time.time()
+        while True:
+            state = self._state(client, queue)
+            with self._lock:
+                if state.depth + state.added >= self.high_water:
+                    state.paused = True
+                if not state.paused:
+                    state.added += count
+                    return
+            wait = self.sample_secs
+            if self.max_wait_secs is not None:
+                wait = min(wait, start + self.max_wait_secs - time.time())
+            if self.mode == 'raise' or wait <= 0:
+                self.rejected += 1
+                raise QueueFull("Queue %s is over its high-water mark (%d)" %
+                                (queue, self.high_water))
+            self.waited += 1
+            time.sleep(wait)
+
+    def stats(self):
+        "A dict of queue -> estimated length and whether it's paused"
+        with self._lock:
+            return dict((queue, {
+                'length': state.depth + state.added,
+                'paused': state.paused,
+            }) for queue, state in self._queues.items())
@@ -0,0 +1,112 @@
+# Copyright 2015 Ryan Brown <sb@ryansb.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import six
+
+
+def _text(value):
+    if isinstance(value, six.binary_type):
+        return value.decode()
+    return value
+
+
+class Job(object):
+    """
+    A job fetched with GETJOB, returned instead of a [queue, id, body] list
+    by clients created with ``job_objects=True``.
+
+    The queue name and job ID are kept as the bytes they were read as, and
+    only decoded the first time they're used. A Job can still be used like
+    the list it replaces: ``queue, id, body = job`` and ``job[1]`` work.
+
+    >>> job = client.getjob('queue')
+    >>> handle(job.body)
+    >>> job.fastack()
+
+    Jobs can be pickled, for example to hand them to another process, but
+    without the client they came from, so they can't be acknowledged from
+    there.
+    """
+    __slots__ = ('_queue', '_id', 'body', 'client')
+
+    def __init__(self, queue, id, body, client=None):
+        self._queue = queue
+        self._id = id
+        self.body = body
+        self.client = client
+
+    @property
+    def queue(self):
+        queue = self._queue = _text(self._queue)
+        return queue
+
+    @property
+    def id(self):
+        id = self._id = _text(self._id)
+        return id
+
+    @property
+    def origin(self):
+        "The ID prefix of the node that created the job"
+        return _text(self._id[2:10])
+
+    def ack(self):
+        "Acknowledge the job with ACKJOB"
+        return self._client().ackjob(self.id)
+
+    def fastack(self):
+        "Acknowledge the job with FASTACK"
+        return self._client().fastack(self.id)
+
+    def requeue(self):
+        "Put the job back on its queue with ENQUEUE"
+        return self._client().enqueue(self.id)
+
+    def _client(self):
+        if self.client is None:
+            raise RuntimeError("Job %s isn't attached to a client" % self.id)
+        return self.client
+
+    def __iter__(self):
+        return iter((self.queue, self.id, self.body))
+
+    def __len__(self):
+        return 3
+
+    def __getitem__(self, index):
+        # job[1] and job[2] don't decode the queue name
+        if index == 1 or index == -2:
+            return self.id
+        if index == 2 or index == -1:
+            return self.body
+        return tuple(self)[index]
+
+    def __eq__(self, other):
+        if isinstance(other, (Job, list, tuple)):
+            return tuple(self) == tuple(other)
+        return NotImplemented
+
+    def __ne__(self, other):
+        equal = self.__eq__(other)
+        if equal is NotImplemented:
+            return equal
+        return not equal
+
+    __hash__ = None
+
+    def __reduce__(self):
+        return (Job, (self._queue, self._id, self.body))
+
+    def __repr__(self):
+        return "Job<%s %s>" % (self.queue, self.id)
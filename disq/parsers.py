@@ -34,6 +34,14 @@ def parse_job_resp(response):
             for r in response]
 
 
+def parse_job_resp_raw(response):
+    """
+    Leaves GETJOB replies as the connection read them: a list of
+    [queue, job_id, body] lists of bytes. Nothing is copied or decoded.
+    """
+    return response
+
+
 def parse_cluster_nodes(response):
     nodes = {}
     fields = ['myself', 'id', 'address', 'flags', 'ping_sent', 'pong_received',
@@ -49,6 +57,23 @@ def parse_hello(response):
     return dict(zip(fields, response[:2] + [response[2:]]))
 
 
+def hello_topology(hello):
+    """
+    Turns a parsed HELLO reply into a dict of node -> node information,
+    where node is the 8 character node ID prefix that also appears in the
+    IDs of jobs created on that node.
+    """
+    topology = {}
+    for node_id, ip, port, priority in hello['nodes']:
+        topology[bin_to_str(node_id[:8])] = {
+            'id': bin_to_str(node_id),
+            'host': bin_to_str(ip),
+            'port': bin_to_int(port),
+            'priority': bin_to_int(priority),
+        }
+    return topology
+
+
 def parse_time(response):
     return bin_to_int(response[0]), bin_to_int(response[1])
 
@@ -66,4 +91,4 @@ def read_json_job(response):
 
 
 def write_json_job(job):
-    return six.binary_type(json.dumps(job))
+    return json.dumps(job).encode('utf-8')
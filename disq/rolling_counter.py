@@ -1,4 +1,6 @@
+import itertools
 import six
+import threading
 import time
 from bisect import bisect
 from collections import defaultdict
@@ -11,6 +13,11 @@ class RollingCounter(object):
     you may use any float to indicate how long (in seconds) an event should
     stay in the count.
 
+    Events are counted in a ring of ``buckets`` time slices per key, each
+    ``ttl_secs / buckets`` long, and expire a whole slice at a time. This
+    keeps add() constant time and the memory used per key fixed, no matter
+    how many events are counted.
+
     Example:
 
     >>> rc = RollingCounter(ttl_secs=0.5)
@@ -23,6 +30,281 @@ class RollingCounter(object):
     >>> rc.keys()
     []
 
+    Usage:
+        use .add('itemname') to increment a count for some id
+    """
+    def __init__(self, ttl_secs=10, buckets=10):
+        # id -> [per-bucket counts, bucket number of each count, total]
+        self._counts = {}
+        if ttl_secs <= 0:
+            raise ValueError("TTL must be >=0")
+        if buckets < 1:
+            raise ValueError("buckets must be >= 1")
+        self._ttl_seconds = ttl_secs
+        self._buckets = buckets
+        self._bucket_seconds = float(ttl_secs) / buckets
+        self._now = None
+
+    def add(self, id):
+        now = self._expire()
+        slot = now % self._buckets
+        try:
+            entry = self._counts[id]
+        except KeyError:
+            entry = self._counts[id] = [[0] * self._buckets,
+                                        [now] * self._buckets, 0]
+        # a slot that was last used a whole window ago was already emptied
+        # by _expire(), it just needs to be claimed for the current bucket
+        entry[1][slot] = now
+        entry[0][slot] += 1
+        entry[2] += 1
+
+    def max(self, default=None):
+        self._expire()
+        if self._counts:
+            return max(six.iteritems(self._counts), key=_total)[0]
+        return default
+
+    def min(self, default=None):
+        self._expire()
+        if self._counts:
+            return min(six.iteritems(self._counts), key=_total)[0]
+        return default
+
+    def ranked(self):
+        self._expire()
+        return [(k, v[2]) for k, v in sorted(six.iteritems(self._counts),
+                                             key=_total)]
+
+    def count(self, id):
+        self._expire()
+        entry = self._counts.get(id)
+        return entry[2] if entry else 0
+
+    def _expire(self):
+        # only does any work once per bucket, when the oldest bucket falls
+        # out of the window
+        now = int(time.time() / self._bucket_seconds)
+        if now == self._now:
+            return now
+        self._now = now
+        expired = now - self._buckets
+        # cast key iterable to list because this loop can delete keys
+        for k, (counts, stamps, total) in list(six.iteritems(self._counts)):
+            for i, stamp in enumerate(stamps):
+                if stamp <= expired and counts[i]:
+                    total -= counts[i]
+                    counts[i] = 0
+            if total:
+                self._counts[k][2] = total
+            else:
+                self.remove(k)
+        return now
+
+    def remove(self, id):
+        del self._counts[id]
+
+    def keys(self):
+        self._expire()
+        return list(six.iterkeys(self._counts))
+
+
+def _total(item):
+    return item[1][2]
+
+
+class ShardedRollingCounter(object):
+    """
+    A thread-safe RollingCounter with the same interface.
+
+    Counts are spread over ``shards`` RollingCounters, each with its own
+    lock. Every thread always adds to the same shard, and threads are dealt
+    out to shards in turn, so threads only contend with the few others that
+    share their shard. Reads take each shard's lock in turn and merge the
+    counts.
+    """
+    def __init__(self, ttl_secs=10, buckets=10, shards=8):
+        if shards < 1:
+            raise ValueError("shards must be >= 1")
+        self._shards = [(threading.Lock(), RollingCounter(ttl_secs, buckets))
+                        for _ in range(shards)]
+        self._next_shard = itertools.count()
+        self._local = threading.local()
+
+    def _shard(self):
+        try:
+            return self._local.shard
+        except AttributeError:
+            shard = self._shards[next(self._next_shard) % len(self._shards)]
+            self._local.shard = shard
+            return shard
+
+    def _merged(self):
+        totals = {}
+        for lock, counter in self._shards:
+            with lock:
+                counter._expire()
+                for k, entry in six.iteritems(counter._counts):
+                    totals[k] = totals.get(k, 0) + entry[2]
+        return totals
+
+    def add(self, id):
+        lock, counter = self._shard()
+        with lock:
+            counter.add(id)
+
+    def max(self, default=None):
+        totals = self._merged()
+        if totals:
+            return max(six.iteritems(totals), key=lambda x: x[1])[0]
+        return default
+
+    def min(self, default=None):
+        totals = self._merged()
+        if totals:
+            return min(six.iteritems(totals), key=lambda x: x[1])[0]
+        return default
+
+    def ranked(self):
+        return sorted(six.iteritems(self._merged()), key=lambda x: x[1])
+
+    def count(self, id):
+        total = 0
+        for lock, counter in self._shards:
+            with lock:
+                total += counter.count(id)
+        return total
+
+    def remove(self, id):
+        for lock, counter in self._shards:
+            with lock:
+                counter._counts.pop(id, None)
+
+    def keys(self):
+        return list(self._merged())
+
+
+class KeyedRollingCounter(object):
+    """
+    A thread-safe set of RollingCounters, one per key, e.g. to count where
+    the jobs of each queue come from separately.
+
+    Every key's counter has a lock of its own, so threads counting for
+    different keys don't wait on each other; only adding a new key or
+    dropping one takes a lock over the whole set.
+
+    At most ``max_keys`` counters are kept. When a counter for a new key is
+    needed and there's no room for it, counters whose counts have all
+    expired are dropped, or if there are none, the counter that was added to
+    least recently.
+
+    Example:
+
+    >>> kc = KeyedRollingCounter(ttl_secs=5)
+    >>> kc.add('queue', 'node1')
+    >>> kc.max(['queue'])
+    'node1'
+    >>> kc.max(['other-queue'], 'default')
+    'default'
+    """
+    def __init__(self, ttl_secs=10, buckets=10, max_keys=1000):
+        if max_keys < 1:
+            raise ValueError("max_keys must be >= 1")
+        # key -> [RollingCounter, time of the last add, lock]
+        self._counters = {}
+        self._ttl_secs = ttl_secs
+        self._buckets = buckets
+        self.max_keys = max_keys
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._counters)
+
+    def add(self, key, id):
+        entry = self._counters.get(key)
+        if entry is None:
+            with self._lock:
+                entry = self._counters.get(key)
+                if entry is None:
+                    if len(self._counters) >= self.max_keys:
+                        self._evict()
+                    entry = self._counters[key] = [
+                        RollingCounter(self._ttl_secs, self._buckets), None,
+                        threading.Lock()]
+        # if the counter was dropped meanwhile, the count is lost along
+        # with the others it held
+        with entry[2]:
+            entry[0].add(id)
+            entry[1] = time.time()
+
+    def _evict(self):
+        for key, (counter, _, lock) in list(six.iteritems(self._counters)):
+            with lock:
+                counter._expire()
+                expired = not counter._counts
+            if expired:
+                del self._counters[key]
+        if len(self._counters) >= self.max_keys:
+            oldest = min(six.iteritems(self._counters),
+                         key=lambda item: item[1][1])[0]
+            del self._counters[oldest]
+
+    def max(self, keys, default=None):
+        "Return the id with the highest count over all of ``keys``"
+        totals = {}
+        for key in keys:
+            entry = self._counters.get(key)
+            if entry is None:
+                continue
+            counter = entry[0]
+            with entry[2]:
+                counter._expire()
+                for k, item in six.iteritems(counter._counts):
+                    totals[k] = totals.get(k, 0) + item[2]
+        if totals:
+            return max(six.iteritems(totals), key=lambda x: x[1])[0]
+        return default
+
+    def count(self, key, id):
+        entry = self._counters.get(key)
+        if entry is None:
+            return 0
+        with entry[2]:
+            return entry[0].count(id)
+
+    def remove(self, key):
+        with self._lock:
+            self._counters.pop(key, None)
+
+    def keys(self):
+        with self._lock:
+            return list(self._counters)
+
+
+class ExactRollingCounter(object):
+    """
+    ExactRollingCounter stores a timestamp for every event, so events expire
+    exactly ``ttl_secs`` after they were added, at the cost of memory and
+    time that grow with the number of events in the window. RollingCounter
+    is usually a better choice.
+
+    The argument to ExactRollingCounter (ttl_secs) indicates how long each
+    event should count towards the total for its key, the default is 10
+    seconds, but you may use any float to indicate how long (in seconds) an
+    event should stay in the count.
+
+    Example:
+
+    >>> rc = ExactRollingCounter(ttl_secs=0.5)
+    >>> rc.add('foo')
+    >>> rc.max()
+    'foo'
+    >>> time.sleep(1)
+    >>> rc.max()
+    None
+    >>> rc.keys()
+    []
+
     Usage:
         use .add('itemname') to increment a count for some id
     """
@@ -0,0 +1,148 @@
+# Copyright 2015 Ryan Brown <sb@ryansb.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import itertools
+import random
+import zlib
+
+import six
+
+
+class RoutingPolicy(object):
+    """
+    Picks the node a command is sent to. ``select`` is given the client,
+    the list of healthy nodes to choose from, and the name of the queue the
+    job is added to (None for GETJOB and acknowledgements).
+    """
+    def select(self, client, nodes, queue):
+        raise NotImplementedError
+
+
+class RoundRobin(RoutingPolicy):
+    "Send each job to the next node in turn"
+    def __init__(self):
+        self._counter = itertools.count()
+
+    def select(self, client, nodes, queue):
+        return nodes[next(self._counter) % len(nodes)]
+
+    def __getstate__(self):
+        return {}
+
+    def __setstate__(self, state):
+        self.__init__()
+
+
+class Random(RoutingPolicy):
+    "Send each job to a node picked at random"
+    def select(self, client, nodes, queue):
+        return random.choice(nodes)
+
+
+class LeastOutstanding(RoutingPolicy):
+    "Send each job to the node with the fewest commands waiting on a reply"
+    def select(self, client, nodes, queue):
+        return min(nodes, key=client._outstanding.__getitem__)
+
+
+def _latencies(client, nodes):
+    """
+    A dict of node -> average latency for ``nodes``, with nodes that haven't
+    been measured yet taking the median latency of the others, or None if
+    none of them has been measured
+    """
+    latency = client._latency
+    measured = sorted(latency[node] for node in nodes if node in latency)
+    if not measured:
+        return None
+    median = measured[len(measured) // 2]
+    return dict((node, latency.get(node, median)) for node in nodes)
+
+
+class LowestLatency(RoutingPolicy):
+    """
+    Send each command to the node with the lowest average latency. Nodes
+    whose latency hasn't been measured yet are assumed to be as fast as the
+    median node, and a fraction ``explore`` of commands go to a random node
+    so that the latency of the other nodes stays up to date. Until any node
+    has been measured, commands go to random nodes; the client's
+    ``probe_latency()`` measures every node up front.
+    """
+    def __init__(self, explore=0.05):
+        self.explore = explore
+
+    def select(self, client, nodes, queue):
+        if random.random() < self.explore:
+            return random.choice(nodes)
+        latency = _latencies(client, nodes)
+        if latency is None:
+            return random.choice(nodes)
+        return min(nodes, key=latency.__getitem__)
+
+
+class JobOriginLatency(LowestLatency):
+    """
+    Weigh where jobs come from against latency: each node is scored by the
+    number of jobs recently received from it (plus one) divided by its
+    average latency, so a node that produces many jobs is only preferred
+    over a faster one if it produces proportionally more of them. Nodes
+    whose latency hasn't been measured yet are assumed to be as fast as the
+    median node, or all equally fast if none has been. Needs the client's
+    record_job_origin option to know where jobs come from.
+    """
+    def select(self, client, nodes, queue):
+        if random.random() < self.explore:
+            return random.choice(nodes)
+        latency = _latencies(client, nodes) or \
+            dict((node, 1.0) for node in nodes)
+        return max(nodes, key=lambda node: (
+            (client._job_score.count(node) + 1) /
+            max(latency[node], 1e-6)))
+
+
+class StickyQueue(RoutingPolicy):
+    """
+    Send all the jobs of a queue to the same node, picked by hashing the
+    queue name, so jobs of one queue stay in order on one node while
+    different queues are spread over the cluster.
+    """
+    def select(self, client, nodes, queue):
+        if isinstance(queue, six.text_type):
+            queue = queue.encode('utf-8')
+        key = zlib.crc32(six.binary_type(queue)) & 0xffffffff
+        return nodes[key % len(nodes)]
+
+
+POLICIES = {
+    'round_robin': RoundRobin,
+    'random': Random,
+    'least_outstanding': LeastOutstanding,
+    'sticky': StickyQueue,
+    'lowest_latency': LowestLatency,
+    'job_origin_latency': JobOriginLatency,
+}
+
+
+def get_policy(policy):
+    """
+    Return a RoutingPolicy for ``policy``, which is either one of the names
+    in POLICIES or a RoutingPolicy instance. None means no policy.
+    """
+    if policy is None or isinstance(policy, RoutingPolicy):
+        return policy
+    try:
+        return POLICIES[policy]()
+    except KeyError:
+        raise ValueError("Unknown routing policy %r, expected one of %s" % (
+            policy, ', '.join(sorted(POLICIES))))
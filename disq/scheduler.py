@@ -0,0 +1,143 @@
+# Copyright 2015 Ryan Brown <sb@ryansb.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import threading
+import time
+
+import six
+
+
+class DeficitRoundRobin(object):
+    """
+    Shares GETJOB batches between several queues by weight.
+
+    ``GETJOB ... FROM a b c`` always drains ``a`` before it looks at ``b``,
+    so a busy queue starves the ones listed after it. Instead, every call to
+    ``plan(count)`` credits each queue with its share of ``count`` (its
+    weight over the sum of the weights) and gives each queue as many whole
+    jobs as it has credit for, with the slots left over by rounding going to
+    the queues with the most credit left. The jobs a queue actually returns
+    are taken off its credit, and a queue that returns fewer jobs than it
+    was asked for loses the rest of its credit, so an idle queue can't save
+    it up and later burst ahead of the others.
+
+    A queue whose share of a batch is less than one job builds up credit
+    over several batches. On top of that, a queue that hasn't been asked for
+    a job in ``max_delay_secs`` seconds is asked for one in the next batch,
+    whatever the weights.
+
+    ``weights`` is a dict of queue name -> weight, or a list of queue names
+    to weigh equally.
+
+    >>> scheduler = DeficitRoundRobin({'high': 8, 'low': 1})
+    >>> jobs = scheduler.getjobs(client, count=20, timeout_ms=500)
+    """
+    def __init__(self, weights, max_delay_secs=5):
+        if not isinstance(weights, dict):
+            weights = dict((queue, 1) for queue in weights)
+        if not weights:
+            raise ValueError("At least one queue is needed")
+        if min(six.itervalues(weights)) <= 0:
+            raise ValueError("Queue weights must be > 0")
+        self.weights = weights
+        self.max_delay_secs = max_delay_secs
+        self.queues = sorted(weights)
+        self.fetched = dict((queue, 0) for queue in self.queues)
+        self._total = float(sum(six.itervalues(weights)))
+        self._deficit = dict((queue, 0.0) for queue in self.queues)
+        now = time.time()
+        self._asked = dict((queue, now) for queue in self.queues)
+        self._lock = threading.Lock()
+
+    def plan(self, count):
+        """
+        Return a list of (queue, number of jobs) to fetch, for a batch of at
+        most ``count`` jobs
+        """
+        now = time.time()
+        with self._lock:
+            for queue in self.queues:
+                self._deficit[queue] += count * self.weights[queue] / \
+                    self._total
+            overdue = sorted(
+                (queue for queue in self.queues
+                 if now - self._asked[queue] >= self.max_delay_secs),
+                key=self._asked.__getitem__)
+            # overdue queues first, longest waiting first, then the ones
+            # owed the most
+            order = overdue + sorted(
+                (queue for queue in self.queues if queue not in overdue),
+                key=self._deficit.__getitem__, reverse=True)
+            shares = {}
+            left = count
+            for queue in order:
+                n = min(max(int(self._deficit[queue]), 0), left)
+                if queue in overdue:
+                    n = max(n, 1)
+                shares[queue] = n
+                left -= n
+                if not left:
+                    break
+            # slots left over by rounding down go to the queues with the
+            # most credit left
+            for queue in sorted(order, key=lambda q: (
+                    shares.get(q, 0) - self._deficit[q]))[:left]:
+                shares[queue] = shares.get(queue, 0) + 1
+            plan = []
+            for queue in order:
+                if shares.get(queue):
+                    plan.append((queue, shares[queue]))
+                    self._asked[queue] = now
+            return plan
+
+    def record(self, queue, asked, got):
+        "Charge ``queue`` for ``got`` of the ``asked`` jobs it returned"
+        with self._lock:
+            self.fetched[queue] += got
+            if got < asked:
+                # the queue ran dry: don't let it bank credit
+                self._deficit[queue] = 0.0
+            else:
+                self._deficit[queue] -= got
+
+    def getjobs(self, client, count, timeout_ms=0):
+        """
+        Fetch a batch of up to ``count`` jobs with ``client``, shared out
+        between the queues as planned. The per-queue GETJOBs are sent with
+        NOHANG in a single pipeline. If none of them returns a job, a
+        blocking GETJOB waits up to ``timeout_ms`` for a job from any
+        queue, most owed first.
+
+        Returns a list of jobs, or None if there were none.
+        """
+        plan = self.plan(count)
+        jobs = []
+        if plan:
+            with client.pipeline() as pipe:
+                for queue, n in plan:
+                    pipe.getjobs(queue, count=n, nohang=True)
+                replies = pipe.execute()
+            for (queue, n), got in zip(plan, replies):
+                self.record(queue, n, len(got or ()))
+                jobs.extend(got or ())
+        if jobs:
+            return jobs
+        with self._lock:
+            order = sorted(self.queues, key=self._deficit.__getitem__,
+                           reverse=True)
+        got = client.getjobs(order[0], timeout_ms=timeout_ms, count=1,
+                             queues=order[1:])
+        for job in got or ():
+            self.record(client._queue_name(job[0]), 0, 1)
+        return got
@@ -0,0 +1,161 @@
+# Copyright 2015 Ryan Brown <sb@ryansb.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import threading
+
+
+class _QueueState(object):
+    __slots__ = ('count', 'timeout_ms', 'fill', 'handler_secs', 'batches',
+                 'jobs')
+
+    def __init__(self, count, timeout_ms):
+        self.count = count
+        self.timeout_ms = timeout_ms
+        self.fill = None
+        self.handler_secs = None
+        self.batches = 0
+        self.jobs = 0
+
+
+def _average(average, value, alpha):
+    if average is None:
+        return value
+    return average + alpha * (value - average)
+
+
+class FetchController(object):
+    """
+    Tunes the COUNT and TIMEOUT of GETJOB per queue, AIMD style, from what
+    the batches it fetched looked like.
+
+    - A full batch means jobs are waiting: COUNT grows by ``increase`` and
+      TIMEOUT drops back to ``min_timeout_ms``.
+    - A partial batch shrinks COUNT to halfway between the old COUNT and
+      the number of jobs that came back.
+    - An empty batch multiplies COUNT by ``decrease``, and doubles TIMEOUT
+      (up to ``max_timeout_ms``) so idle queues aren't polled in a loop.
+
+    COUNT is also kept low enough for a batch to be handled well within the
+    retry window: with ``workers`` jobs handled at a time, taking
+    ``handler_secs`` each on average, a batch takes
+    ``count * handler_secs / workers`` seconds, which must stay under
+    ``retry_fraction * retry_secs``, or Disque would requeue jobs that are
+    still waiting their turn. Report how long jobs take with
+    ``observe_handler()``.
+
+    >>> controller = FetchController(max_count=100, workers=8)
+    >>> jobs = controller.getjobs(client, 'queue')
+    >>> controller.stats()['queue']
+    {'count': 2, 'timeout_ms': 100, ...}
+    """
+    def __init__(self, min_count=1, max_count=100, min_timeout_ms=100,
+                 max_timeout_ms=2000, increase=1, decrease=0.5, workers=1,
+                 retry_secs=300, retry_fraction=0.5, alpha=0.2):
+        if not 1 <= min_count <= max_count:
+            raise ValueError("min_count must be between 1 and max_count")
+        if not 0 < min_timeout_ms <= max_timeout_ms:
+            raise ValueError("min_timeout_ms must be between 1 and "
+                             "max_timeout_ms")
+        if not 0 < decrease < 1:
+            raise ValueError("decrease must be between 0 and 1")
+        self.min_count = min_count
+        self.max_count = max_count
+        self.min_timeout_ms = min_timeout_ms
+        self.max_timeout_ms = max_timeout_ms
+        self.increase = increase
+        self.decrease = decrease
+        self.workers = workers
+        self.retry_secs = retry_secs
+        self.retry_fraction = retry_fraction
+        self.alpha = alpha
+        self._queues = {}
+        self._lock = threading.Lock()
+
+    def _state(self, queue):
+        state = self._queues.get(queue)
+        if state is None:
+            state = self._queues[queue] = _QueueState(self.min_count,
+                                                      self.min_timeout_ms)
+        return state
+
+    def _max_count(self, state):
+        if not state.handler_secs:
+            return self.max_count
+        budget = self.retry_secs * self.retry_fraction * self.workers
+        return max(self.min_count,
+                   min(self.max_count, int(budget / state.handler_secs)))
+
+    def params(self, queue):
+        "The (count, timeout_ms) to fetch jobs from ``queue`` with"
+        with self._lock:
+            state = self._state(queue)
+            return state.count, state.timeout_ms
+
+    def observe_batch(self, queue, asked, got):
+        "Adjust ``queue``'s settings after a GETJOB for ``asked`` jobs"
+        with self._lock:
+            state = self._state(queue)
+            state.batches += 1
+            state.jobs += got
+            state.fill = _average(state.fill, float(got) / asked, self.alpha)
+            if got >= asked:
+                if asked >= state.count:
+                    count = state.count + self.increase
+                else:
+                    # the caller had room for fewer jobs than COUNT, so a
+                    # full batch says nothing about a bigger one
+                    count = state.count
+                state.timeout_ms = self.min_timeout_ms
+            elif got:
+                count = (state.count + got) // 2
+            else:
+                count = int(state.count * self.decrease)
+                state.timeout_ms = min(state.timeout_ms * 2,
+                                       self.max_timeout_ms)
+            state.count = max(self.min_count,
+                              min(count, self._max_count(state)))
+
+    def observe_handler(self, queue, secs):
+        "Record that a job from ``queue`` took ``secs`` seconds to handle"
+        with self._lock:
+            state = self._state(queue)
+            state.handler_secs = _average(state.handler_secs, secs,
+                                          self.alpha)
+            state.count = max(self.min_count,
+                              min(state.count, self._max_count(state)))
+
+    def getjobs(self, client, queue, queues=None, limit=None):
+        """
+        Fetch jobs from ``queue`` (and any extra ``queues``) with the current
+        settings, at most ``limit`` of them
+        """
+        count, timeout_ms = self.params(queue)
+        if limit is not None:
+            count = max(1, min(count, limit))
+        jobs = client.getjobs(queue, timeout_ms=timeout_ms, count=count,
+                              queues=queues)
+        self.observe_batch(queue, count, len(jobs or ()))
+        return jobs
+
+    def stats(self):
+        "A dict of queue -> current settings and observations"
+        with self._lock:
+            return dict((queue, {
+                'count': state.count,
+                'timeout_ms': state.timeout_ms,
+                'fill_ratio': state.fill,
+                'handler_secs': state.handler_secs,
+                'batches': state.batches,
+                'jobs': state.jobs,
+            }) for queue, state in self._queues.items())
@@ -0,0 +1,228 @@
+# Copyright 2015 Ryan Brown <sb@ryansb.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import logging
+import threading
+import time
+
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from redis.exceptions import RedisError
+
+from disq.codec import DecodeError
+
+log = logging.getLogger(__name__)
+
+
+class Worker(object):
+    """
+    Runs ``handler(job)`` for every job fetched from ``queue`` (and any
+    extra ``queues``) on a pool of ``max_workers`` threads, acknowledging
+    each job once its handler returns.
+
+    Jobs are fetched ``batch_size`` at a time with GETJOB ... COUNT, and at
+    most ``max_in_flight`` jobs are fetched but not yet finished at any time,
+    so jobs aren't taken from Disque faster than they can be handled. A job
+    whose handler raises, or whose body can't be decoded, is logged and left
+    unacknowledged, for Disque to redeliver after its retry time. A failed
+    fetch is logged and retried after ``timeout_ms``.
+
+    Example:
+
+    >>> worker = Worker(client, 'queue', handle_job, max_workers=16)
+    >>> worker.start()
+    >>> ...
+    >>> worker.stop()
+
+    ``run()`` may be called instead of ``start()`` to work in the calling
+    thread until ``stop()`` is called from another one. Either way, stopping
+    waits for jobs that are already being handled to finish and be acked.
+
+    With a ``scheduler``, such as a disq.scheduler.DeficitRoundRobin, jobs
+    are fetched from the scheduler's queues, shared out by their weights,
+    and ``queue`` and ``queues`` are ignored.
+
+    With a ``fetch_controller`` (a disq.tuning.FetchController), the number
+    of jobs fetched at a time and the GETJOB timeout are tuned as the
+    worker goes, from how full batches come back and how long jobs take to
+    handle, instead of being fixed by ``batch_size`` and ``timeout_ms``.
+    Batches are still capped by ``max_in_flight``.
+    """
+    def __init__(self, client, queue, handler, queues=None, max_workers=4,
+                 batch_size=None, max_in_flight=None, timeout_ms=500,
+                 fast_ack=True, scheduler=None, fetch_controller=None):
+        if timeout_ms <= 0:
+            raise ValueError("timeout_ms must be > 0, or the worker can "
+                             "block forever waiting for jobs")
+        self.client = client
+        self.queue = queue
+        self.queues = queues
+        self.handler = handler
+        self.max_workers = max_workers
+        self.batch_size = batch_size or max_workers
+        self.max_in_flight = max_in_flight or 2 * max_workers
+        self.timeout_ms = timeout_ms
+        self.fast_ack = fast_ack
+        self.scheduler = scheduler
+        self.fetch_controller = fetch_controller
+        if scheduler is not None:
+            self._fetch_key = tuple(scheduler.queues)
+        else:
+            self._fetch_key = queue
+
+        self.processed = 0
+        self.failed = 0
+
+        self._in_flight = 0
+        self._cond = threading.Condition()
+        self._stopping = threading.Event()
+        self._thread = None
+
+    def start(self):
+        "Start working in a background thread"
+        self._thread = threading.Thread(target=self.run, name='disq-worker')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self, wait=True):
+        """
+        Stop fetching jobs. With ``wait``, block until the jobs already
+        fetched have been handled.
+        """
+        self._stopping.set()
+        with self._cond:
+            self._cond.notify_all()
+        if wait and self._thread is not None:
+            self._thread.join()
+
+    @property
+    def in_flight(self):
+        "Number of jobs fetched but not finished yet"
+        return self._in_flight
+
+    def run(self):
+        "Fetch and handle jobs until stop() is called"
+        self._stopping.clear()
+        acker = self.client.acker(fast=self.fast_ack)
+        executor = self._make_executor()
+        try:
+            while not self._stopping.is_set():
+                free = self._wait_for_capacity()
+                if not free:
+                    continue
+                if self.fetch_controller is None:
+                    free = min(self.batch_size, free)
+                try:
+                    jobs = self.fetch(free)
+                except RedisError:
+                    log.exception("Failed to fetch jobs")
+                    # back off, but wake up right away when stopped
+                    self._stopping.wait(self.timeout_ms / 1000.0)
+                    continue
+                for job in jobs or []:
+                    self._submit(executor, acker, job)
+        finally:
+            executor.shutdown(wait=True)
+            acker.close()
+
+    def fetch(self, count):
+        "Fetch up to ``count`` jobs"
+        timeout_ms = self.timeout_ms
+        controller = self.fetch_controller
+        if controller is not None:
+            wanted, timeout_ms = controller.params(self._fetch_key)
+            count = max(1, min(count, wanted))
+        if self.scheduler is not None:
+            jobs = self.scheduler.getjobs(self.client, count,
+                                          timeout_ms=timeout_ms)
+        else:
+            jobs = self.client.getjobs(self.queue, timeout_ms=timeout_ms,
+                                       count=count, queues=self.queues)
+        if controller is not None:
+            controller.observe_batch(self._fetch_key, count, len(jobs or ()))
+        return jobs
+
+    def _make_executor(self):
+        return ThreadPoolExecutor(max_workers=self.max_workers)
+
+    def _wait_for_capacity(self):
+        with self._cond:
+            while (self._in_flight >= self.max_in_flight and
+                   not self._stopping.is_set()):
+                self._cond.wait()
+            if self._stopping.is_set():
+                return 0
+            return self.max_in_flight - self._in_flight
+
+    def _submit(self, executor, acker, job):
+        if isinstance(job[2], DecodeError):
+            # left for Disque to redeliver, like a job whose handler failed
+            log.error("Can't handle job %s: %s", job[1], job[2])
+            with self._cond:
+                self.failed += 1
+            return
+        with self._cond:
+            self._in_flight += 1
+        future = executor.submit(_timed, self.handler, job)
+        future.add_done_callback(lambda f: self._finished(f, acker, job))
+
+    def _finished(self, future, acker, job):
+        error = future.exception()
+        if error is None and self.fetch_controller is not None:
+            # the handler's own run time: the controller accounts for jobs
+            # waiting on the others itself
+            self.fetch_controller.observe_handler(self._fetch_key,
+                                                  future.result()[1])
+        try:
+            if error is None:
+                acker.ack(job[1])
+            else:
+                log.error("Handler failed for job %s", job[1],
+                          exc_info=_exc_info(error))
+        finally:
+            with self._cond:
+                if error is None:
+                    self.processed += 1
+                else:
+                    self.failed += 1
+                self._in_flight -= 1
+                self._cond.notify()
+
+
+def _timed(handler, job):
+    "Run ``handler(job)``, returning its result and how long it took"
+    # a module-level function, so it can be sent to a ProcessPoolExecutor
+    start = time.time()
+    result = handler(job)
+    return result, time.time() - start
+
+
+def _exc_info(exception):
+    return (type(exception), exception, getattr(exception, '__traceback__',
+                                                None))
+
+
+class ProcessWorker(Worker):
+    """
+    A Worker that runs handlers in a pool of ``max_workers`` processes, for
+    CPU-bound jobs that can't run in parallel on threads because of the GIL.
+
+    Jobs are still fetched and acknowledged by this process, so the handler
+    processes don't need a connection to Disque. ``handler`` and the jobs
+    passed to it must be picklable, so the handler has to be a module-level
+    function. If it needs a client of its own, a DisqueAlpha can be pickled;
+    or create it with ``fork_safe=True`` so it can be inherited across
+    fork().
+    """
+    def _make_executor(self):
+        return ProcessPoolExecutor(max_workers=self.max_workers)
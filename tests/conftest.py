@@ -12,6 +12,8 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import sys
+
 import pytest
 import disq
 
@@ -47,3 +49,8 @@ def _get_client(cls, request=None, **kwargs):
             client.connection_pool.disconnect()
         request.addfinalizer(teardown)
     return client
+
+
+if sys.version_info < (3, 5):
+    # the asyncio client uses async/await syntax
+    collect_ignore = ['test_aio.py']
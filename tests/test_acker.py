@@ -0,0 +1,90 @@
+# Copyright 2015 Ryan Brown <sb@ryansb.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import time
+
+import pytest
+
+
+class TestAcker(object):
+    def test_flush_on_close(self, dq):
+        qname = 'ackerq'
+        ids = dq.addjobs(qname, ['foo'] * 10)
+        dq.getjobs(qname, timeout_ms=1, count=10)
+        with dq.acker(max_batch=100, max_delay_secs=60) as acker:
+            acker.ack(*ids[:5])
+            for id in ids[5:]:
+                acker.ack(id)
+            assert len(acker) == 10
+            assert all(dq.show(id) for id in ids)
+        assert len(acker) == 0
+        assert not any(dq.show(id) for id in ids)
+        with pytest.raises(RuntimeError):
+            acker.ack(ids[0])
+
+    def test_flush_on_size(self, dq):
+        qname = 'ackersizeq'
+        ids = dq.addjobs(qname, ['foo'] * 10)
+        acker = dq.acker(fast=False, max_batch=5, max_delay_secs=60)
+        acker.ack(*ids[:4])
+        time.sleep(0.1)
+        assert dq.show(ids[0])
+        acker.ack(ids[4])
+        time.sleep(0.1)
+        assert not any(dq.show(id) for id in ids[:5])
+        assert all(dq.show(id) for id in ids[5:])
+        acker.close()
+
+    def test_flush_on_delay(self, dq):
+        qname = 'ackerdelayq'
+        id = dq.addjob(qname, 'foo')
+        acker = dq.acker(max_batch=100, max_delay_secs=0.1)
+        acker.ack(id)
+        assert dq.show(id)
+        time.sleep(0.3)
+        assert not dq.show(id)
+        acker.close()
+
+    def test_flush_errors(self, dq):
+        errors = []
+        acker = dq.acker(on_error=lambda ids, e: errors.append((ids, e)))
+        acker.ack('not-a-job-id')
+        acker.flush()
+        assert errors[0][0] == ['not-a-job-id']
+        acker.close()
+
+    def test_errors_dont_stop_the_thread(self, dq):
+        qname = 'ackerrorq'
+        id = dq.addjob(qname, 'foo')
+        dq.getjob(qname)
+
+        def on_error(ids, e):
+            raise ValueError(ids)
+        acker = dq.acker(max_delay_secs=0.05, on_error=on_error)
+        command = acker._command
+        failures = [OSError('blob store down')]
+
+        def flaky_command(*ids):
+            if failures:
+                raise failures.pop()
+            return command(*ids)
+        acker._command = flaky_command
+        acker.ack('not-a-job-id')
+        time.sleep(0.2)
+        assert not failures
+        acker.ack(id)
+        time.sleep(0.2)
+        assert acker._thread.is_alive()
+        assert not dq.show(id)
+        acker.close()
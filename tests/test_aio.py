@@ -0,0 +1,135 @@
+# Copyright 2015 Ryan Brown <sb@ryansb.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import asyncio
+import os
+import pickle
+
+import pytest
+
+import disq
+from disq.aio import AsyncDisque
+from disq.blobstore import FileBlobStore
+
+
+def run(coro):
+    return asyncio.get_event_loop().run_until_complete(coro)
+
+
+class TestAsyncDisque(object):
+    def test_connect(self, dq):
+        c = AsyncDisque()
+        assert c.default_node == 'default'
+        run(c.connect())
+        assert c.default_node == dq.default_node
+        assert sorted(c.connection_pool) == sorted(dq.connection_pool)
+        c.close()
+
+    def test_round_trip(self, dq):
+        qname = 'aiorttq'
+        c = AsyncDisque()
+        assert run(c.getjob(qname, timeout_ms=1)) is None
+        id = run(c.addjob(qname, 'foobar'))
+        assert run(c.qlen(qname)) == 1
+        assert run(c.getjob(qname, timeout_ms=1)) == [qname, id, b'foobar']
+        assert run(c.ackjob(id)) == 1
+
+    def test_buffer_bodies(self, dq):
+        qname = 'aiobufferq'
+        c = AsyncDisque()
+        run(c.addjob(qname, bytearray(b'foo')))
+        run(c.addjob(qname, memoryview(b'bar')))
+        jobs = run(c.getjobs(qname, timeout_ms=1, count=2))
+        assert [j[2] for j in jobs] == [b'foo', b'bar']
+
+    def test_concurrent_commands(self, dq):
+        qname = 'aioconcurrentq'
+        c = AsyncDisque()
+        ids = run(asyncio.gather(
+            *[c.addjob(qname, 'foo {0}'.format(i)) for i in range(50)]))
+        assert len(set(ids)) == 50
+        jobs = run(c.getjobs(qname, timeout_ms=1, count=50))
+        assert sorted(j[1] for j in jobs) == sorted(ids)
+
+    def test_addjobs(self, dq):
+        qname = 'aiobulkq'
+        c = AsyncDisque()
+        run(c.addjob(qname, 'foo'))
+        ids = run(c.addjobs_with_options(qname, [
+            {'body': 'bar'},
+            {'body': 'baz', 'maxlen': 1},
+        ]))
+        assert isinstance(ids[1], disq.ResponseError)
+        assert run(c.addjobs(qname, ['quux'] * 3, chunk_size=2))
+        assert dq.qlen(qname) == 5
+
+    def test_job_commands_go_to_owner(self, dq):
+        qname = 'aioownerq'
+        producer = disq.Disque(producer_routing='round_robin')
+        ids = [producer.addjob(qname, 'foobar') for _ in range(8)]
+        c = AsyncDisque()
+        assert run(c.enqueue(*ids)) == 0
+        assert run(c.dequeue(*ids)) == 8
+        assert run(c.fastack(*ids)) == 8
+        assert dq.qlen(qname) == 0
+
+    def test_errors(self, dq):
+        c = AsyncDisque()
+        with pytest.raises(disq.ResponseError):
+            run(c.ackjob('not-a-job-id'))
+        assert run(c.ping())
+        with pytest.raises(disq.ConnectionError):
+            run(AsyncDisque(port=1).hello())
+
+    def test_node_stats_and_latency(self, dq):
+        c = AsyncDisque()
+        run(c.ping())
+        stats = c.node_stats()
+        assert sum(s['routed'] for s in stats.values()) >= 1
+        assert all(s['outstanding'] == 0 for s in stats.values())
+        latency = run(c.probe_latency())
+        assert sorted(latency) == sorted(c.connection_pool)
+        c.close()
+
+    def test_refresh_topology_and_warmup(self, dq):
+        c = AsyncDisque()
+        topology = run(c.refresh_topology())
+        assert sorted(topology) == sorted(dq.connection_pool)
+        assert run(c.refresh_topology()) == topology
+        opened = run(c.warmup(connections_per_node=2))
+        assert opened == dict((node, 2) for node in topology)
+        run(c.ping())
+        c.close()
+
+    def test_pickle(self, dq):
+        c = AsyncDisque(record_job_origin=True, codec='json')
+        run(c.connect())
+        copy = pickle.loads(pickle.dumps(c))
+        assert copy.record_job_origin
+        assert type(copy.codec) is type(c.codec)
+        assert copy.default_node == 'default'
+        assert run(copy.ping())
+        assert copy.default_node == dq.default_node
+        c.close()
+        copy.close()
+
+    def test_rejected_job_blob(self, dq, tmpdir):
+        qname = 'aioblobq'
+        store = FileBlobStore(str(tmpdir))
+        c = AsyncDisque(blob_store=store, blob_min_size=10)
+        run(c.addjob(qname, b'x' * 100))
+        with pytest.raises(disq.ResponseError):
+            run(c.addjob(qname, b'y' * 100, maxlen=1))
+        assert run(c.getjob(qname))[2] == b'x' * 100
+        assert sum(len(files) for _, _, files in os.walk(str(tmpdir))) == 1
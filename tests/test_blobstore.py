@@ -0,0 +1,143 @@
+# Copyright 2015 Ryan Brown <sb@ryansb.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+
+import pytest
+
+import disq
+from disq.blobstore import FileBlobStore, reference, referenced_key
+from disq.codec import DecodeError
+
+BIG = b'x' * 4096
+
+
+def test_file_store(tmpdir):
+    store = FileBlobStore(str(tmpdir))
+    key = store.put(BIG)
+    assert store.get(key) == BIG
+    assert store.get(store.put(b'')) == b''
+    assert store.get(store.put(u'text')) == b'text'
+    store.delete(key)
+    with pytest.raises(KeyError):
+        store.get(key)
+    # deleting twice is fine
+    store.delete(key)
+    with pytest.raises(KeyError):
+        store.get('../escape')
+
+
+def test_cleanup(tmpdir):
+    store = FileBlobStore(str(tmpdir))
+    old = store.put(BIG)
+    os.utime(store._file(old), (0, 0))
+    new = store.put(BIG)
+    assert store.cleanup(3600) == 1
+    with pytest.raises(KeyError):
+        store.get(old)
+    assert store.get(new) == BIG
+
+
+def test_reference():
+    assert referenced_key(reference('abc')) == 'abc'
+    assert referenced_key(b'plain body') is None
+    assert referenced_key(None) is None
+
+
+def test_client_claim_check(dq, tmpdir):
+    qname = 'claimcheckq'
+    store = FileBlobStore(str(tmpdir))
+    q = disq.Disque(blob_store=store, blob_min_size=1024)
+    q.addjob(qname, BIG)
+    q.addjob(qname, b'small')
+    raw = dq.execute_command('QPEEK', qname, 2)
+    key = referenced_key(raw[0][2])
+    assert key is not None
+    assert raw[1][2] == b'small'
+
+    jobs = q.getjobs(qname, count=2)
+    assert [j[2] for j in jobs] == [BIG, b'small']
+    q.ackjob(*[j[1] for j in jobs])
+    with pytest.raises(KeyError):
+        store.get(key)
+
+
+def test_non_buffer_bodies(dq, tmpdir):
+    qname = 'claimchecknumberq'
+    q = disq.Disque(blob_store=FileBlobStore(str(tmpdir)), blob_min_size=0)
+    q.addjob(qname, 123)
+    assert q.getjob(qname)[2] == b'123'
+    assert not tmpdir.listdir()
+
+
+def test_client_claim_check_codec(dq, tmpdir):
+    qname = 'claimcheckjsonq'
+    q = disq.Disque(blob_store=FileBlobStore(str(tmpdir)), blob_min_size=100,
+                    codec='json', blob_delete_on_ack=False)
+    doc = {'key': 'value' * 100}
+    q.addjob(qname, doc)
+    job = q.getjob(qname)
+    assert job[2] == doc
+    q.fastack(job[1])
+    assert len(tmpdir.listdir()) == 1
+
+
+def test_client_without_store(dq, tmpdir):
+    qname = 'claimchecknostoreq'
+    q = disq.Disque(blob_store=FileBlobStore(str(tmpdir)), blob_min_size=100)
+    q.addjob(qname, BIG)
+    q.addjob(qname, b'small')
+    jobs = disq.Disque().getjobs(qname, count=2)
+    assert isinstance(jobs[0][2], DecodeError)
+    assert referenced_key(jobs[0][2].body) is not None
+    assert jobs[1][2] == b'small'
+
+
+def test_missing_blob(dq, tmpdir):
+    qname = 'claimcheckmissingq'
+    store = FileBlobStore(str(tmpdir))
+    q = disq.Disque(blob_store=store, blob_min_size=100, codec='json')
+    q.addjob(qname, 'x' * 200)
+    q.addjob(qname, 'small')
+    store.delete(referenced_key(dq.execute_command('QPEEK', qname, 1)[0][2]))
+    jobs = q.getjobs(qname, count=2)
+    assert isinstance(jobs[0][2], DecodeError)
+    assert jobs[1][2] == 'small'
+
+
+def test_rejected_jobs_leave_no_blobs(dq, tmpdir):
+    qname = 'claimcheckrejectq'
+    store = FileBlobStore(str(tmpdir))
+    q = disq.Disque(blob_store=store, blob_min_size=100)
+    q.addjob(qname, BIG)
+    with pytest.raises(disq.ResponseError):
+        q.addjob(qname, BIG, maxlen=1)
+    results = q.addjobs(qname, [BIG, BIG], maxlen=1)
+    assert all(isinstance(r, disq.ResponseError) for r in results)
+    assert sum(len(files) for _, _, files in os.walk(str(tmpdir))) == 1
+
+
+def test_pipeline_ack(dq, tmpdir):
+    qname = 'claimcheckpipeq'
+    store = FileBlobStore(str(tmpdir))
+    q = disq.Disque(blob_store=store, blob_min_size=100)
+    q.addjob(qname, BIG)
+    job = q.getjob(qname)
+    key = q._blob_keys[job[1]]
+    with q.pipeline() as p:
+        p.ackjob(job[1])
+        assert store.get(key) == BIG
+        p.execute()
+    with pytest.raises(KeyError):
+        store.get(key)
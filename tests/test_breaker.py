@@ -0,0 +1,60 @@
+# Copyright 2015 Ryan Brown <sb@ryansb.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import time
+
+from disq.breaker import CLOSED, HALF_OPEN, OPEN, CircuitBreaker
+
+
+def test_opens_after_threshold():
+    b = CircuitBreaker(failure_threshold=2, reset_timeout_secs=60)
+    b.failure('a')
+    assert b.state('a') == CLOSED
+    b.success('a')
+    b.failure('a')
+    assert b.state('a') == CLOSED
+    b.failure('a')
+    assert b.state('a') == OPEN
+    assert b.open_nodes() == ['a']
+    assert not b.acquire_probe('a')
+    assert b.state('b') == CLOSED
+
+
+def test_half_open():
+    b = CircuitBreaker(reset_timeout_secs=0.05)
+    b.failure('a')
+    assert b.state('a') == OPEN
+    time.sleep(0.1)
+    assert b.state('a') == HALF_OPEN
+    assert b.acquire_probe('a')
+    # only one caller probes at a time
+    assert not b.acquire_probe('a')
+    b.failure('a')
+    assert b.state('a') == OPEN
+
+    time.sleep(0.1)
+    assert b.acquire_probe('a')
+    b.success('a')
+    assert b.state('a') == CLOSED
+    assert b.open_nodes() == []
+
+
+def test_reset():
+    b = CircuitBreaker()
+    b.failure('a')
+    b.failure('b')
+    b.reset('a')
+    assert b.open_nodes() == ['b']
+    b.reset()
+    assert b.open_nodes() == []
@@ -0,0 +1,113 @@
+# Copyright 2015 Ryan Brown <sb@ryansb.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import pickle
+
+import pytest
+
+import disq
+from disq.codec import (Codec, DecodeError, JSONCodec, PickleCodec,
+                        get_codec, register_codec)
+
+DOC = {'hello': 'world', 'numbers': [1, 2, 3], 'nested': {'ok': True}}
+
+
+class UpperCodec(Codec):
+    def encode(self, obj):
+        return obj.upper().encode()
+
+    def decode(self, data):
+        return data.decode().lower()
+
+
+@pytest.mark.parametrize('name', ['json', 'pickle'])
+def test_round_trip(name):
+    codec = get_codec(name)
+    assert codec.decode(codec.encode(DOC)) == DOC
+    bodies = [codec.encode(DOC), codec.encode([1]), codec.encode('x')]
+    assert codec.decode_many(bodies) == [DOC, [1], 'x']
+
+
+def test_msgpack():
+    pytest.importorskip('msgpack')
+    codec = get_codec('msgpack')
+    assert codec.decode_many([codec.encode(DOC), codec.encode(b'x')]) == \
+        [DOC, b'x']
+    assert pickle.loads(pickle.dumps(codec)).decode(codec.encode(1)) == 1
+
+
+def test_decode_errors_are_per_job():
+    codec = JSONCodec()
+    # bodies that only make sense together aren't decoded as one value
+    decoded = codec.decode_many([b'[1', b'2]', b'3,4', b'5'])
+    assert all(isinstance(d, DecodeError) for d in decoded[:3])
+    assert [d.body for d in decoded[:3]] == [b'[1', b'2]', b'3,4']
+    assert decoded[3] == 5
+    decoded = get_codec('pickle').decode_many([b'garbage'])
+    assert isinstance(decoded[0], DecodeError)
+
+
+def test_registry():
+    assert isinstance(get_codec('pickle'), PickleCodec)
+    assert get_codec(None) is None
+    codec = UpperCodec()
+    assert get_codec(codec) is codec
+    with pytest.raises(ValueError):
+        get_codec('upper')
+    register_codec('upper', UpperCodec)
+    assert isinstance(get_codec('upper'), UpperCodec)
+
+
+def test_client_codec(dq):
+    qname = 'codecq'
+    q = disq.Disque(codec='json')
+    id = q.addjob(qname, DOC)
+    assert dq.qpeek(qname)[0][2] == JSONCodec().encode(DOC)
+    assert q.qpeek(qname)[0][2] == DOC
+    assert q.getjob(qname) == [qname, id, DOC]
+
+    q.addjobs(qname, [DOC, [1, 2], 'three'])
+    jobs = q.getjobs(qname, count=3)
+    assert [j[2] for j in jobs] == [DOC, [1, 2], 'three']
+
+    # a body that isn't JSON doesn't cost the rest of the batch
+    dq.addjob(qname, b'{not json')
+    q.addjob(qname, 'fine')
+    jobs = q.getjobs(qname, count=2)
+    assert isinstance(jobs[0][2], DecodeError)
+    assert jobs[0][2].body == b'{not json'
+    assert jobs[1][2] == 'fine'
+
+    with q.pipeline() as pipe:
+        pipe.addjob(qname, DOC).qpeek(qname).getjob(qname)
+        _, peeked, job = pipe.execute()
+    assert peeked[0][2] == DOC
+    assert job[2] == DOC
+
+
+def test_queue_codecs(dq):
+    q = disq.Disque(codec='json', queue_codecs={'picklecodecq': 'pickle',
+                                                'rawcodecq': 'raw'},
+                    job_objects=True)
+    q.addjob('jsoncodecq', DOC)
+    q.addjob('picklecodecq', set([1, 2]))
+    q.addjob('rawcodecq', b'raw')
+    jobs = q.getjobs('jsoncodecq', count=3,
+                     queues=['picklecodecq', 'rawcodecq'])
+    bodies = dict((job.queue, job.body) for job in jobs)
+    assert bodies == {'jsoncodecq': DOC, 'picklecodecq': set([1, 2]),
+                      'rawcodecq': b'raw'}
+
+    q2 = pickle.loads(pickle.dumps(q))
+    assert isinstance(q2.queue_codecs['picklecodecq'], PickleCodec)
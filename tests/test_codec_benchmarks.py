@@ -0,0 +1,50 @@
+# Copyright 2015 Ryan Brown <sb@ryansb.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import pytest
+
+from disq.codec import CODECS, get_codec
+
+PAYLOADS = {
+    # a typical small task
+    'small': {'task': 'resize', 'id': 12345, 'args': ['a.png', 640, 480]},
+    # a record with a few hundred fields
+    'wide': dict(('field{0}'.format(i), i * 1.5) for i in range(300)),
+    # a batch of records
+    'nested': [{'id': i, 'tags': ['x', 'y'], 'score': i / 3.0}
+               for i in range(200)],
+}
+
+
+def codec_or_skip(name):
+    try:
+        return get_codec(name)
+    except ImportError:
+        pytest.skip('{0} is not installed'.format(name))
+
+
+@pytest.mark.parametrize('name', sorted(set(CODECS) - set(['raw'])))
+@pytest.mark.parametrize('payload', sorted(PAYLOADS))
+def test_encode_bench(name, payload, benchmark):
+    codec = codec_or_skip(name)
+    benchmark(codec.encode, PAYLOADS[payload])
+
+
+@pytest.mark.parametrize('name', sorted(set(CODECS) - set(['raw'])))
+@pytest.mark.parametrize('payload', sorted(PAYLOADS))
+def test_decode_many_bench(name, payload, benchmark):
+    # decoding the bodies of a GETJOB ... COUNT 100 reply
+    codec = codec_or_skip(name)
+    bodies = [codec.encode(PAYLOADS[payload])] * 100
+    benchmark(codec.decode_many, bodies)
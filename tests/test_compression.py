@@ -0,0 +1,103 @@
+# Copyright 2015 Ryan Brown <sb@ryansb.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+
+import pytest
+
+import disq
+from disq.codec import DecodeError
+from disq.compression import (MAGIC, Compressor, ZlibCompressor, compress,
+                              decompress, get_compressor, register_compressor)
+
+BIG = b'{"key": "value"}' * 1000
+
+
+class ReverseCompressor(Compressor):
+    tag = b'r'
+
+    def compress(self, data):
+        return bytes(data)[::-1][:len(data) // 2]
+
+    def decompress(self, data):
+        return data
+
+
+def test_threshold():
+    zlib = ZlibCompressor()
+    assert compress(zlib, b'small', 1024) == b'small'
+    compressed = compress(zlib, BIG, 1024)
+    assert compressed.startswith(MAGIC + b'z')
+    assert len(compressed) < len(BIG) / 10
+    assert decompress(compressed) == BIG
+    assert decompress(compress(zlib, bytearray(BIG), 1024)) == BIG
+    assert decompress(compress(zlib, memoryview(BIG), 1024)) == BIG
+    assert decompress(compress(zlib, BIG.decode(), 1024)) == BIG
+
+
+def test_incompressible():
+    data = os.urandom(1024)
+    assert compress(ZlibCompressor(), data, 0) == data
+
+
+def test_legacy_bodies():
+    assert decompress(b'plain old body') == b'plain old body'
+    assert decompress({'not': 'bytes'}) == {'not': 'bytes'}
+    with pytest.raises(ValueError):
+        decompress(MAGIC + b'?garbage')
+
+
+def test_optional_compressors():
+    for name in ('lz4', 'zstd'):
+        try:
+            compressor = get_compressor(name)
+        except ImportError:
+            continue
+        assert decompress(compress(compressor, BIG, 0)) == BIG
+        assert decompress(compress(compressor, bytearray(BIG), 0)) == BIG
+
+
+def test_registry():
+    with pytest.raises(ValueError):
+        get_compressor('reverse')
+    register_compressor('reverse', ReverseCompressor)
+    assert isinstance(get_compressor('reverse'), ReverseCompressor)
+
+
+def test_client_compression(dq):
+    qname = 'compressedq'
+    q = disq.Disque(compression='zlib', compress_min_size=100, codec='json')
+    doc = {'key': 'value' * 1000}
+    q.addjob(qname, doc)
+    q.addjob(qname, {'small': 1})
+    raw = dq.execute_command('QPEEK', qname, 2)
+    assert raw[0][2].startswith(MAGIC)
+    assert not raw[1][2].startswith(MAGIC)
+
+    # clients decompress bodies whether they compress their own or not
+    plain = disq.Disque()
+    assert plain.qpeek(qname, 2)[0][2] == q.codec.encode(doc)
+    jobs = q.getjobs(qname, count=2)
+    assert [j[2] for j in jobs] == [doc, {'small': 1}]
+
+
+def test_corrupt_bodies(dq):
+    qname = 'corruptcompressedq'
+    dq.addjobs(qname, [b'good1', MAGIC + b'zNOTZLIB', MAGIC + b'?unknown',
+                       b'good2'])
+    jobs = disq.Disque(codec='raw').getjobs(qname, count=4)
+    assert [j[2] for j in jobs[::3]] == [b'good1', b'good2']
+    for job in jobs[1:3]:
+        assert isinstance(job[2], DecodeError)
+        assert job[2].body.startswith(MAGIC)
@@ -12,7 +12,17 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import multiprocessing
+import os
+import pickle
+import threading
+import time
+
+import pytest
+from redis.connection import ConnectionPool
+
 import disq
+from disq.routing import LowestLatency
 
 
 def test_connection_from_url():
@@ -54,3 +64,399 @@ def test_connection_switch_workload():
     assert node == second.default_node
     assert node != first.default_node
     second._release_connection(conn, node)
+
+
+def double_int(response):
+    return int(response) * 2
+
+
+def test_pickled_client():
+    c = disq.Disque(port=7712, record_job_origin=True)
+    c.set_response_callback('QLEN', double_int)
+    c2 = pickle.loads(pickle.dumps(c))
+    assert c2.default_node == c.default_node
+    assert sorted(c2.connection_pool) == sorted(c.connection_pool)
+    assert c2.record_job_origin
+    assert c2.response_callbacks['QLEN'] is double_int
+    assert c2.response_callbacks['GETJOB'] is c.response_callbacks['GETJOB']
+
+
+def _use_client(c):
+    assert c.ping()
+    os._exit(0)
+
+
+def test_fork_safe_client():
+    c = disq.Disque(fork_safe=True)
+    assert c.ping()
+    conn, node = c._get_connection('PING')
+    c._release_connection(conn, node)
+    sock = conn._sock
+
+    p = multiprocessing.Process(target=_use_client, args=(c,))
+    p.start()
+    p.join()
+    assert p.exitcode == 0
+
+    # the child must not have shut down the parent's socket
+    assert c.ping()
+    conn, node = c._get_connection('PING')
+    assert conn._sock is sock
+    c._release_connection(conn, node)
+
+
+def test_refresh_topology():
+    c = disq.Disque()
+    topology = c.refresh_topology()
+    assert sorted(topology) == sorted(c.connection_pool)
+    assert len(topology) == 4
+    info = topology[c.default_node]
+    assert info['id'].startswith(c.default_node)
+    assert info['port'] == 7711
+    assert info['priority'] == 1
+
+    # nodes that left are dropped and new nodes are picked up, while the
+    # pools of nodes that didn't change are kept
+    other = [n for n in c.connection_pool if n != c.default_node][0]
+    kept = c.connection_pool[c.default_node]
+    del c.connection_pool[other]
+    c.connection_pool['deadbeef'] = ConnectionPool(port=1)
+    c.refresh_topology()
+    assert sorted(c.connection_pool) == sorted(topology)
+    assert c.connection_pool[c.default_node] is kept
+
+
+def test_refresh_topology_fallback():
+    c = disq.Disque()
+    first = c.default_node
+    c.connection_pool[first] = ConnectionPool(port=1)
+    c.refresh_topology()
+    # the default node couldn't be reached, so another node answered HELLO
+    assert c.default_node != first
+    assert c.connection_pool[first].connection_kwargs['port'] == 7711
+    assert c.ping()
+
+
+def test_refresh_topology_after_error():
+    c = disq.Disque()
+    c.connection_pool['deadbeef'] = ConnectionPool(port=1)
+    with pytest.raises(disq.ConnectionError):
+        c._execute_on('deadbeef', 'PING')
+    assert c.ping()
+    assert 'deadbeef' not in c.connection_pool
+
+
+def test_periodic_topology_refresh():
+    c = disq.Disque(topology_refresh_secs=0.1)
+    c.connection_pool['deadbeef'] = ConnectionPool(port=1)
+    assert c.ping()
+    assert 'deadbeef' in c.connection_pool
+    time.sleep(0.2)
+    assert c.ping()
+    assert 'deadbeef' not in c.connection_pool
+
+
+def test_failing_nodes_are_avoided():
+    c = disq.Disque(record_job_origin=True)
+    other = [n for n in c.connection_pool if n != c.default_node][0]
+    for _ in range(10):
+        c._job_score.add(other)
+    assert c._get_node('GETJOB') == other
+    c.topology[other]['priority'] = 100
+    assert c._get_node('GETJOB') == c.default_node
+
+
+def test_lazy_client():
+    c = disq.Disque(port=1, lazy=True)
+    assert list(c.connection_pool) == ['default']
+    assert c.topology == {}
+    with pytest.raises(disq.ConnectionError):
+        c.ping()
+
+    c = disq.Disque(lazy=True)
+    assert c.ping()
+    assert len(c.topology) == 4
+    assert c.default_node in c.connection_pool
+    c2 = pickle.loads(pickle.dumps(c))
+    assert c2.topology == {}
+    assert c2.ping()
+
+
+def test_warmup():
+    c = disq.Disque(lazy=True)
+    opened = c.warmup(connections_per_node=3)
+    assert len(opened) == 4
+    assert set(opened.values()) == set([3])
+    for pool in c.connection_pool.values():
+        assert len(pool._available_connections) == 3
+        assert all(conn._sock is not None
+                   for conn in pool._available_connections)
+    assert c.ping()
+    assert len(c.connection_pool[c.default_node]._available_connections) == 3
+
+    c.connection_pool['deadbeef'] = ConnectionPool(port=1)
+    c._topology_stale = False
+    assert c.warmup()['deadbeef'] == 0
+
+
+def _routed(c, n=40, queue='routedq'):
+    before = dict((node, s['routed']) for node, s in c.node_stats().items())
+    for _ in range(n):
+        c.addjob(queue, 'body')
+    return dict((node, s['routed'] - before.get(node, 0))
+                for node, s in c.node_stats().items())
+
+
+def test_default_producer_routing():
+    c = disq.Disque()
+    routed = _routed(c)
+    assert routed[c.default_node] == 40
+
+
+def test_round_robin_routing():
+    c = disq.Disque(producer_routing='round_robin')
+    routed = _routed(c)
+    assert sorted(routed.values()) == [10, 10, 10, 10]
+    assert all(s['outstanding'] == 0 for s in c.node_stats().values())
+
+
+def test_random_routing():
+    c = disq.Disque(producer_routing='random')
+    routed = _routed(c, n=200)
+    assert len([n for n in routed.values() if n]) > 1
+
+
+def test_least_outstanding_routing():
+    c = disq.Disque(producer_routing='least_outstanding')
+    busy = c.default_node
+    c._outstanding[busy] += 5
+    routed = _routed(c)
+    assert routed[busy] == 0
+    assert sum(routed.values()) == 40
+
+
+def test_sticky_routing():
+    c = disq.Disque(producer_routing='sticky')
+    routed = _routed(c, n=10, queue='stickyq')
+    assert sorted(routed.values()) == [0, 0, 0, 10]
+    c2 = disq.Disque(port=7712, producer_routing='sticky')
+    routed2 = _routed(c2, n=10, queue='stickyq')
+    assert routed2 == routed
+
+
+def test_routing_skips_failing_nodes():
+    c = disq.Disque(producer_routing='round_robin')
+    other = [n for n in c.connection_pool if n != c.default_node][0]
+    c.topology[other]['priority'] = 100
+    assert _routed(c)[other] == 0
+
+
+def test_pipeline_routing():
+    c = disq.Disque(producer_routing='round_robin')
+    with c.pipeline() as pipe:
+        for _ in range(8):
+            pipe.addjob('routedq', 'body')
+        assert len(set(pipe.execute())) == 8
+    assert [s['routed'] for s in c.node_stats().values()] == [2, 2, 2, 2]
+
+
+def test_stats_locks_are_per_node():
+    c = disq.Disque()
+    nodes = ['node%d' % i for i in range(100)]
+    busy = nodes[0]
+    other = next(node for node in nodes
+                 if c._stats_lock(node) is not c._stats_lock(busy))
+    done = threading.Event()
+
+    def count():
+        c._started(other)
+        c._finished(other, elapsed=0.01)
+        done.set()
+    with c._stats_lock(busy):
+        threading.Thread(target=count).start()
+        done.wait(5)
+        assert done.is_set()
+    assert c._routed[other] == 1
+    assert c._outstanding[other] == 0
+    assert c._latency[other] == 0.01
+
+
+def test_unknown_routing_policy():
+    with pytest.raises(ValueError):
+        disq.Disque(producer_routing='nope')
+
+
+def test_latency_tracking():
+    c = disq.Disque(latency_alpha=0.5)
+    # the HELLO sent to discover the cluster is measured too
+    assert 0 < c.node_stats()[c.default_node]['latency'] < 1
+    c._latency.clear()
+    assert c.node_stats()[c.default_node]['latency'] is None
+    c.ping()
+    first = c.node_stats()[c.default_node]['latency']
+    assert 0 < first < 1
+    c._finished(c.default_node, 0, elapsed=first + 1)
+    assert c.node_stats()[c.default_node]['latency'] == \
+        pytest.approx(first + 0.5)
+
+    latency = c.probe_latency()
+    assert sorted(latency) == sorted(c.connection_pool)
+
+    # GETJOB may block waiting for jobs, so it isn't measured
+    c._latency.clear()
+    c.getjob('latencyq', timeout_ms=100)
+    assert c._latency == {}
+    # unless it can't block
+    c.getjobs('latencyq', nohang=True)
+    assert list(c._latency) == [c.default_node]
+
+    lazy = disq.Disque(lazy=True)
+    assert sorted(lazy.probe_latency()) == sorted(lazy.connection_pool)
+
+    with pytest.raises(ValueError):
+        disq.Disque(latency_alpha=0)
+
+
+def test_lowest_latency_routing():
+    c = disq.Disque(producer_routing=LowestLatency(explore=0),
+                    read_routing=LowestLatency(explore=0))
+    c.probe_latency()
+    fast = [n for n in c.connection_pool if n != c.default_node][0]
+    for node in c._latency:
+        c._latency[node] = 0.5
+    c._latency[fast] = 0.001
+    assert c._get_node('ADDJOB', ('ADDJOB', 'q', 'body')) == fast
+    assert c._get_node('GETJOB') == fast
+    # nodes that haven't been measured yet count as the median node, so
+    # they don't win over a node known to be faster
+    del c._latency[c.default_node]
+    assert c._get_node('ADDJOB', ('ADDJOB', 'q', 'body')) == fast
+    c._latency[fast] = 1
+    assert c._get_node('ADDJOB', ('ADDJOB', 'q', 'body')) != fast
+    # with nothing measured, nodes are picked at random
+    c._latency.clear()
+    assert len(set(c._get_node('ADDJOB', ('ADDJOB', 'q', 'body'))
+                   for _ in range(100))) > 1
+
+
+def test_job_origin_latency_routing():
+    c = disq.Disque(record_job_origin=True, read_routing='job_origin_latency')
+    c.read_routing.explore = 0
+    nodes = sorted(c.connection_pool)
+    busy, fast = nodes[0], nodes[1]
+    for node in nodes:
+        c._latency[node] = 0.01
+    for _ in range(9):
+        c._job_score.add(busy)
+    assert c._get_node('GETJOB') == busy
+
+    # 10 jobs from busy is worth less than 1 job from a node 20x faster
+    c._latency[fast] = 0.0005
+    assert c._get_node('GETJOB') == fast
+    # but not more than 100 jobs
+    for _ in range(100):
+        c._job_score.add(busy)
+    assert c._get_node('GETJOB') == busy
+
+
+def test_per_queue_job_origin():
+    c = disq.Disque(record_job_origin=True)
+    nodes = sorted(c.connection_pool)
+    for _ in range(10):
+        c._got_jobs([['hotq', 'DI' + nodes[0] + 'xxSQ', b'']])
+    c._got_jobs([['coldq', 'DI' + nodes[1] + 'xxSQ', b'']])
+
+    def getjob_node(*queues):
+        return c._get_node('GETJOB', c._getjob_args(queues[0],
+                                                    queues=queues[1:]))
+
+    assert getjob_node('coldq') == nodes[1]
+    assert c._get_node('GETJOB', c._getjob_args('coldq',
+                                                nohang=True)) == nodes[1]
+    assert getjob_node('hotq') == nodes[0]
+    assert getjob_node('hotq', 'coldq') == nodes[0]
+    # queues nothing was received from use the global score
+    assert getjob_node('newq') == nodes[0]
+    # acknowledgements of unknown jobs too
+    assert c._get_node('ACKJOB') == nodes[0]
+
+
+def _break_node(c, node):
+    # point the node's pool at a port nobody listens on
+    c.connection_pool[node] = ConnectionPool(host='127.0.0.1', port=1)
+
+
+def test_failover():
+    c = disq.Disque(failover=True, failure_threshold=1)
+    dead = c.default_node
+    _break_node(c, dead)
+    assert c.addjob('failoverq', 'body')
+    assert c._breaker.state(dead) == 'open'
+    # the node is left alone while its circuit is open, even once the
+    # topology refresh gave it a working pool again
+    assert c.ping()
+    assert c.node_stats()[dead]['routed'] == 1
+
+    # half-open: a PING probe closes the circuit
+    c._breaker.reset_timeout_secs = 0
+    assert c._failover_node(dead, set()) == dead
+    assert c._breaker.state(dead) == 'closed'
+    assert c.node_stats()[dead]['routed'] == 2
+
+
+def test_failover_gives_up():
+    c = disq.Disque(failover=True, failure_threshold=1)
+    for node in list(c.connection_pool):
+        _break_node(c, node)
+    c._prepare = lambda: None
+    with pytest.raises(disq.ConnectionError):
+        c.ping()
+    assert sorted(c._breaker.open_nodes()) == sorted(c.connection_pool)
+    with pytest.raises(disq.ConnectionError):
+        c.ping()
+
+
+def test_failover_retries_stale_connections():
+    c = disq.Disque(failover=True)
+    node = c.default_node
+    pool = c.connection_pool[node]
+    connection = pool.get_connection('PING')
+    connection.connect()
+    # the node dropped the pooled connection while it was idle
+    connection._sock.close()
+    pool.release(connection)
+    assert c.addjob('failoverq', 'body')
+    assert c._breaker.state(node) == 'closed'
+    assert c.default_node == node
+
+    # a node that is really down needs failure_threshold failures in a row
+    _break_node(c, node)
+    c._prepare = lambda: None
+    assert c.ping()
+    assert c._breaker.state(node) == 'closed'
+    c.ping()
+    c.ping()
+    assert c._breaker.state(node) == 'open'
+
+
+def test_failover_split_jobs():
+    c = disq.Disque(failover=True, failure_threshold=1,
+                    producer_routing='round_robin')
+    ids = [c.addjob('failoversplitq', 'body') for _ in range(8)]
+    owners = sorted(set(c._job_owner(id) for id in ids))
+    assert len(owners) > 1
+    dead = owners[0]
+    _break_node(c, dead)
+    c._prepare = lambda: None
+    # the dead node's share fails over, the rest go to their owners
+    assert c.ackjob(*ids[:4]) == 4
+    assert c._breaker.state(dead) == 'open'
+    # with its circuit open, the node isn't even tried
+    assert c.fastack(*ids[4:]) == 4
+
+
+def test_no_failover_by_default():
+    c = disq.Disque()
+    _break_node(c, c.default_node)
+    with pytest.raises(disq.ConnectionError):
+        c.addjob('failoverq', 'body')
@@ -0,0 +1,80 @@
+# Copyright 2015 Ryan Brown <sb@ryansb.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import time
+
+import pytest
+
+from disq.consumer import PrefetchConsumer
+
+
+class TestPrefetchConsumer(object):
+    def test_prefetch(self, dq):
+        qname = 'prefetchq'
+        ids = dq.addjobs(qname, ['foo {0}'.format(i) for i in range(50)])
+        with PrefetchConsumer(dq, qname, maxsize=20, low_water=5,
+                              timeout_ms=10, max_age_secs=5) as consumer:
+            first = consumer.get(timeout=1)
+            assert first[1] == ids[0]
+            time.sleep(0.1)
+            # one job in 10 seconds is too slow to prefetch more than the
+            # low water mark
+            assert 1 <= len(consumer) <= 5
+            jobs = [first] + [next(consumer) for _ in range(49)]
+            assert [j[1] for j in jobs] == ids
+            assert consumer.get(timeout=0.05) is None
+            stats = consumer.stats()
+        assert stats['delivered'] == 50
+        assert stats['fetched'] == 50
+        assert stats['depth'] == 0
+        assert stats['expired'] == 0
+
+    def test_capacity_follows_rate(self, dq):
+        qname = 'prefetchrateq'
+        dq.addjobs(qname, ['foo'] * 100)
+        consumer = PrefetchConsumer(dq, qname, maxsize=50, low_water=2,
+                                    timeout_ms=10, max_age_secs=1,
+                                    rate_window_secs=1)
+        assert consumer.stats()['capacity'] == 2
+        for _ in range(20):
+            consumer.get(timeout=1)
+        # 20 jobs/sec for 1 sec
+        assert consumer.stats()['capacity'] == 20
+        consumer.close()
+
+    def test_stale_jobs_are_requeued(self, dq):
+        qname = 'prefetchstaleq'
+        ids = dq.addjobs(qname, ['foo', 'bar'])
+        consumer = PrefetchConsumer(dq, qname, maxsize=2, low_water=2,
+                                    timeout_ms=10, max_age_secs=0.1)
+        time.sleep(0.2)
+        assert consumer.get(timeout=0.01) in (None, [qname, ids[0], b'foo'],
+                                              [qname, ids[1], b'bar'])
+        consumer.close()
+        assert consumer.stats()['expired'] >= 2
+        assert dq.qlen(qname) == 2
+
+    def test_close_returns_jobs(self, dq):
+        qname = 'prefetchcloseq'
+        dq.addjobs(qname, ['foo'] * 10)
+        consumer = PrefetchConsumer(dq, qname, maxsize=10, low_water=10,
+                                    timeout_ms=10)
+        time.sleep(0.1)
+        assert dq.qlen(qname) == 0
+        consumer.close()
+        assert consumer.stats()['returned'] == 10
+        assert dq.qlen(qname) == 10
+        assert consumer.get() is None
+        with pytest.raises(StopIteration):
+            next(consumer)
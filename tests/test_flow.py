@@ -0,0 +1,118 @@
+# Copyright 2015 Ryan Brown <sb@ryansb.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import pickle
+import threading
+import time
+
+import pytest
+
+import disq
+from disq.flow import FlowController, QueueFull
+
+
+def test_raise_mode(dq):
+    qname = 'flowraiseq'
+    flow = FlowController(high_water=5, low_water=2, sample_secs=0.05,
+                          mode='raise')
+    c = disq.Disque(flow_control=flow)
+    for _ in range(5):
+        c.addjob(qname, 'body')
+    with pytest.raises(QueueFull):
+        c.addjob(qname, 'body')
+    assert flow.stats()[qname] == {'length': 5, 'paused': True}
+    assert flow.rejected == 1
+
+    # still paused above the low-water mark
+    dq.getjobs(qname, count=2)
+    time.sleep(0.1)
+    with pytest.raises(QueueFull):
+        c.addjob(qname, 'body')
+    dq.getjob(qname)
+    time.sleep(0.1)
+    assert c.addjob(qname, 'body')
+    assert flow.stats()[qname] == {'length': 3, 'paused': False}
+
+
+def test_addjobs_results(dq):
+    qname = 'flowbulkq'
+    flow = FlowController(high_water=150, mode='raise')
+    c = disq.Disque(flow_control=flow)
+    results = c.addjobs(qname, ['body'] * 300, chunk_size=100)
+    assert len(results) == 300
+    assert all(isinstance(r, str) for r in results[:150])
+    assert all(isinstance(r, QueueFull) for r in results[150:])
+    assert dq.qlen(qname) == 150
+
+
+def test_samples_are_cached(dq):
+    qname = 'flowcachedq'
+    flow = FlowController(high_water=100, sample_secs=60)
+    c = disq.Disque(flow_control=flow)
+    samples = []
+    qlen = c.qlen
+    c.qlen = lambda queue: samples.append(queue) or qlen(queue)
+    c.addjobs(qname, ['body'] * 10)
+    assert samples == [qname]
+    assert flow.stats()[qname]['length'] == 10
+
+
+def test_routed_clients_sample_every_node(dq):
+    qname = 'flowroutedq'
+    flow = FlowController(high_water=100, sample_secs=60)
+    c = disq.Disque(flow_control=flow, producer_routing='round_robin')
+    sampled = []
+    execute_on = c._execute_on
+
+    def record(node, *args, **options):
+        if args[0] == 'QLEN':
+            sampled.append(node)
+        return execute_on(node, *args, **options)
+    c._execute_on = record
+    c.addjob(qname, 'body')
+    assert sorted(sampled) == sorted(c.connection_pool)
+    assert len(sampled) > 1
+
+
+def test_block_mode(dq):
+    qname = 'flowblockq'
+    flow = FlowController(high_water=3, low_water=1, sample_secs=0.05)
+    c = disq.Disque(flow_control=flow)
+    c.addjobs(qname, ['body'] * 3)
+
+    def consume():
+        dq.getjobs(qname, count=2)
+    threading.Timer(0.2, consume).start()
+    start = time.time()
+    assert c.addjob(qname, 'body')
+    assert time.time() - start >= 0.2
+    assert flow.waited
+
+    flow.max_wait_secs = 0.1
+    c.addjob(qname, 'body')
+    with pytest.raises(QueueFull):
+        c.addjob(qname, 'body')
+
+
+def test_pickle():
+    flow = pickle.loads(pickle.dumps(FlowController(high_water=10)))
+    assert flow.low_water == 5
+    assert flow.stats() == {}
+
+
+def test_bad_settings():
+    with pytest.raises(ValueError):
+        FlowController(high_water=10, low_water=10)
+    with pytest.raises(ValueError):
+        FlowController(high_water=10, mode='drop')
@@ -0,0 +1,95 @@
+# Copyright 2015 Ryan Brown <sb@ryansb.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import pickle
+
+import pytest
+
+import disq
+from disq.job import Job
+
+JOB_ID = 'DI0f0c644f2d0000000000000000000000000000SQ'
+
+
+def test_lazy_decoding():
+    job = Job(b'queue', JOB_ID.encode(), b'body')
+    assert job._queue == b'queue'
+    assert job[1] == JOB_ID
+    assert job[2] == b'body'
+    # only the ID was used
+    assert job._queue == b'queue'
+    assert job.queue == 'queue'
+    assert job.origin == '0f0c644f'
+
+
+def test_sequence():
+    job = Job(b'queue', JOB_ID.encode(), b'body')
+    queue, id, body = job
+    assert (queue, id, body) == ('queue', JOB_ID, b'body')
+    assert len(job) == 3
+    assert job[0] == 'queue'
+    assert job[-1] == b'body'
+    assert job[:2] == ('queue', JOB_ID)
+    assert job == ['queue', JOB_ID, b'body']
+    assert job != ['queue', JOB_ID, b'other']
+
+
+def test_slots():
+    job = Job(b'queue', JOB_ID.encode(), b'body')
+    with pytest.raises(AttributeError):
+        job.foo = 'bar'
+
+
+def test_pickle():
+    job = Job(b'queue', JOB_ID.encode(), b'body', client=object())
+    job2 = pickle.loads(pickle.dumps(job))
+    assert job2 == job
+    assert job2.client is None
+    with pytest.raises(RuntimeError):
+        job2.ack()
+
+
+def test_job_objects(dq):
+    qname = 'jobobjq'
+    q = disq.Disque(job_objects=True, record_job_origin=True)
+    id = q.addjob(qname, 'foobar')
+    job = q.getjob(qname)
+    assert isinstance(job, Job)
+    assert job == [qname, id, b'foobar']
+    assert job.origin == q._job_owner(id)
+    assert job.requeue() == 1
+    assert job.fastack() == 1
+
+    # recording where jobs come from doesn't decode them
+    id = q.addjob(qname, 'foobar')
+    job = q.getjob(qname)
+    assert isinstance(job._queue, bytes) and isinstance(job._id, bytes)
+    assert q._queue_score.max([qname]) == q._job_owner(id)
+    job.fastack()
+
+    q.addjobs(qname, ['foo', 'bar'])
+    jobs = q.getjobs(qname, count=2)
+    assert [j.body for j in jobs] == [b'foo', b'bar']
+    assert sum(j.ack() for j in jobs) == 2
+    assert dq.qlen(qname) == 0
+
+
+def test_pipelined_job_objects(dq):
+    qname = 'jobobjpipeq'
+    q = disq.Disque(job_objects=True)
+    q.addjob(qname, 'foobar')
+    with q.pipeline() as pipe:
+        job = pipe.getjob(qname).execute()[0]
+    assert job.client is q
+    assert job.ack() == 1
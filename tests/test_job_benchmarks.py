@@ -11,8 +11,14 @@
 # WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 # See the License for the specific language governing permissions and
 # limitations under the License.
+import pytest
 import six
 
+import disq
+from disq.connection import DisqueConnection
+from disq.job import Job
+from disq.parsers import parse_job_resp, parse_job_resp_raw
+
 
 def addjob(dq, **kwargs):
     def inner():
@@ -20,6 +26,12 @@ def addjob(dq, **kwargs):
     return inner
 
 
+def addjobs(dq, **kwargs):
+    def inner():
+        dq.addjobs(**kwargs)
+    return inner
+
+
 def getjob(dq, **kwargs):
     def inner():
         dq.getjob(**kwargs)
@@ -53,3 +65,66 @@ def test_getjob_bench(dq, benchmark):
     for _ in six.moves.range(10000):
         dq.addjob(queue=qname, body='foo')
     benchmark(getjob(dq, queue=qname, timeout_ms=1))
+
+
+def test_addjobs_bench(dq, benchmark):
+    qname = 'benchbulkq'
+    assert dq.getjob(qname, timeout_ms=1) is None
+    benchmark(addjobs(dq, queue=qname, bodies=['foo'] * 100))
+    assert dq.qlen(qname)
+
+
+def test_getjob_raw_bench(dq, benchmark):
+    qname = 'benchrawconsume'
+    raw = disq.Disque(raw_jobs=True)
+    assert dq.getjob(qname, timeout_ms=1) is None
+    for _ in six.moves.range(10000):
+        dq.addjob(queue=qname, body='foo' * 1000)
+    benchmark(getjob(raw, queue=qname, timeout_ms=1))
+
+
+def allocations(func, *args):
+    "Number of memory blocks and bytes still allocated by func(*args)"
+    tracemalloc = pytest.importorskip('tracemalloc')
+    tracemalloc.start()
+    try:
+        before = tracemalloc.take_snapshot()
+        result = func(*args)
+        after = tracemalloc.take_snapshot()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    diff = after.compare_to(before, 'filename')
+    del result
+    return (sum(s.count_diff for s in diff), sum(s.size_diff for s in diff),
+            peak)
+
+
+def test_parse_job_allocations():
+    response = [[b'queue', b'DI0f0c644f2d0000000000000000000000000000SQ',
+                 b'x' * 1000] for _ in range(1000)]
+    blocks, size, _ = allocations(parse_job_resp, response)
+    raw_blocks, raw_size, _ = allocations(parse_job_resp_raw, response)
+    assert raw_blocks < blocks / 100, (raw_blocks, blocks)
+    assert raw_size < size, (raw_size, size)
+
+
+def test_job_object_allocations():
+    response = [[b'queue', b'DI0f0c644f2d0000000000000000000000000000SQ',
+                 b'x' * 1000] for _ in range(1000)]
+    _, size, _ = allocations(parse_job_resp, response)
+    _, job_size, _ = allocations(
+        lambda: [Job(q, i, b) for q, i, b in response])
+    assert job_size < size / 2, (job_size, size)
+
+
+def test_pack_buffer_allocations():
+    connection = DisqueConnection()
+    body = bytearray(500 * 1024)
+    # without buffer support, a bytearray had to be copied to bytes first
+    _, _, copied = allocations(
+        lambda: connection.pack_command('ADDJOB', 'q', bytes(body), 0))
+    _, _, packed = allocations(
+        lambda: connection.pack_command('ADDJOB', 'q', body, 0))
+    # the bytearray is sent as it is, while bytes(body) peaks at a copy
+    assert packed < len(body) / 100 < copied, (packed, copied)
@@ -14,8 +14,13 @@
 
 import json
 import pytest
+import socket
+import threading
 import time
 
+from redis.connection import ConnectionPool
+from redis.exceptions import ResponseError, TimeoutError
+
 import disq
 
 
@@ -103,3 +108,187 @@ def test_json_job():
     q.addjob(qname, json.dumps(job))
     j = q.getjob(qname)
     assert j[2] == job
+
+    q.addjob(qname, disq.parsers.write_json_job(job))
+    assert q.getjob(qname)[2] == job
+
+
+def test_raw_jobs(dq):
+    qname = 'rawq'
+    q = disq.Disque(raw_jobs=True, record_job_origin=True)
+    body = b'x' * 100000
+    id = q.addjob(qname, body)
+    job = q.getjob(qname)
+    assert job == [qname.encode(), id.encode(), body]
+    assert q._get_node('GETJOB', q._getjob_args(qname)) == \
+        q._job_owner(id)
+    assert q.fastack(job[1]) == 1
+
+
+def test_buffer_bodies(dq):
+    qname = 'bufferq'
+    body = bytearray(b'foo' * 5000)
+    dq.addjob(qname, body)
+    dq.addjob(qname, memoryview(b'bar'))
+    dq.addjob(qname, bytearray(b'baz'))
+    dq.addjobs(qname, [memoryview(body), bytearray(b'quux')])
+    jobs = dq.getjobs(qname, timeout_ms=1, count=5)
+    assert [j[2] for j in jobs] == [bytes(body), b'bar', b'baz', bytes(body),
+                                    b'quux']
+
+
+def test_addjobs(dq):
+    qname = 'bulkq'
+    assert dq.getjob(qname, timeout_ms=1) is None
+    bodies = ('foobar {0}'.format(i) for i in range(250))
+    ids = dq.addjobs(qname, bodies, chunk_size=100)
+    assert len(ids) == 250
+    assert dq.qlen(qname) == 250
+    jobs = dq.getjobs(qname, timeout_ms=1, count=250)
+    assert [j[1] for j in jobs] == ids
+    assert jobs[-1][2] == b'foobar 249'
+
+
+def test_addjobs_with_options(dq):
+    qname = 'bulkoptsq'
+    assert dq.getjob(qname, timeout_ms=1) is None
+    ids = dq.addjobs_with_options(qname, [
+        {'body': 'foo'},
+        {'body': 'bar', 'maxlen': 1},
+        {'body': 'baz', 'queue': 'bulkotherq'},
+    ])
+    assert len(ids) == 3
+    assert isinstance(ids[1], disq.ResponseError)
+    assert dq.qlen(qname) == 1
+    assert dq.getjob('bulkotherq', timeout_ms=1)[1] == ids[2]
+
+
+def test_job_commands_go_to_owner(dq):
+    qname = 'ownerq'
+    producer = disq.Disque(producer_routing='round_robin')
+    ids = [producer.addjob(qname, 'foobar') for _ in range(8)]
+    owners = set(dq._job_owner(id) for id in ids)
+    assert owners == set(dq.connection_pool)
+
+    before = dq.node_stats()
+    assert dq.enqueue(*ids) == 0
+    assert dq.dequeue(*ids) == 8
+    dq.enqueue(*ids)
+    assert dq.show(ids[0])
+    assert dq.ackjob(*ids[:4]) == 4
+    assert dq.fastack(*ids[4:6]) == 2
+    assert dq.deljob(*ids[6:]) == 2
+    after = dq.node_stats()
+    # every node got its share of the 7 commands, except SHOW
+    assert sorted(after[n]['routed'] - before[n]['routed']
+                  for n in owners) == [5, 5, 5, 6]
+
+    assert dq.deljob(*ids) == 0
+
+
+def test_job_commands_unknown_owner(dq):
+    with pytest.raises(disq.ResponseError):
+        dq.ackjob('not-a-job-id')
+    job_id = 'DIdeadbeef' + dq.addjob('ownerq', 'foobar')[10:]
+    assert dq._get_node('ACKJOB', ('ACKJOB', job_id)) == dq.default_node
+    assert dq.ackjob(job_id) == 0
+
+
+def _slow_node(reply=None, delay=0):
+    """
+    Listen on a free port like a node that takes ``delay`` seconds to send
+    ``reply`` to the first command, or never replies if reply is None. Later
+    commands are passed on to a real node.
+    """
+    server = socket.socket()
+    server.bind(('127.0.0.1', 0))
+    server.listen(1)
+
+    def serve():
+        conn, _ = server.accept()
+        conn.recv(65536)
+        time.sleep(delay)
+        if reply is not None:
+            conn.sendall(reply)
+        node = socket.create_connection(('127.0.0.1', 7711))
+        command = conn.recv(65536)
+        while command:
+            node.sendall(command)
+            conn.sendall(node.recv(65536))
+            command = conn.recv(65536)
+        node.close()
+        conn.close()
+        server.close()
+    thread = threading.Thread(target=serve)
+    thread.daemon = True
+    thread.start()
+    return server.getsockname()[1]
+
+
+def _hedged_client(port, socket_timeout=None, **kwargs):
+    c = disq.Disque(hedge_after_secs=0.05, **kwargs)
+    c.connection_pool[c.default_node] = ConnectionPool(
+        host='127.0.0.1', port=port, socket_timeout=socket_timeout)
+    c._prepare = lambda: None
+    return c
+
+
+def test_hedged_getjob(dq):
+    qname = 'hedgedq'
+    id = dq.addjob(qname, 'body')
+    c = _hedged_client(_slow_node(), hedge_drain_secs=0.1)
+    start = time.time()
+    assert c.getjob(qname, timeout_ms=5000)[1] == id
+    assert time.time() - start < 1
+
+
+def test_hedged_getjob_requeues_loser(dq):
+    qname = 'hedgedloserq'
+    late = dq.addjob(qname, 'late')
+    dq.getjob(qname)
+    id = dq.addjob(qname, 'body')
+    reply = ('*1\r\n*3\r\n$%d\r\n%s\r\n$%d\r\n%s\r\n$4\r\nlate\r\n' % (
+        len(qname), qname, len(late), late)).encode()
+    c = _hedged_client(_slow_node(reply, delay=0.2))
+    assert c.getjob(qname, timeout_ms=5000)[1] == id
+    for _ in range(20):
+        if dq.qlen(qname):
+            break
+        time.sleep(0.1)
+    assert dq.getjob(qname, timeout_ms=1)[1] == late
+
+
+def test_hedged_getjob_primary_wins(dq):
+    qname = 'hedgedemptyq'
+    c = disq.Disque(hedge_after_secs=0.05)
+    threading.Timer(0.2, dq.addjob, (qname, 'body')).start()
+    job = c.getjob(qname, timeout_ms=5000)
+    assert job[2] == b'body'
+    assert c.getjob(qname, timeout_ms=1) is None
+
+
+def test_hedge_error_discards_primary(dq):
+    c = disq.Disque(hedge_after_secs=0.05)
+
+    def hedge(args, primary):
+        raise ResponseError('ERR hedge failed')
+    c._hedge = hedge
+    with pytest.raises(ResponseError):
+        c.getjob('hedgeerrorq', timeout_ms=200)
+    # the unread GETJOB reply isn't handed to the next command
+    time.sleep(0.3)
+    assert c.ping()
+
+
+def test_hedged_getjob_timeout_isnt_retried(dq):
+    c = _hedged_client(_slow_node(), socket_timeout=0.1)
+    c._hedge = lambda args, primary: None
+    sent = []
+    pool = c.connection_pool[c.default_node]
+    connection = pool.get_connection('GETJOB')
+    send_command = connection.send_command
+    connection.send_command = lambda *a: sent.append(a) or send_command(*a)
+    pool.release(connection)
+    with pytest.raises(TimeoutError):
+        c.getjob('hedgetimeoutq', timeout_ms=5000)
+    assert len(sent) == 1
@@ -0,0 +1,63 @@
+# Copyright 2015 Ryan Brown <sb@ryansb.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import pytest
+
+import disq
+
+
+class TestPipeline(object):
+    def test_pipeline_round_trip(self, dq):
+        qname = 'pipeq'
+        assert dq.getjob(qname, timeout_ms=1) is None
+        with dq.pipeline() as pipe:
+            pipe.addjob(qname, 'foo').addjob(qname, 'bar').qlen(qname)
+            assert len(pipe) == 3
+            first, second, qlen = pipe.execute()
+            assert len(pipe) == 0
+        assert qlen == 2
+
+        with dq.pipeline() as pipe:
+            pipe.getjob(qname, timeout_ms=1)
+            pipe.getjobs(qname, timeout_ms=1, count=5)
+            job, jobs = pipe.execute()
+        assert job == [qname, first, b'foo']
+        assert jobs == [[qname, second, b'bar']]
+
+    def test_empty_pipeline(self, dq):
+        assert dq.pipeline().execute() == []
+
+    def test_pipeline_errors(self, dq):
+        qname = 'pipeerrq'
+        assert dq.getjob(qname, timeout_ms=1) is None
+        dq.addjob(qname, 'foo')
+
+        pipe = dq.pipeline()
+        pipe.addjob(qname, 'bar', maxlen=1).qlen(qname)
+        with pytest.raises(disq.ResponseError) as e:
+            pipe.execute()
+        assert 'Command # 1 (ADDJOB' in str(e.value)
+
+        pipe.addjob(qname, 'bar', maxlen=1).qlen(qname)
+        err, qlen = pipe.execute(raise_on_error=False)
+        assert isinstance(err, disq.ResponseError)
+        assert qlen == 1
+
+    def test_pipeline_records_job_origin(self, dq):
+        qname = 'pipeoriginq'
+        c = disq.Disque(record_job_origin=True)
+        assert c.getjob(qname, timeout_ms=1) is None
+        c.addjob(qname, 'foo')
+        c.pipeline().getjob(qname, timeout_ms=1).execute()
+        assert c._job_score.keys() == [c.default_node]
@@ -12,8 +12,10 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import threading
 import time
-from disq.rolling_counter import RollingCounter
+from disq.rolling_counter import (ExactRollingCounter, KeyedRollingCounter,
+                                  RollingCounter, ShardedRollingCounter)
 
 
 class TestRollingCounter(object):
@@ -45,3 +47,169 @@ class TestRollingCounter(object):
         assert rc.min() is None
         assert not rc.ranked()
         assert rc.count('foo') == 0
+
+    def test_buckets(self):
+        rc = RollingCounter(ttl_secs=0.5, buckets=5)
+        rc.add('foo')
+        time.sleep(0.3)
+        rc.add('foo')
+        rc.add('bar')
+        assert rc.count('foo') == 2
+        time.sleep(0.3)
+        # the first 'foo' has expired, the second hasn't
+        assert rc.count('foo') == 1
+        assert rc.count('bar') == 1
+        time.sleep(0.3)
+        assert rc.keys() == []
+
+    def test_remove(self):
+        rc = RollingCounter()
+        rc.add('foo')
+        rc.add('bar')
+        rc.remove('foo')
+        assert rc.keys() == ['bar']
+        assert rc.count('foo') == 0
+
+
+class TestExactRollingCounter(object):
+    def test_rank(self):
+        rc = ExactRollingCounter()
+        for _ in range(3):
+            rc.add('foo')
+        rc.add('bar')
+        assert rc.max() == 'foo'
+        assert rc.min() == 'bar'
+        assert rc.ranked() == [('bar', 1), ('foo', 3)]
+
+    def test_expiration(self):
+        rc = ExactRollingCounter(ttl_secs=0.5)
+        rc.add('foo')
+        assert rc.count('foo') == 1
+        time.sleep(1)
+        assert rc.count('foo') == 0
+        assert rc.max() is None
+
+
+class TestShardedRollingCounter(object):
+    def test_rank(self):
+        rc = ShardedRollingCounter(shards=4)
+        for _ in range(100):
+            rc.add('foo')
+        for _ in range(10):
+            rc.add('bar')
+        for _ in range(40):
+            rc.add('baz')
+        assert rc.max() == 'foo'
+        assert rc.min() == 'bar'
+        assert rc.ranked() == [('bar', 10), ('baz', 40), ('foo', 100)]
+        rc.remove('baz')
+        assert sorted(rc.keys()) == ['bar', 'foo']
+
+    def test_expiration(self):
+        rc = ShardedRollingCounter(ttl_secs=0.5)
+        rc.add('foo')
+        assert rc.count('foo') == 1
+        time.sleep(1)
+        assert rc.count('foo') == 0
+        assert rc.max() is None
+
+    def test_threads(self):
+        rc = ShardedRollingCounter(shards=4)
+        errors = []
+
+        def add(key):
+            try:
+                for _ in range(2000):
+                    rc.add(key)
+            except Exception as e:
+                errors.append(e)
+
+        def read():
+            try:
+                for _ in range(500):
+                    rc.max()
+                    rc.keys()
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=add, args=(k,))
+                   for k in ['foo', 'bar'] * 4]
+        threads.append(threading.Thread(target=read))
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        assert not errors
+        assert rc.count('foo') == 8000
+        assert rc.count('bar') == 8000
+
+
+class TestKeyedRollingCounter(object):
+    def test_max(self):
+        kc = KeyedRollingCounter()
+        for _ in range(10):
+            kc.add('q1', 'node1')
+        for _ in range(5):
+            kc.add('q1', 'node2')
+            kc.add('q2', 'node2')
+        assert kc.max(['q1']) == 'node1'
+        assert kc.max(['q2']) == 'node2'
+        assert kc.max(['q1', 'q2']) == 'node1'
+        kc.add('q2', 'node2')
+        assert kc.max(['q1', 'q2']) == 'node2'
+        assert kc.max(['q3'], 'default') == 'default'
+        assert kc.count('q1', 'node2') == 5
+
+    def test_expiration(self):
+        kc = KeyedRollingCounter(ttl_secs=0.2)
+        kc.add('q1', 'node1')
+        assert kc.max(['q1']) == 'node1'
+        time.sleep(0.3)
+        assert kc.max(['q1']) is None
+
+    def test_bounded(self):
+        kc = KeyedRollingCounter(ttl_secs=0.2, max_keys=2)
+        kc.add('q1', 'node1')
+        time.sleep(0.01)
+        kc.add('q2', 'node1')
+        time.sleep(0.01)
+        kc.add('q1', 'node1')
+        # q2 is the least recently used
+        kc.add('q3', 'node1')
+        assert sorted(kc.keys()) == ['q1', 'q3']
+        # expired counters make room before anything else is dropped
+        time.sleep(0.3)
+        kc.add('q4', 'node1')
+        kc.add('q5', 'node1')
+        assert sorted(kc.keys()) == ['q4', 'q5']
+        assert len(kc) == 2
+
+    def test_threads(self):
+        kc = KeyedRollingCounter(max_keys=4)
+        errors = []
+
+        def add(key):
+            try:
+                for _ in range(2000):
+                    kc.add(key, 'node1')
+            except Exception as e:
+                errors.append(e)
+
+        def read():
+            try:
+                for _ in range(500):
+                    kc.max(['q1', 'q2', 'q3'])
+                    kc.keys()
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=add, args=(k,))
+                   for k in ['q1', 'q2'] * 4]
+        threads.append(threading.Thread(target=read))
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        assert not errors
+        assert kc.count('q1', 'node1') == 8000
+        assert kc.count('q2', 'node1') == 8000
@@ -0,0 +1,50 @@
+# Copyright 2015 Ryan Brown <sb@ryansb.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import pytest
+
+from disq.rolling_counter import (ExactRollingCounter, RollingCounter,
+                                  ShardedRollingCounter)
+
+NODES = ['node{0}'.format(i) for i in range(4)]
+
+
+def filled(cls, events):
+    rc = cls(ttl_secs=60)
+    for i in range(events):
+        rc.add(NODES[i % len(NODES)])
+    return rc
+
+
+def add_and_max(rc):
+    # what DisqueAlpha does for every job it fetches and every read command
+    # it routes when record_job_origin is on
+    def inner():
+        rc.add(NODES[0])
+        rc.max()
+    return inner
+
+
+@pytest.mark.parametrize('cls', [RollingCounter, ExactRollingCounter,
+                                 ShardedRollingCounter])
+@pytest.mark.parametrize('events', [100, 10000])
+def test_add_and_max_bench(cls, events, benchmark):
+    benchmark(add_and_max(filled(cls, events)))
+
+
+@pytest.mark.parametrize('cls', [RollingCounter, ExactRollingCounter,
+                                 ShardedRollingCounter])
+def test_add_bench(cls, benchmark):
+    rc = cls(ttl_secs=60)
+    benchmark(rc.add, NODES[0])
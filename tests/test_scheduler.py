@@ -0,0 +1,94 @@
+# Copyright 2015 Ryan Brown <sb@ryansb.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import time
+
+import pytest
+
+from disq.scheduler import DeficitRoundRobin
+from disq.worker import Worker
+
+
+def _serve(scheduler, rounds, count):
+    "Simulate queues that always have jobs"
+    for _ in range(rounds):
+        for queue, n in scheduler.plan(count):
+            scheduler.record(queue, n, n)
+    return scheduler.fetched
+
+
+def test_weights():
+    fetched = _serve(DeficitRoundRobin({'a': 3, 'b': 1}), 100, 8)
+    assert fetched == {'a': 600, 'b': 200}
+
+
+def test_small_shares_add_up():
+    # 'b' gets less than a job per batch, but isn't starved
+    fetched = _serve(DeficitRoundRobin({'a': 20, 'b': 1}), 42, 2)
+    assert 3 <= fetched['b'] <= 5
+    assert fetched['a'] + fetched['b'] == 84
+
+
+def test_idle_queues_dont_bank_credit():
+    scheduler = DeficitRoundRobin(['a', 'b'])
+    for _ in range(10):
+        for queue, n in scheduler.plan(4):
+            # 'b' is empty
+            scheduler.record(queue, n, n if queue == 'a' else 0)
+    assert scheduler.plan(4) == [('a', 2), ('b', 2)]
+
+
+def test_max_delay():
+    scheduler = DeficitRoundRobin({'a': 1000, 'b': 1}, max_delay_secs=0.05)
+    assert [q for q, _ in scheduler.plan(1)] == ['a']
+    time.sleep(0.1)
+    assert [q for q, _ in scheduler.plan(1)] == ['b']
+
+
+def test_bad_weights():
+    with pytest.raises(ValueError):
+        DeficitRoundRobin({'a': 0})
+    with pytest.raises(ValueError):
+        DeficitRoundRobin({})
+
+
+def test_getjobs(dq):
+    dq.addjobs('drrhighq', ['high'] * 20)
+    dq.addjobs('drrlowq', ['low'] * 20)
+    scheduler = DeficitRoundRobin({'drrhighq': 3, 'drrlowq': 1})
+    jobs = scheduler.getjobs(dq, 8, timeout_ms=10)
+    assert sorted(j[2] for j in jobs) == [b'high'] * 6 + [b'low'] * 2
+    dq.ackjob(*[j[1] for j in jobs])
+
+
+def test_getjobs_blocks_when_empty(dq):
+    scheduler = DeficitRoundRobin(['drremptyq', 'drrotherq'])
+    start = time.time()
+    assert scheduler.getjobs(dq, 4, timeout_ms=100) is None
+    assert time.time() - start >= 0.1
+
+
+def test_worker(dq):
+    dq.addjobs('drrworkerq1', ['a'] * 10)
+    dq.addjobs('drrworkerq2', ['b'] * 10)
+    seen = []
+    worker = Worker(dq, None, lambda job: seen.append(job[2]), timeout_ms=10,
+                    scheduler=DeficitRoundRobin(['drrworkerq1',
+                                                 'drrworkerq2']))
+    worker.start()
+    deadline = time.time() + 5
+    while worker.processed < 20 and time.time() < deadline:
+        time.sleep(0.01)
+    worker.stop()
+    assert sorted(seen) == [b'a'] * 10 + [b'b'] * 10
@@ -0,0 +1,150 @@
+# Copyright 2015 Ryan Brown <sb@ryansb.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import time
+
+import pytest
+
+from disq.tuning import FetchController
+from disq.worker import Worker
+
+
+def test_full_batches_grow():
+    c = FetchController(max_count=5, increase=2)
+    assert c.params('q') == (1, 100)
+    for _ in range(10):
+        count, _ = c.params('q')
+        c.observe_batch('q', count, count)
+    assert c.params('q') == (5, 100)
+    assert c.stats()['q']['fill_ratio'] == 1.0
+
+
+def test_empty_batches_back_off():
+    c = FetchController(min_count=2, max_timeout_ms=500)
+    c.observe_batch('q', 2, 2)
+    c.observe_batch('q', 3, 3)
+    c.observe_batch('q', 4, 4)
+    assert c.params('q') == (5, 100)
+    c.observe_batch('q', 5, 0)
+    assert c.params('q') == (2, 200)
+    for _ in range(5):
+        c.observe_batch('q', 2, 0)
+    assert c.params('q') == (2, 500)
+    # jobs coming back reset the timeout
+    c.observe_batch('q', 2, 2)
+    assert c.params('q') == (3, 100)
+
+
+def test_partial_batches_shrink():
+    c = FetchController()
+    for n in range(1, 11):
+        c.observe_batch('q', n, n)
+    assert c.params('q')[0] == 11
+    c.observe_batch('q', 11, 3)
+    assert c.params('q')[0] == 7
+    # a full batch that was capped below COUNT doesn't grow it
+    c.observe_batch('q', 5, 5)
+    assert c.params('q')[0] == 7
+
+
+def test_retry_window():
+    c = FetchController(max_count=100, workers=2, retry_secs=10)
+    for n in range(1, 50):
+        c.observe_batch('q', n, n)
+    assert c.params('q')[0] == 50
+    # 1s per job on 2 workers: only 10 jobs fit in half of 10s
+    c.observe_handler('q', 1.0)
+    assert c.params('q')[0] == 10
+    c.observe_batch('q', 10, 10)
+    assert c.params('q')[0] == 10
+    assert c.stats()['q']['handler_secs'] == 1.0
+
+
+def test_bad_settings():
+    with pytest.raises(ValueError):
+        FetchController(min_count=10, max_count=5)
+    with pytest.raises(ValueError):
+        FetchController(decrease=1)
+
+
+def test_getjobs(dq):
+    qname = 'tunedq'
+    dq.addjobs(qname, ['body'] * 5)
+    c = FetchController(min_timeout_ms=10)
+    assert len(c.getjobs(dq, qname)) == 1
+    assert len(c.getjobs(dq, qname)) == 2
+    assert len(c.getjobs(dq, qname, limit=1)) == 1
+    assert len(c.getjobs(dq, qname)) == 1
+    assert c.getjobs(dq, qname) is None
+    assert c.params(qname) == (1, 20)
+    assert c.stats()[qname]['jobs'] == 5
+
+
+def test_worker(dq):
+    qname = 'tunedworkerq'
+    dq.addjobs(qname, ['body'] * 30)
+    controller = FetchController(min_timeout_ms=10, workers=4)
+    worker = Worker(dq, qname, lambda job: None, max_workers=4,
+                    fetch_controller=controller)
+    worker.start()
+    deadline = time.time() + 5
+    while worker.processed < 30 and time.time() < deadline:
+        time.sleep(0.01)
+    worker.stop()
+    assert worker.processed == 30
+    stats = controller.stats()[qname]
+    assert stats['jobs'] == 30
+    assert stats['handler_secs'] is not None
+
+
+def test_worker_times_handler_only(dq):
+    qname = 'tunedworkerwaitq'
+    dq.addjobs(qname, ['body'] * 10)
+    controller = FetchController(min_count=10, max_count=10)
+    # ten jobs are fetched at once for a single thread, so most of them
+    # wait in the executor's queue first, which isn't handler time
+    worker = Worker(dq, qname, lambda job: time.sleep(0.05), max_workers=1,
+                    max_in_flight=10, fetch_controller=controller)
+    worker.start()
+    deadline = time.time() + 5
+    while worker.processed < 10 and time.time() < deadline:
+        time.sleep(0.01)
+    worker.stop()
+    assert worker.processed == 10
+    assert controller.stats()[qname]['handler_secs'] < 0.1
+
+
+def test_worker_batches_arent_capped_by_batch_size(dq):
+    qname = 'tunedworkerbigq'
+    dq.addjobs(qname, ['body'] * 300)
+    controller = FetchController(max_count=100, workers=4)
+    counts = []
+    getjobs = dq.getjobs
+
+    def recording_getjobs(queue, **kwargs):
+        counts.append(kwargs['count'])
+        return getjobs(queue, **kwargs)
+    dq.getjobs = recording_getjobs
+    worker = Worker(dq, qname, lambda job: None, max_workers=4,
+                    max_in_flight=50, fetch_controller=controller)
+    worker.start()
+    deadline = time.time() + 5
+    while worker.processed < 300 and time.time() < deadline:
+        time.sleep(0.01)
+    worker.stop()
+    del dq.getjobs
+    assert worker.processed == 300
+    assert max(counts) > 4
+    # COUNT only grows past what was actually asked for by one step
+    assert controller.stats()[qname]['count'] <= max(counts) + 1
@@ -0,0 +1,139 @@
+# Copyright 2015 Ryan Brown <sb@ryansb.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import threading
+import time
+
+from redis.exceptions import ConnectionError, ResponseError
+
+import disq
+from disq.worker import ProcessWorker, Worker
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.time() + timeout
+    while not condition() and time.time() < deadline:
+        time.sleep(0.01)
+    return condition()
+
+
+def square(job):
+    # runs in a worker process, so it has to be a module-level function
+    n = int(job[2])
+    if n < 0:
+        raise ValueError(n)
+    return n * n
+
+
+class TestWorker(object):
+    def test_handles_and_acks(self, dq):
+        qname = 'workerq'
+        ids = dq.addjobs(qname, ['foo {0}'.format(i) for i in range(50)])
+        seen = []
+        lock = threading.Lock()
+
+        def handler(job):
+            time.sleep(0.01)
+            with lock:
+                seen.append(job[1])
+
+        worker = Worker(dq, qname, handler, max_workers=8, timeout_ms=10)
+        worker.start()
+        assert wait_for(lambda: worker.processed == 50)
+        worker.stop()
+        assert sorted(seen) == sorted(ids)
+        assert worker.in_flight == 0
+        assert not any(dq.show(id) for id in ids)
+
+    def test_failed_jobs_arent_acked(self, dq):
+        qname = 'workerfailq'
+        ids = dq.addjobs(qname, ['foo', 'bar'])
+
+        def handler(job):
+            if job[2] == b'bar':
+                raise ValueError(job)
+
+        worker = Worker(dq, qname, handler, timeout_ms=10)
+        worker.start()
+        assert wait_for(lambda: worker.processed + worker.failed == 2)
+        worker.stop()
+        assert worker.failed == 1
+        assert not dq.show(ids[0])
+        assert dq.show(ids[1])
+
+    def test_undecodable_jobs_arent_handled(self, dq):
+        qname = 'workerdecodeq'
+        ids = dq.addjobs(qname, ['1', '{'])
+        client = disq.Disque(codec='json')
+        seen = []
+        worker = Worker(client, qname, seen.append, timeout_ms=10)
+        worker.start()
+        assert wait_for(lambda: worker.processed + worker.failed == 2)
+        worker.stop()
+        assert worker.failed == 1
+        assert [job[2] for job in seen] == [1]
+        assert not dq.show(ids[0])
+        assert dq.show(ids[1])
+
+    def test_fetch_errors_are_retried(self, dq):
+        qname = 'workerfetcherrorq'
+        dq.addjobs(qname, ['foo', 'bar'])
+        worker = Worker(dq, qname, lambda job: None, timeout_ms=10)
+        fetch = worker.fetch
+        errors = [ConnectionError('down'), ResponseError('ERR oops')]
+
+        def flaky_fetch(count):
+            if errors:
+                raise errors.pop(0)
+            return fetch(count)
+        worker.fetch = flaky_fetch
+        worker.start()
+        assert wait_for(lambda: worker.processed == 2)
+        worker.stop()
+        assert not errors
+
+    def test_bounded_in_flight(self, dq):
+        qname = 'workerboundq'
+        dq.addjobs(qname, ['foo'] * 20)
+        release = threading.Event()
+        worker = Worker(dq, qname, lambda job: release.wait(),
+                        max_workers=2, max_in_flight=5, timeout_ms=10)
+        worker.start()
+        assert wait_for(lambda: worker.in_flight == 5)
+        time.sleep(0.1)
+        assert worker.in_flight == 5
+        assert dq.qlen(qname) == 15
+
+        # stopping drains the jobs that were already fetched
+        worker.stop(wait=False)
+        release.set()
+        worker.stop()
+        assert worker.processed == 5
+        assert worker.in_flight == 0
+
+
+class TestProcessWorker(object):
+    def test_handles_and_acks(self, dq):
+        qname = 'processworkerq'
+        ids = dq.addjobs(qname, [str(i) for i in range(20)] + ['-1'])
+
+        worker = ProcessWorker(dq, qname, square, max_workers=2,
+                               timeout_ms=10)
+        worker.start()
+        assert wait_for(lambda: worker.processed + worker.failed == 21)
+        worker.stop()
+        assert worker.processed == 20
+        assert worker.failed == 1
+        assert not any(dq.show(id) for id in ids[:20])
+        assert dq.show(ids[20])